@@ -0,0 +1,226 @@
+'''Benchmarks the Model and GUI hot paths on synthetic databases.
+
+    python bench.py --sizes 1000 10000 --output results.json
+
+The GUI benchmarks need a display, run them headless with e.g.
+`xvfb-run python bench.py`; without one they are reported as skipped.'''
+from __future__ import annotations
+import argparse
+import json
+import os
+from pathlib import Path
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from duo2anki.model import Model, ModelDict
+from duo2anki.storage import open_storage
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+BACKENDS = ('json', 'journal', 'sqlite')
+SYLLABLES = ('ka', 'be', 'lo', 'ver', 'ste', 'gen', 'mo', 'ri', 'dam', 'pel', 'schu', 'tro', 'wij', 'naa', 'hui', 'zen', 'ui', 'oe')
+ENDINGS = ('', 'en', 't', 'e', 'je', 'te', 's')
+FILTERS = ('', 'k', 'ka', 'kabe', 'zen')
+OPS = 20    # operations per run of the single-operation benchmarks
+
+
+def make_words(count: int, rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 5))) + rng.choice(ENDINGS))
+    return sorted(words)
+
+
+def make_model(size: int, seed: int = 0) -> ModelDict:
+    '''Returns a model with `size` Duolingo words, a third as many cards and half
+    of the words linked to them.'''
+    rng = random.Random(seed)
+    duo_words = make_words(size, rng)
+    cards = {f'{i:032x}': (word, rng.choice(('', 'translation'))) for i, word in enumerate(rng.sample(duo_words, max(size // 3, 1)))}
+    keys = list(cards)
+    return {
+        'info': {'name': f'bench-{size}', 'lang': 'nl'},
+        'duo': {word: (rng.choice(keys) if rng.random() < 0.5 else None) for word in duo_words},
+        'anki': cards,
+        'stamps': {key: float(i) for i, key in enumerate(keys)},
+        'exported': float(len(keys) // 2),
+    }
+
+
+def make_export(data: ModelDict, seed: int = 0) -> str:
+    '''Returns a Duolingo export with half of the model's words and as many new ones.'''
+    rng = random.Random(seed + 1)
+    known = [word for word in data['duo'] if rng.random() < 0.5]
+    new = [word + 'x' for word in known]
+    vocab = [{'word_string': word, 'strength_bars': 4} for word in known + new]
+    return json.dumps({'language_string': 'Dutch', 'vocab_overview': vocab})
+
+
+class Bench:
+
+    def __init__(self, repeat: int):
+        self._repeat = repeat
+        self.results: List[Dict[str, Any]] = []
+
+    def measure(self, name: str, size: int, backend: str, run: Callable[[], Any], setup: Optional[Callable[[], None]] = None, ops: int = 1):
+        '''Times `run` `repeat` times, calling `setup` untimed before each run.'''
+        times = []
+        for _ in range(self._repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            run()
+            times.append((time.perf_counter() - start) / ops)
+        self.results.append({
+            'name': name, 'size': size, 'backend': backend,
+            'min': min(times), 'median': statistics.median(times), 'runs': len(times), 'ops': ops,
+        })
+        print(f'{name:<48} {backend:<8} {size:>9} {min(times) * 1000:>11.3f} ms')
+
+    def skip(self, name: str, size: int, backend: str, reason: str):
+        self.results.append({'name': name, 'size': size, 'backend': backend, 'skipped': reason})
+        print(f'{name:<48} {backend:<8} {size:>9}     skipped ({reason})')
+
+
+def bench_model(bench: Bench, size: int, backend: str, data: ModelDict, workdir: Path):
+    suffix = '.sqlite' if backend == 'sqlite' else '.json'
+    journal = backend == 'journal'
+    template = workdir / f'template{suffix}'
+    storage = open_storage(template)
+    storage.create(data)
+    storage.close()
+    file = workdir / f'db{suffix}'
+
+    def reset():
+        for path in workdir.glob('db*'):
+            path.unlink()
+        shutil.copyfile(template, file)
+
+    def open_model() -> Model:
+        return Model(str(file), journal=journal)
+
+    reset()
+    bench.measure('Model.__init__', size, backend, lambda: Model(str(file), journal=journal, cache=False).close())
+    if backend != 'sqlite':
+        open_model().close()    # writes the cache
+        bench.measure('Model.__init__(cached)', size, backend, lambda: open_model().close())
+
+    model = open_model()
+    searches = [(f'get_duo_words({filter!r})', lambda filter=filter: model.get_duo_words(filter)) for filter in FILTERS]
+    searches += [(f'get_anki_words({filter!r})', lambda filter=filter: model.get_anki_words(filter)) for filter in FILTERS]
+    searches.append(('get_duo_words(unassigned_only)', lambda: model.get_duo_words('ka', unassigned_only=True)))
+    searches.append(('get_anki_words(no_translation_only)', lambda: model.get_anki_words('ka', no_translation_only=True)))
+    # searches are memoized until the model changes: the plain runs search,
+    # the memoized ones repeat a search already made
+    for name, search in searches:
+        bench.measure(name, size, backend, search, model.clear_queries)
+        bench.measure(f'{name}(memoized)', size, backend, search, search)
+
+    rng = random.Random(size)
+    duo_words = list(data['duo'])
+    anki_words = [anki_word for anki_word, _ in data['anki'].values()]
+    bench.measure('link_duo_word_to_anki_word', size, backend,
+        lambda: [model.link_duo_word_to_anki_word(rng.choice(duo_words), rng.choice(anki_words)) for _ in range(OPS)], ops=OPS)
+    keys = list(data['anki'])
+    rng.shuffle(keys)
+    bench.measure('delete_anki_entry', size, backend,
+        lambda: [model.delete_anki_entry(keys.pop()) for _ in range(OPS)], ops=OPS)
+    model.close()
+
+    export = make_export(data)
+    export_file = workdir / 'export.json'
+    export_file.write_text(export)
+    models: List[Model] = []
+
+    def fresh_model():
+        for m in models:
+            m.close()
+        models.clear()
+        reset()
+        models.append(open_model())
+
+    bench.measure('update_duo_new_words_from_file', size, backend, lambda: models[0].update_duo_new_words_from_file(str(export_file)), fresh_model)
+    bench.measure('update_duo_new_words_from_str', size, backend, lambda: models[0].update_duo_new_words_from_str(export), fresh_model)
+    csv_file = workdir / 'export.csv'
+    bench.measure('export_anki_csv', size, backend, lambda: models[0].export_anki_csv(str(csv_file)), fresh_model)
+    bench.measure('export_anki_csv(delta)', size, backend, lambda: models[0].export_anki_csv(str(csv_file), delta=True), fresh_model)
+    for m in models:
+        m.close()
+
+
+def bench_gui(bench: Bench, size: int, data: ModelDict, workdir: Path):
+    import tkinter as tk
+    names = ('DuoWordsGui.refresh', 'AnkiWordsGui.refresh')
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        for name in names:
+            bench.skip(name, size, 'json', 'no display')
+        return
+    from duo2anki.gui import AnkiWordsGui, DuoWordsGui
+
+    file = workdir / 'gui.json'
+    open_storage(file).create(data)
+    model = Model(str(file))
+    try:
+        for name, panel in zip(names, (DuoWordsGui(root), AnkiWordsGui(root))):
+            panel.pack()
+            root.update()
+
+            def refresh():
+                panel.refresh(model)
+                root.update()
+            bench.measure(name, size, 'json', refresh)
+    finally:
+        model.close()
+        root.destroy()
+
+
+def version() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of Duolingo words')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the fastest counts')
+    parser.add_argument('--no-gui', action='store_true', help='skip the GUI benchmarks')
+    parser.add_argument('--output', help='file to write the results to as JSON')
+    args = parser.parse_args()
+
+    bench = Bench(args.repeat)
+    for size in args.sizes:
+        data = make_model(size)
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as workdir:
+                bench_model(bench, size, backend, data, Path(workdir))
+        if not args.no_gui:
+            with tempfile.TemporaryDirectory() as workdir:
+                bench_gui(bench, size, data, Path(workdir))
+
+    report = {
+        'version': version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'results': bench.results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import sys
+
+from duo2anki.cli import main
+
+sys.exit(main())
@@ -0,0 +1,179 @@
+'''Writes cards as an Anki package (.apkg), which Anki imports directly.
+
+A package is a zip holding an Anki collection, an SQLite database in the
+legacy schema 11 that all Anki versions import. The notes get GUIDs derived
+from the keys of the cards, and the note type and deck ids derived from their
+names, so importing a newer package updates the notes of an older one in place
+instead of duplicating them.'''
+from __future__ import annotations
+import hashlib
+import html
+import json
+import os
+import sqlite3
+import string
+import time
+from typing import Iterable, List, NamedTuple, Set
+import zipfile
+
+from duo2anki.instrument import timed
+
+
+class Note(NamedTuple):
+    key:            str         # key of the card, the GUID of the note is derived from it
+    word:           str
+    translation:    str
+    tags:           List[str]
+    stamp:          float       # time of the last change, Anki keeps the newer of two versions
+
+
+NOTE_TYPE = 'duo2anki Basic'
+
+SCHEMA = '''
+    CREATE TABLE col (id INTEGER PRIMARY KEY, crt INTEGER NOT NULL, mod INTEGER NOT NULL, scm INTEGER NOT NULL, ver INTEGER NOT NULL,
+        dty INTEGER NOT NULL, usn INTEGER NOT NULL, ls INTEGER NOT NULL, conf TEXT NOT NULL, models TEXT NOT NULL, decks TEXT NOT NULL,
+        dconf TEXT NOT NULL, tags TEXT NOT NULL);
+    CREATE TABLE notes (id INTEGER PRIMARY KEY, guid TEXT NOT NULL, mid INTEGER NOT NULL, mod INTEGER NOT NULL, usn INTEGER NOT NULL,
+        tags TEXT NOT NULL, flds TEXT NOT NULL, sfld INTEGER NOT NULL, csum INTEGER NOT NULL, flags INTEGER NOT NULL, data TEXT NOT NULL);
+    CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER NOT NULL, did INTEGER NOT NULL, ord INTEGER NOT NULL, mod INTEGER NOT NULL,
+        usn INTEGER NOT NULL, type INTEGER NOT NULL, queue INTEGER NOT NULL, due INTEGER NOT NULL, ivl INTEGER NOT NULL,
+        factor INTEGER NOT NULL, reps INTEGER NOT NULL, lapses INTEGER NOT NULL, left INTEGER NOT NULL, odue INTEGER NOT NULL,
+        odid INTEGER NOT NULL, flags INTEGER NOT NULL, data TEXT NOT NULL);
+    CREATE TABLE revlog (id INTEGER PRIMARY KEY, cid INTEGER NOT NULL, usn INTEGER NOT NULL, ease INTEGER NOT NULL, ivl INTEGER NOT NULL,
+        lastIvl INTEGER NOT NULL, factor INTEGER NOT NULL, time INTEGER NOT NULL, type INTEGER NOT NULL);
+    CREATE TABLE graves (usn INTEGER NOT NULL, oid INTEGER NOT NULL, type INTEGER NOT NULL);
+'''
+
+INDEXES = '''
+    CREATE INDEX ix_notes_usn ON notes (usn);
+    CREATE INDEX ix_cards_usn ON cards (usn);
+    CREATE INDEX ix_revlog_usn ON revlog (usn);
+    CREATE INDEX ix_cards_nid ON cards (nid);
+    CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+    CREATE INDEX ix_revlog_cid ON revlog (cid);
+    CREATE INDEX ix_notes_csum ON notes (csum);
+'''
+
+_BASE91 = string.ascii_letters + string.digits + "!#$%&()*+,-./:;<=>?@[]^_`{|}~"
+_BASE91_PAIRS = [high + low for high in _BASE91 for low in _BASE91]
+_ID_MASK = (1 << 52) - 1    # ids stay exact as JavaScript numbers, which Anki relies on
+
+
+def _key_bits(key: str) -> int:
+    '''Returns the 128 bits of a card key, a UUID, or of a hash of other keys.'''
+    digits = key.replace('-', '')
+    if len(digits) == 32:
+        try:
+            return int(digits, 16)  # as uuid.UUID(key).int, without its overhead
+        except ValueError:
+            pass
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest(), 'big')
+
+
+def _guid(bits: int) -> str:
+    '''Encodes 64 bits in the base 91 digits of the GUIDs Anki makes, two digits
+    at a time, always 10 digits long.'''
+    bits &= (1 << 64) - 1
+    pairs = []
+    for _ in range(5):
+        bits, pair = divmod(bits, len(_BASE91_PAIRS))
+        pairs.append(_BASE91_PAIRS[pair])
+    return ''.join(reversed(pairs))
+
+
+def _note_guid(key: str) -> str:
+    '''Returns the GUID of the note of a card, from the first 64 bits of a hash
+    of its whole key: the bits of a UUID are not all random, its version and
+    variant are fixed.'''
+    return _guid(int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'big'))
+
+
+def _stable_id(name: str) -> int:
+    return _key_bits(name) & _ID_MASK or 1
+
+
+def _checksum(field: str) -> int:
+    '''The checksum Anki keeps of the first field to find duplicates.'''
+    return int(hashlib.sha1(field.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _anki_tag(tag: str) -> str:
+    return '_'.join(tag.split())    # Anki separates tags by spaces
+
+
+def _collection(deck_name: str, deck_id: int, model_id: int, now: int) -> tuple:
+    '''Returns the row of the `col` table: the configuration, the note type and the deck.'''
+    conf = {'nextPos': 1, 'estTimes': True, 'activeDecks': [1], 'sortType': 'noteFld', 'timeLim': 0, 'sortBackwards': False,
+        'addToCur': True, 'curDeck': 1, 'newBury': True, 'newSpread': 0, 'dueCounts': True, 'curModel': str(model_id), 'collapseTime': 1200}
+    model = {
+        'id': model_id, 'name': NOTE_TYPE, 'type': 0, 'mod': now, 'usn': -1, 'sortf': 0, 'did': deck_id, 'tags': [], 'vers': [],
+        'flds': [{'name': name, 'ord': ord, 'sticky': False, 'rtl': False, 'font': 'Arial', 'size': 20, 'media': []}
+            for ord, name in enumerate(('Front', 'Back'))],
+        'tmpls': [{'name': 'Card 1', 'ord': 0, 'qfmt': '{{Front}}', 'afmt': '{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}',
+            'did': None, 'bqfmt': '', 'bafmt': ''}],
+        'css': '.card {\n font-family: arial;\n font-size: 20px;\n text-align: center;\n color: black;\n background-color: white;\n}\n',
+        'latexPre': '\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage[utf8]{inputenc}\n'
+            '\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n',
+        'latexPost': '\\end{document}', 'latexsvg': False, 'req': [[0, 'any', [0]]],
+    }
+
+    def deck(id: int, name: str) -> dict:
+        return {'id': id, 'name': name, 'mod': now, 'usn': -1, 'desc': '', 'dyn': 0, 'conf': 1, 'collapsed': False, 'browserCollapsed': False,
+            'extendNew': 10, 'extendRev': 50, 'lrnToday': [0, 0], 'revToday': [0, 0], 'newToday': [0, 0], 'timeToday': [0, 0]}
+    dconf = {'id': 1, 'name': 'Default', 'mod': 0, 'usn': 0, 'maxTaken': 60, 'autoplay': True, 'timer': 0, 'replayq': True, 'dyn': False,
+        'new': {'bury': True, 'delays': [1, 10], 'initialFactor': 2500, 'ints': [1, 4, 7], 'order': 1, 'perDay': 20, 'separate': True},
+        'lapse': {'delays': [10], 'leechAction': 0, 'leechFails': 8, 'minInt': 1, 'mult': 0},
+        'rev': {'bury': True, 'ease4': 1.3, 'fuzz': 0.05, 'ivlFct': 1, 'maxIvl': 36500, 'minSpace': 1, 'perDay': 100}}
+    decks = {'1': deck(1, 'Default'), str(deck_id): deck(deck_id, deck_name)}
+    return (1, now, now * 1000, now * 1000, 11, 0, 0, 0,
+        json.dumps(conf), json.dumps({str(model_id): model}), json.dumps(decks), json.dumps({'1': dconf}), '{}')
+
+
+@timed
+def write_apkg(file: str, deck_name: str, notes: Iterable[Note]) -> int:
+    '''Writes the notes as a package with a deck of the given name and returns
+    the number of notes written. The collection is built next to the package
+    with bulk inserts and removed once zipped.'''
+    now = int(time.time())
+    deck_id, model_id = _stable_id(f'deck {deck_name}'), _stable_id(f'note type {NOTE_TYPE}')
+    note_rows, card_rows = [], []
+    note_ids: Set[int] = set()
+    for due, note in enumerate(notes, 1):
+        bits = _key_bits(note.key)
+        note_id = (bits >> 64) & _ID_MASK
+        while not note_id or note_id in note_ids:   # ids only need to be unique within the package
+            note_id = (note_id + 1) & _ID_MASK
+        note_ids.add(note_id)
+        tags = f" {' '.join(_anki_tag(tag) for tag in note.tags)} " if note.tags else ''
+        mod = int(note.stamp)
+        note_rows.append((note_id, _note_guid(note.key), model_id, mod, -1, tags, f'{html.escape(note.word, False)}\x1f{html.escape(note.translation, False)}',
+            note.word, _checksum(note.word), 0, ''))
+        card_rows.append((note_id, note_id, deck_id, 0, mod, -1, 0, 0, due, 0, 0, 0, 0, 0, 0, 0, 0, ''))
+
+    collection = f'{file}.anki2'
+    if os.path.exists(collection):
+        os.remove(collection)
+    try:
+        db = sqlite3.connect(collection)
+        try:
+            db.execute('PRAGMA journal_mode = OFF')     # a scratch file, built in one go
+            db.execute('PRAGMA synchronous = OFF')
+            db.executescript(SCHEMA)
+            # rows in id order are appended to the tables, and indexes built
+            # once filled are built in one sort instead of row by row
+            note_rows.sort()
+            card_rows.sort()
+            with db:
+                db.execute('INSERT INTO col VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', _collection(deck_name, deck_id, model_id, now))
+                db.executemany('INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)', note_rows)
+                db.executemany('INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', card_rows)
+            db.executescript(INDEXES)
+        finally:
+            db.close()
+        with zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as package:    # the fastest level, the text compresses well anyway
+            package.write(collection, 'collection.anki2')
+            package.writestr('media', '{}')
+    finally:
+        if os.path.exists(collection):
+            os.remove(collection)
+    return len(note_rows)
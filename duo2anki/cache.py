@@ -0,0 +1,71 @@
+'''Sidecar cache of a model's in-memory state, so that large JSON databases
+open without parsing and checking the JSON.
+
+The cache is a file next to the database holding the state as plain values
+(see Model._cached_state()) in the marshal format, which unlike pickle can't
+run code when read, so a tampered cache is only ever wrong data. A header
+tags it with the version of the snapshot it was built from (see
+Storage.version()) and is checked before the state is read. A cache whose
+version doesn't match, or that can't be read, is ignored and rebuilt.'''
+from __future__ import annotations
+import gc
+import marshal
+import os
+from pathlib import Path
+import struct
+from typing import Any, Hashable, Optional
+
+from duo2anki.instrument import timed
+
+MAGIC = b'duo2anki-cache\n'
+FORMAT = 4  # bump whenever the layout of the cached state changes
+HEADER_SIZE = struct.Struct('<I')   # precedes the header, so that it is read without the state
+
+
+def cache_file(file: Path) -> Path:
+    return file.with_name(f'{file.name}.cache')
+
+
+@timed
+def load_cache(file: Path, version: Hashable) -> Optional[Any]:
+    '''Returns the state cached for the given snapshot version, None if there is
+    no valid cache.'''
+    try:
+        with open(file, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            size, = HEADER_SIZE.unpack(f.read(HEADER_SIZE.size))
+            if marshal.loads(f.read(size)) != (FORMAT, version):
+                return None
+            data = f.read()
+        # the state is millions of small objects that can't form cycles,
+        # collecting while they are created only slows reading down
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return marshal.loads(data)
+        finally:
+            if enabled:
+                gc.enable()
+    except (OSError, ValueError, EOFError, TypeError, struct.error):
+        return None
+
+
+@timed
+def save_cache(file: Path, version: Hashable, state: Any):
+    '''Writes the state of the given snapshot version. The cache is only an
+    optimisation, so failing to write it is not an error.'''
+    tmp_file = file.with_name(f'{file.name}.tmp')
+    header = marshal.dumps((FORMAT, version))
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(MAGIC)
+            f.write(HEADER_SIZE.pack(len(header)))
+            f.write(header)
+            f.write(marshal.dumps(state))
+        os.replace(tmp_file, file)
+    except (OSError, ValueError):
+        try:
+            tmp_file.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,231 @@
+'''Command line interface of duo2anki, run with `python -m duo2anki`.
+
+Only the GUI needs tkinter, it is imported when the GUI is started, so the
+other commands also work without a display.'''
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+import sys
+from typing import Dict, List, Optional
+
+from duo2anki import instrument
+from duo2anki.model import Model
+from duo2anki.workspace import Workspace
+
+
+def cmd_gui(args: argparse.Namespace) -> int:
+    import tkinter
+    import duo2anki.gui
+    try:
+        duo2anki.gui.main(args.database)
+    except tkinter.TclError as e:
+        raise Model.ModelError(f'Could not start the GUI: {e}')
+    return 0
+
+
+def cmd_create(args: argparse.Namespace) -> int:
+    if os.path.exists(args.database):
+        raise Model.ModelError(f"'{args.database}' already exists")
+    model = Model(args.database, journal=args.journal)
+    try:
+        model.update_model_info({'name': args.name or os.path.splitext(os.path.basename(args.database))[0], 'lang': args.lang})
+    finally:
+        model.close()
+    return 0
+
+
+def cmd_import(args: argparse.Namespace) -> int:
+    model = open_model(args)
+    try:
+        if args.export == '-':
+            report = model.import_duo_words(sys.stdin)
+        else:
+            report = model.update_duo_new_words_from_file(args.export)
+    finally:
+        model.close()
+    print(f'{len(report.added)} added, {len(report.known)} known, {len(report.missing)} not in the export')
+    if args.verbose:
+        for word in report.added:
+            print(f'+ {word}')
+    return 0
+
+
+def cmd_link(args: argparse.Namespace) -> int:
+    '''Links the Duolingo words of a CSV file with rows `duo word;anki word`.'''
+    model = open_model(args)
+    try:
+        links: Dict[str, List[str]] = {}
+        unknown = 0
+        with open(args.mapping, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f, delimiter=args.delimiter):
+                if not row:
+                    continue
+                if len(row) != 2:
+                    raise Model.ModelError(f'Expected a Duolingo and an Anki word, got {row}')
+                duo_word, anki_word = row
+                if not model.has_duo_word(duo_word):
+                    print(f"unknown Duolingo word '{duo_word}'", file=sys.stderr)
+                    unknown += 1
+                    continue
+                links.setdefault(anki_word, []).append(duo_word)
+        with model.batch():
+            for anki_word, duo_words in links.items():
+                model.link_many(duo_words, anki_word)
+    finally:
+        model.close()
+    print(f'{sum(map(len, links.values()))} words linked to {len(links)} cards, {unknown} unknown')
+    return 0
+
+
+def cmd_stats(args: argparse.Namespace) -> int:
+    model = open_model(args)
+    try:
+        summary = model.summary()
+        info = model.info
+    finally:
+        model.close()
+    if args.json:
+        print(json.dumps({'info': info, **summary}))
+    else:
+        print(f"{info['name']} ({info['lang']})")
+        for key, value in summary.items():
+            print(f"{key.replace('_', ' '):<24} {value:>9}")
+    return 0
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    model = open_model(args)
+    try:
+        if args.output.lower().endswith('.apkg'):
+            count = model.export_anki_apkg(args.output, delta=args.delta, tags=args.tag or ())
+        else:
+            count = model.export_anki_csv(args.output, delimiter=args.delimiter, encoding=args.encoding, delta=args.delta, tags=args.tag or ())
+    finally:
+        model.close()
+    print(f'{count} cards exported')
+    return 0
+
+
+def cmd_check(args: argparse.Namespace) -> int:
+    model = open_model(args, warn=False)
+    try:
+        report = model.check(repair=args.repair)
+    finally:
+        model.close()
+    for line in report.lines():
+        print(line)
+    if report.ok:
+        print('no problems found')
+        return 0
+    if args.repair:
+        print(f'{len(report.lines())} problems repaired')
+        return 0
+    print(f"{len(report.lines())} problems found, run with --repair to fix them")
+    return 1
+
+
+def cmd_search(args: argparse.Namespace) -> int:
+    '''Searches the words of several databases at once.'''
+    for database in args.databases:
+        if not os.path.exists(database):
+            raise Model.ModelError(f"'{database}' does not exist")
+    workspace = Workspace(max_models=len(args.databases), journal=args.journal)
+    try:
+        for database in args.databases:
+            workspace.open(database)
+        hits = workspace.search(args.filter)
+    finally:
+        workspace.close_all()
+    if args.json:
+        print(json.dumps([hit._asdict() for hit in hits]))
+        return 0
+    for hit in hits:
+        print(f"{hit.name} ({hit.file}): {len(hit.duo_words)} Duolingo words, {len(hit.anki_words)} Anki words")
+        for word in hit.duo_words:
+            print(f'  duo   {word}')
+        for word in hit.anki_words:
+            print(f'  anki  {word}')
+    return 0
+
+
+def open_model(args: argparse.Namespace, warn: bool = True) -> Model:
+    if not os.path.exists(args.database):
+        raise Model.ModelError(f"'{args.database}' does not exist, create it first")
+    model = Model(args.database, journal=args.journal)
+    problems = len(model.integrity().lines())
+    if warn and problems:
+        print(f"duo2anki: warning: {problems} problems found in '{args.database}', run the check command for details", file=sys.stderr)
+    return model
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='duo2anki', description='Groups Duolingo words under Anki cards. Starts the GUI without a command.')
+    parser.add_argument('--journal', action='store_true', help='append the changes of JSON databases to a journal')
+    parser.add_argument('--instrument', action='store_true', help='print timings of the model operations when done')
+    parser.set_defaults(func=cmd_gui, database=None)
+    commands = parser.add_subparsers(title='commands')
+
+    cmd = commands.add_parser('gui', help='start the GUI')
+    cmd.add_argument('database', nargs='?', help='database to open')
+    cmd.set_defaults(func=cmd_gui)
+
+    cmd = commands.add_parser('create', help='create a database, SQLite if named .db/.sqlite, JSON otherwise')
+    cmd.add_argument('database')
+    cmd.add_argument('--lang', required=True, help='language of the Duolingo course, e.g. Dutch')
+    cmd.add_argument('--name', help='name of the database, defaults to the file name')
+    cmd.set_defaults(func=cmd_create)
+
+    cmd = commands.add_parser('import', help='add the new words of a Duolingo vocabulary export')
+    cmd.add_argument('database')
+    cmd.add_argument('export', help="the export as JSON, '-' for stdin")
+    cmd.add_argument('-v', '--verbose', action='store_true', help='list the added words')
+    cmd.set_defaults(func=cmd_import)
+
+    cmd = commands.add_parser('link', help='link Duolingo words to cards from a CSV file of duo word, anki word rows')
+    cmd.add_argument('database')
+    cmd.add_argument('mapping')
+    cmd.add_argument('--delimiter', default=';')
+    cmd.set_defaults(func=cmd_link)
+
+    cmd = commands.add_parser('stats', help='show the numbers of words and cards')
+    cmd.add_argument('database')
+    cmd.add_argument('--json', action='store_true', help='print as JSON')
+    cmd.set_defaults(func=cmd_stats)
+
+    cmd = commands.add_parser('export', help='export the cards as CSV for Anki, or as an Anki package if the output ends in .apkg')
+    cmd.add_argument('database')
+    cmd.add_argument('output')
+    cmd.add_argument('--delta', action='store_true', help='only the cards changed since the last export')
+    cmd.add_argument('--tag', action='append', help='only the cards with this tag, may be repeated')
+    cmd.add_argument('--delimiter', default=';')
+    cmd.add_argument('--encoding', default='utf-8')
+    cmd.set_defaults(func=cmd_export)
+
+    cmd = commands.add_parser('search', help='search the words of several databases')
+    cmd.add_argument('filter')
+    cmd.add_argument('databases', nargs='+', metavar='database')
+    cmd.add_argument('--json', action='store_true', help='print as JSON')
+    cmd.set_defaults(func=cmd_search)
+
+    cmd = commands.add_parser('check', help='check the database for duplicate cards, broken links and malformed entries')
+    cmd.add_argument('database')
+    cmd.add_argument('--repair', action='store_true', help='merge the duplicate cards, unlink the broken links and drop the malformed entries')
+    cmd.set_defaults(func=cmd_check)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parser().parse_args(argv)
+    if args.instrument:
+        instrument.enable()
+    try:
+        return args.func(args)
+    except (OSError, ValueError, KeyError, Model.ModelError) as e:
+        print(f'duo2anki: error: {e}', file=sys.stderr)
+        return 1
+    finally:
+        if args.instrument:
+            print(instrument.report(), file=sys.stderr)
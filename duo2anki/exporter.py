@@ -0,0 +1,37 @@
+from __future__ import annotations
+import csv
+import io
+from typing import Iterable, Iterator, Sequence, TextIO
+
+
+def iter_csv_chunks(rows: Iterable[Sequence[str]], delimiter: str = ';', chunk_rows: int = 1000) -> Iterator[str]:
+    '''Yields the given rows as CSV text, `chunk_rows` rows at a time. Fields
+    containing the delimiter, quotes or newlines are quoted.'''
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=delimiter, lineterminator='\n')
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count == chunk_rows:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            count = 0
+    if count:
+        yield buf.getvalue()
+
+
+def write_csv(f: TextIO, rows: Iterable[Sequence[str]], delimiter: str = ';') -> int:
+    '''Writes the rows as CSV to `f` in chunks and returns the number of rows written.'''
+    count = 0
+
+    def counted() -> Iterator[Sequence[str]]:
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    for chunk in iter_csv_chunks(counted(), delimiter):
+        f.write(chunk)
+    return count
@@ -0,0 +1,216 @@
+from __future__ import annotations
+import re
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+
+class Suggestion(NamedTuple):
+    anki_word:  str             # front side of the card to link the words to
+    duo_words:  Tuple[str, ...] # unassigned Duolingo words
+    score:      float           # 1.0 for words with the same stem as the card, less the more they differ
+    new:        bool            # whether the card has to be created
+
+
+class Rules(NamedTuple):
+    articles:   Tuple[str, ...] # leading words dropped before stemming
+    suffixes:   Tuple[str, ...] # inflection endings, the longest matching one is dropped
+
+
+RULES: Dict[str, Rules] = {
+    'dutch': Rules(
+        ('de', 'het', 'een', "'t"),
+        ('heden', 'tjes', 'eren', 'ende', 'jes', 'tje', 'ste', 'je', 'en', 'er', 'es', 'st', 'te', 'de', 's', 't', 'e', 'd'),
+    ),
+    'german': Rules(
+        ('der', 'die', 'das', 'den', 'dem', 'des', 'ein', 'eine', 'einen', 'einem', 'einer', 'eines'),
+        ('ern', 'est', 'ten', 'em', 'en', 'er', 'es', 'et', 'st', 'te', 'e', 'n', 's', 't'),
+    ),
+    'english': Rules(
+        ('the', 'a', 'an', 'to'),
+        ('ing', 'ies', 'ed', 'es', 'er', 's'),
+    ),
+    'spanish': Rules(
+        ('el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas'),
+        ('iendo', 'amos', 'emos', 'imos', 'ando', 'aron', 'ieron', 'ado', 'ido', 'aba', 'ais', 'eis', 'ian', 'ia',
+         'ar', 'er', 'ir', 'as', 'es', 'os', 'an', 'en', 'a', 'o', 'e', 's'),
+    ),
+    'french': Rules(
+        ('le', 'la', 'les', 'un', 'une', 'des', 'du', "l'"),
+        ('issons', 'aient', 'ions', 'iez', 'ons', 'ais', 'ait', 'ent', 'ees', 'ez', 'er', 'ir', 're', 'es', 'ee', 'e', 's', 'x'),
+    ),
+    'italian': Rules(
+        ('il', 'lo', 'la', 'i', 'gli', 'le', 'un', 'uno', 'una', "l'", "un'"),
+        ('iamo', 'ando', 'endo', 'ano', 'ono', 'are', 'ere', 'ire', 'ato', 'ito', 'uto', 'ate', 'ete', 'ite', 'a', 'e', 'i', 'o'),
+    ),
+    'portuguese': Rules(
+        ('o', 'a', 'os', 'as', 'um', 'uma', 'uns', 'umas'),
+        ('amos', 'emos', 'imos', 'ando', 'endo', 'indo', 'ado', 'ido', 'ar', 'er', 'ir', 'as', 'es', 'os', 'am', 'em', 'a', 'e', 'o', 's'),
+    ),
+}
+
+LANGUAGES = {
+    'nl': 'dutch', 'nederlands': 'dutch',
+    'de': 'german', 'deutsch': 'german',
+    'en': 'english',
+    'es': 'spanish', 'espanol': 'spanish',
+    'fr': 'french', 'francais': 'french',
+    'it': 'italian', 'italiano': 'italian',
+    'pt': 'portuguese', 'portugues': 'portuguese',
+}
+
+NO_RULES = Rules((), ())
+MIN_STEM = 3        # suffixes are only dropped if this many characters remain
+MAX_DISTANCE = 2    # largest edit distance between the stems of grouped words
+
+
+def _fold(text: str) -> str:
+    '''Lowers the text and drops its accents.'''
+    decomposed = unicodedata.normalize('NFD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def rules_for(lang: str) -> Rules:
+    '''Returns the rules of a language given by name or code, e.g. 'Dutch' or 'nl'.'''
+    lang = _fold(lang).strip()
+    articles, suffixes = RULES.get(LANGUAGES.get(lang, lang), NO_RULES)
+    return Rules(articles, tuple(sorted(suffixes, key=len, reverse=True)))
+
+
+def stem(word: str, rules: Rules) -> str:
+    '''Returns the folded word without its article and inflection ending, `rules`
+    as returned by rules_for(). Doubled letters are collapsed, as inflection
+    often doubles or undoubles them (e.g. kat - katten, loop - lopen).'''
+    folded = _fold(word).strip()
+    for article in rules.articles:
+        if article.endswith("'") and folded.startswith(article):
+            folded = folded[len(article):]
+            break
+        if folded.startswith(article + ' '):
+            folded = folded[len(article) + 1:]
+            break
+    for suffix in rules.suffixes:
+        if folded.endswith(suffix) and len(folded) - len(suffix) >= MIN_STEM:
+            folded = folded[:-len(suffix)]
+            break
+    return _DOUBLED.sub(r'\1', folded)
+
+
+_DOUBLED = re.compile(r'(.)\1+')
+
+
+def distance(a: str, b: str, limit: int) -> int:
+    '''Returns the edit distance of `a` and `b`, or `limit + 1` if it is larger than `limit`.
+    Only the band of cells within `limit` of the diagonal is computed.'''
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    previous = {j: j for j in range(min(len(b), limit) + 1)}
+    for i, ca in enumerate(a, 1):
+        current = {}
+        for j in range(max(0, i - limit), min(len(b), i + limit) + 1):
+            if j == 0:
+                current[j] = i
+                continue
+            current[j] = min(previous.get(j, over) + 1, current.get(j - 1, over) + 1, previous.get(j - 1, over) + (ca != b[j - 1]))
+        if min(current.values()) > limit:
+            return over
+        previous = current
+    return min(previous.get(len(b), over), over)
+
+
+def _limit(stem: str) -> int:
+    '''Returns the edit distance tolerated for a stem, so that short words need to match closely.'''
+    if len(stem) <= MIN_STEM:
+        return 0
+    return 1 if len(stem) <= 5 else MAX_DISTANCE
+
+
+def _variants(stem: str) -> Set[str]:
+    '''Returns the stem with up to as many letters deleted as its tolerated edit distance.'''
+    variants = level = {stem}
+    for _ in range(min(_limit(stem), len(stem) - 1)):
+        level = {variant[:i] + variant[i+1:] for variant in level for i in range(len(variant))}
+        variants = variants | level
+    return variants
+
+
+class _StemIndex:
+    '''Finds the words whose stems are within a small edit distance of a stem.
+
+    Stems are indexed by their variants with up to MAX_DISTANCE letters deleted.
+    Two stems within edit distance d share a variant with at most d deletions,
+    so a lookup only compares the stem against the few words sharing one of its
+    variants instead of all words.'''
+
+    def __init__(self):
+        self._by_stem: Dict[str, List[str]] = {}
+        self._variants: Dict[str, Set[str]] = {}
+
+    def add(self, word: str, word_stem: str, variants: Optional[Set[str]] = None):
+        if word_stem not in self._by_stem:
+            self._by_stem[word_stem] = []
+            for variant in variants or _variants(word_stem):
+                self._variants.setdefault(variant, set()).add(word_stem)
+        self._by_stem[word_stem].append(word)
+
+    def words(self, word_stem: str) -> List[str]:
+        return self._by_stem[word_stem]
+
+    def groups(self) -> List[List[str]]:
+        '''Returns the words grouped by stem.'''
+        return list(self._by_stem.values())
+
+    def closest(self, word_stem: str, variants: Set[str]) -> Optional[Tuple[str, int]]:
+        '''Returns the closest stem and its distance, preferring short stems on ties.
+        `variants` are the variants of the stem as returned by _variants().'''
+        if word_stem in self._by_stem:
+            return word_stem, 0
+        limit = _limit(word_stem)
+        candidates: Set[str] = set()
+        for variant in variants:
+            candidates.update(self._variants.get(variant, ()))
+        best: Optional[Tuple[int, int, str]] = None
+        for other in candidates:
+            tolerated = max(limit, _limit(other))   # that of the longer stem
+            if best is not None:
+                tolerated = min(tolerated, best[0])
+            d = distance(word_stem, other, tolerated)
+            if d <= tolerated and (best is None or (d, len(other), other) < best):
+                best = (d, len(other), other)
+        return None if best is None else (best[2], best[0])
+
+
+def suggest_links(duo_words: Sequence[str], anki_words: Sequence[str], lang: str) -> List[Suggestion]:
+    '''Suggests cards for unassigned Duolingo words, best first.
+
+    Words are linked to the existing card with the same or a close stem. Words
+    left over that share a stem are grouped under a new card named after the
+    shortest of them.'''
+    rules = rules_for(lang)
+    cards = _StemIndex()
+    for anki_word in anki_words:
+        cards.add(anki_word, stem(anki_word, rules))
+    groups = _StemIndex()   # of the words without a card
+    linked: Dict[str, List[str]] = {}
+    scores: Dict[str, float] = {}
+
+    for duo_word in duo_words:
+        word_stem = stem(duo_word, rules)
+        variants = _variants(word_stem)
+        match = cards.closest(word_stem, variants)
+        if match is None:
+            match = groups.closest(word_stem, variants)
+            groups.add(duo_word, match[0] if match else word_stem, variants)
+            continue
+        card_stem, d = match
+        anki_word = min(cards.words(card_stem), key=lambda w: (len(w), w))
+        linked.setdefault(anki_word, []).append(duo_word)
+        scores[anki_word] = min(scores.get(anki_word, 1.0), 1.0 - d / max(len(word_stem), 1))
+
+    suggestions = [Suggestion(anki_word, tuple(words), scores[anki_word], False) for anki_word, words in linked.items()]
+    for words in groups.groups():
+        if len(words) > 1:
+            anki_word = min(words, key=lambda w: (len(w), w))
+            suggestions.append(Suggestion(anki_word, tuple(words), 0.5, True))
+    suggestions.sort(key=lambda s: (-s.score, -len(s.duo_words), s.anki_word))
+    return suggestions
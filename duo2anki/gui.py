@@ -1,25 +1,399 @@
 from io import StringIO
 import os
+import threading
+import time
 import tkinter as tk
 import tkinter.dnd as dnd
 import tkinter.ttk as ttk
 import tkinter.messagebox as messagebox
 import tkinter.filedialog as filedialog
-from typing import Dict, List, Optional, Tuple
+import tkinter.font as tkfont
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
-from duo2anki.model import Model, ModelInfo, ModelDict
+from duo2anki import instrument
+from duo2anki.grouping import Suggestion
+from duo2anki.jobs import Job, JobRunner
+from duo2anki.model import IntegrityReport, Model, ModelDict, ModelEvent, ModelInfo
+from duo2anki.scheduler import SearchScheduler
+from duo2anki.search import match_rank
+from duo2anki.workspace import Workspace, WorkspaceHit
 
 PBIG, PSMALL = 5, 2     # padding constants
+WRITE_DELAY = 0.5       # seconds to coalesce database writes over
+SEARCH_DELAY = 0.15     # seconds of no typing before the filter is searched
+RELOAD_DELAY = 2.0      # seconds between checks for changes made by other processes
+PROGRESS_DELAY = 0.3    # seconds a job runs before its progress is shown
+WORKSPACE_HITS = 200    # words of each kind listed per database by the workspace search
+TAGS = ('noun', 'verb', 'adjective')    # tags offered for the cards
 
 NI = lambda: messagebox.showerror('Error:', 'This feature is not yet implemented!')
 
 
-class DuoWordsGui(tk.Frame):
+class VirtualList(tk.Frame):
+    '''A scrollable list that only puts the visible rows (plus a small margin) into
+    its listbox, so the cost of showing it doesn't grow with the number of items.
+
+    Selection and keyboard navigation are handled on the items, not on the listbox
+    rows, so they keep working across scrolls. Row colours are computed by the
+    `colour` callback only for the rows shown. Selection changes are announced
+    with a <<ListboxSelect>> event on the VirtualList itself.'''
+
+    MARGIN = 2  # rows rendered beyond the visible ones
+
+    def __init__(self, *args, selectmode: str = tk.BROWSE, colour: Optional[Callable[[str], Optional[str]]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._selectmode = selectmode
+        self._colour = colour
+        self._items: List[str] = []
+        self._sort_key: Callable[[str], Any] = lambda item: item
+        self._selected: Set[str] = set()
+        self._offset = 0    # index of the item in the first row
+        self._active = 0    # index of the item with the keyboard cursor
+        self._anchor = 0    # index of the item extended selections start from
+        self._visible = 1   # number of fully visible rows
+
+        self._listbox = tk.Listbox(self, selectmode=tk.EXTENDED, exportselection=False, activestyle=tk.DOTBOX)
+        self._listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=PSMALL, pady=PSMALL)
+        self._scroll = ttk.Scrollbar(self, command=self._on_scroll)
+        self._scroll.pack(side=tk.LEFT, fill=tk.Y)
+
+        font = tkfont.Font(font=self._listbox.cget('font'))
+        self._row_height = font.metrics('linespace') + 1 + 2 * int(self._listbox.cget('selectborderwidth'))
+
+        self._listbox.bind('<Configure>', self._on_configure)
+        self._listbox.bind('<Button-1>', self._on_click)
+        self._listbox.bind('<Shift-Button-1>', lambda e: self._on_click(e, extend=True))
+        self._listbox.bind('<Control-Button-1>', lambda e: self._on_click(e, toggle=True))
+        self._listbox.bind('<B1-Motion>', lambda e: self._on_click(e, extend=True))
+        self._listbox.bind('<MouseWheel>', lambda e: self._scroll_by(-e.delta // 120 * 3 if abs(e.delta) >= 120 else -e.delta))
+        self._listbox.bind('<Button-4>', lambda e: self._scroll_by(-3))
+        self._listbox.bind('<Button-5>', lambda e: self._scroll_by(3))
+        for key, step in (('Up', -1), ('Down', 1), ('Prior', 'page-'), ('Next', 'page+'), ('Home', 'home'), ('End', 'end')):
+            self._listbox.bind(f'<{key}>', lambda e, step=step: self._on_nav_key(step))
+            self._listbox.bind(f'<Shift-{key}>', lambda e, step=step: self._on_nav_key(step, extend=True))
+        self._listbox.bind('<Control-a>', self._on_select_all)
+        self._listbox.bind('<space>', lambda e: self._select(self._active, toggle=True))
+
+    @property
+    def items(self) -> List[str]:
+        return self._items
+
+    def bind_rows(self, sequence: str, func: Callable):
+        '''Binds an event handler to the listbox holding the rows.'''
+        self._listbox.bind(sequence, func)
+
+    def focus(self):
+        self._listbox.focus()
+
+    def set_items(self, items: List[str], selected: Iterable[str] = (), sort_key: Optional[Callable[[str], Any]] = None):
+        '''Replaces the items of the list, keeping those of `selected` that are in it selected.
+        `sort_key` gives the order of the items, for update_item().'''
+        self._items = items
+        self._sort_key = sort_key or (lambda item: item)
+        self._selected = set(selected).intersection(items)
+        self._active = min(self._active, max(len(items) - 1, 0))
+        self._anchor = min(self._anchor, max(len(items) - 1, 0))
+        self._scroll_to(self._offset)
+
+    def set_selected(self, items: Iterable[str]):
+        '''Selects the given items that are in the list, without a <<ListboxSelect>> event.'''
+        self._selected = {item for item in items if self._find(item)[1]}
+        self.redraw()
+
+    def _find(self, item: str) -> Tuple[int, bool]:
+        '''Returns where the item is or belongs in the list, and whether it is there.'''
+        key = self._sort_key(item)
+        lo, hi = 0, len(self._items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._sort_key(self._items[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo, lo < len(self._items) and self._items[lo] == item
+
+    def update_item(self, item: str, present: bool):
+        '''Inserts or removes the item at its place in the list sorted by the
+        `sort_key` of the last set_items(). Call redraw() when done.'''
+        index, found = self._find(item)
+        if present and not found:
+            self._items.insert(index, item)
+            shift = 1
+        elif found and not present:
+            del self._items[index]
+            self._selected.discard(item)
+            shift = -1
+        else:
+            return
+        if index < self._offset:
+            self._offset += shift
+        if index <= self._active:
+            self._active = max(0, self._active + shift)
+        if index <= self._anchor:
+            self._anchor = max(0, self._anchor + shift)
+
+    def get_selected(self) -> List[str]:
+        '''Returns the selected items in list order.'''
+        if len(self._selected) <= 1:
+            return list(self._selected)
+        return [item for item in self._items if item in self._selected]
+
+    @instrument.timed
+    def redraw(self):
+        '''Renders the visible rows again, e.g. after their colours changed.'''
+        self._listbox.delete(0, tk.END)
+        rows = self._items[self._offset:self._offset + self._visible + self.MARGIN]
+        instrument.observe('VirtualList rows rendered', len(rows))
+        if rows:
+            self._listbox.insert(tk.END, *rows)
+        for row, item in enumerate(rows):
+            if self._colour:
+                colour = self._colour(item)
+                if colour:
+                    self._listbox.itemconfig(row, foreground=colour)
+            if item in self._selected:
+                self._listbox.selection_set(row)
+        if self._offset <= self._active < self._offset + len(rows):
+            self._listbox.activate(self._active - self._offset)
+        self._listbox.yview_moveto(0)
+
+        if self._items:
+            self._scroll.set(self._offset / len(self._items), min(self._offset + self._visible, len(self._items)) / len(self._items))
+        else:
+            self._scroll.set(0, 1)
+
+    def _scroll_to(self, offset: int):
+        self._offset = max(0, min(offset, len(self._items) - self._visible))
+        self.redraw()
+
+    def _scroll_by(self, rows: int):
+        self._scroll_to(self._offset + rows)
+        return 'break'
+
+    def _see(self, index: int):
+        if index < self._offset:
+            self._scroll_to(index)
+        elif index >= self._offset + self._visible:
+            self._scroll_to(index - self._visible + 1)
+        else:
+            self.redraw()
+
+    def _on_scroll(self, command: str, *args):
+        if command == tk.MOVETO:
+            self._scroll_to(round(float(args[0]) * len(self._items)))
+        elif command == tk.SCROLL:
+            amount, what = int(args[0]), args[1]
+            self._scroll_by(amount * (self._visible if what == tk.PAGES else 1))
+
+    def _on_configure(self, event):
+        self._visible = max(1, event.height // self._row_height)
+        self._scroll_to(self._offset)
+
+    def _select(self, index: int, extend: bool = False, toggle: bool = False):
+        if not self._items:
+            return 'break'
+        index = max(0, min(index, len(self._items) - 1))
+        if self._selectmode != tk.EXTENDED:
+            extend = toggle = False
+
+        if extend:
+            lo, hi = sorted((self._anchor, index))
+            self._selected = set(self._items[lo:hi + 1])
+        elif toggle:
+            self._selected ^= {self._items[index]}
+            self._anchor = index
+        else:
+            self._selected = {self._items[index]}
+            self._anchor = index
+        self._active = index
+        self._see(index)
+        self.event_generate('<<ListboxSelect>>', when='tail')
+        return 'break'
+
+    def _on_click(self, event, extend: bool = False, toggle: bool = False):
+        self._listbox.focus()
+        row = self._listbox.nearest(event.y)
+        if row < 0 or self._offset + row >= len(self._items):
+            return 'break'
+        return self._select(self._offset + row, extend, toggle)
+
+    def _on_nav_key(self, step, extend: bool = False):
+        if step == 'page-':
+            index = self._active - self._visible
+        elif step == 'page+':
+            index = self._active + self._visible
+        elif step == 'home':
+            index = 0
+        elif step == 'end':
+            index = len(self._items) - 1
+        else:
+            index = self._active + step
+        return self._select(index, extend)
+
+    def _on_select_all(self, event):
+        if self._selectmode == tk.EXTENDED and self._items:
+            self._selected = set(self._items)
+            self.redraw()
+            self.event_generate('<<ListboxSelect>>', when='tail')
+        return 'break'
+
+
+
+class ModelPanel(tk.Frame):
+    '''A panel showing part of a model, which applies the changes of the model
+    to its rows in place instead of being refreshed as a whole.
+
+    Changes made on other threads, by jobs or by the background writer merging
+    the changes of other processes, are picked up on the Tk thread by polling.'''
+
+    BULK_CHANGES = 1000 # more changes than this are applied with a full refresh
+    POLL_MS = 50        # interval changes made on other threads are picked up at
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._model: Optional[Model] = None
+        self._changes: List[ModelEvent] = []
+        self._changes_lock = threading.Lock()
+        self._poll_timer: Optional[str] = None
+
+    def _watch(self, model: Optional[Model]):
+        if model is self._model:
+            return
+        if self._model:
+            self._model.unsubscribe(self._on_model_event)
+        self._model = model
+        self._discard_changes()
+        if self._model:
+            self._model.subscribe(self._on_model_event)
+            if self._poll_timer is None:
+                self._poll_timer = self.after(self.POLL_MS, self._poll_changes)
+
+    def _discard_changes(self):
+        with self._changes_lock:
+            self._changes = []
+
+    def _on_model_event(self, event: ModelEvent):
+        '''Called on the thread that changed the model.'''
+        with self._changes_lock:
+            first = not self._changes
+            self._changes.append(event)
+        if first and threading.current_thread() is threading.main_thread():
+            self.after_idle(self._apply_pending_changes)
+
+    def _poll_changes(self):
+        if not self._model:
+            self._poll_timer = None
+            return
+        self._poll_timer = self.after(self.POLL_MS, self._poll_changes)
+        if self._changes:
+            self._apply_pending_changes()
+
+    def _apply_pending_changes(self):
+        with self._changes_lock:
+            changes, self._changes = self._changes, []
+        self._apply_changes(changes)
+
+    def _apply_changes(self, changes: List[ModelEvent]):
+        if not changes or not self._model:
+            return
+        if len(changes) > self.BULK_CHANGES:
+            self.refresh(self._model)
+        else:
+            with instrument.timer(f'{type(self).__name__}.apply_changes'):
+                self.apply_changes(changes)
+
+    def refresh(self, model: Optional[Model]):
+        raise NotImplementedError
+
+    def apply_changes(self, changes: List[ModelEvent]):
+        raise NotImplementedError
+
+    def destroy(self):
+        self._watch(None)
+        if self._poll_timer is not None:
+            self.after_cancel(self._poll_timer)
+            self._poll_timer = None
+        super().destroy()
+
+
+class WordsPanel(ModelPanel):
+    '''A panel listing the words of a model that match its filter.
+
+    Filter changes are searched on a worker thread, so typing doesn't wait for
+    the search. Model changes arriving meanwhile are applied to the shown words
+    and again to the search result once it is shown, which announces itself with
+    a <<WordsShown>> event.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._scheduler = SearchScheduler(self, SEARCH_DELAY)
+        self._query: Tuple = self._EMPTY_QUERY          # the filter of the shown words
+        self._missed: List[ModelEvent] = []             # changes made while searching
+
+    _EMPTY_QUERY: Tuple = ('', False)
+
+    def _current_query(self) -> Tuple:
+        '''Returns the filter text followed by the state of the other filters.'''
+        raise NotImplementedError
+
+    def _search(self, model: Model, query: Tuple) -> List[str]:
+        '''Returns the words matching the query, called on the search thread.'''
+        raise NotImplementedError
+
+    def _show_words(self, words: List[str]):
+        raise NotImplementedError
+
+    def refresh(self, model: Optional[Model] = None):
+        self._watch(model)
+        self._discard_changes()
+        self._missed = []
+        self._scheduler.cancel()
+
+        if self._model:
+            with instrument.timer(f'{type(self).__name__}.refresh'):
+                self._query = self._current_query()
+                self._show_words(self._search(self._model, self._query))
+
+    def search(self, *args):
+        '''Searches the words matching the filter in the background.'''
+        if not self._model:
+            return
+        model, query, name = self._model, self._current_query(), f'{type(self).__name__}.search'
+
+        def search() -> List[str]:
+            with instrument.timer(name):
+                return self._search(model, query)
+        self._scheduler.submit(search, lambda words: self._on_search_done(query, words))
+
+    def _on_search_done(self, query: Tuple, words: List[str]):
+        missed, self._missed = self._missed, []
+        self._query = query
+        with instrument.timer(f'{type(self).__name__}.show_search'):
+            self._show_words(words)
+            if missed:
+                self.apply_changes(missed)
+        self.event_generate('<<WordsShown>>', when='tail')
+
+    def _apply_changes(self, changes: List[ModelEvent]):
+        if self._scheduler.busy:
+            self._missed.extend(changes)
+        super()._apply_changes(changes)
+
+    def _sort_key(self, word: str) -> Tuple[int, str]:
+        rank = match_rank(word, self._query[0])
+        return (2 if rank is None else rank), word
+
+    def destroy(self):
+        self._scheduler.close()
+        super().destroy()
+
+
+class DuoWordsGui(WordsPanel):
 
     def __init__(self, *args, model=None, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._model: Optional[Model] = model
         self._last_selected: List[str] = []
         self._setup_ui()
         self.refresh(model)
@@ -30,7 +404,7 @@ class DuoWordsGui(tk.Frame):
 
         self._uncategorised = tk.IntVar(value=0)
         ttk.Checkbutton(self, text="Uncategorised only", variable=self._uncategorised).pack(side=tk.TOP, fill=tk.X, padx=PSMALL, pady=PSMALL)
-        self._uncategorised.trace_add('write', self._request_refresh)
+        self._uncategorised.trace_add('write', self.search)
 
         sub_frame1 = tk.Frame(self)
         sub_frame1.pack(side=tk.TOP, fill=tk.X)
@@ -40,45 +414,48 @@ class DuoWordsGui(tk.Frame):
         self._tbx_filter_text = ttk.Entry(sub_frame1, textvariable=self._filter_text)
         self._tbx_filter_text.bind()
         self._tbx_filter_text.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=PSMALL, pady=PSMALL)
-        self._filter_text.trace_add('write', self._request_refresh)
+        self._filter_text.trace_add('write', self.search)
 
         sub_frame2 = tk.Frame(self)
         sub_frame2.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=PSMALL, pady=PSMALL)
 
-        self._lbx_words = tk.Listbox(sub_frame2, selectmode=tk.EXTENDED, exportselection=False)
-        self._lbx_words.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=PSMALL, pady=PSMALL)
-        scroll = ttk.Scrollbar(sub_frame2, command=self._lbx_words.yview)
-        scroll.pack(side=tk.LEFT, fill=tk.Y)
-        self._lbx_words.configure(yscrollcommand=scroll.set)
+        self._lst_words = VirtualList(sub_frame2, selectmode=tk.EXTENDED, colour=self._word_colour)
+        self._lst_words.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
-        self._lbx_words.bind('<<ListboxSelect>>', self._on_word_select)
-        self._lbx_words.bind('<Key>', self._on_lbx_words_key)
-        self._lbx_words.bind('<Button-3>', self._request_word_link)
+        self._lst_words.bind('<<ListboxSelect>>', self._on_word_select)
+        self._lst_words.bind_rows('<Key>', self._on_lbx_words_key)
+        self._lst_words.bind_rows('<Button-3>', self._request_word_link)
 
-    def refresh(self, model: Optional[Model] = None):
-        self._model = model
+    def _current_query(self) -> Tuple[str, bool]:
+        return self._filter_text.get(), bool(self._uncategorised.get())
 
-        if self._model:
-            self._lbx_words.delete(0, tk.END)
+    def _search(self, model: Model, query: Tuple[str, bool]) -> List[str]:
+        return model.get_duo_words(*query)
+
+    def _show_words(self, words: List[str]):
+        self._lst_words.set_items(words, self._last_selected, self._sort_key)
 
-            for word in self._model.get_duo_words(self._filter_text.get(), bool(self._uncategorised.get())):
-                self._lbx_words.insert(tk.END, word)
-                if self._model.get_anki_key_from_duo_word(word):
-                    self._lbx_words.itemconfig(tk.END, foreground='#266e16')
-                else:
-                    self._lbx_words.itemconfig(tk.END, foreground='#6e1616')
+    def apply_changes(self, changes: List[ModelEvent]):
+        for duo_word in {event.duo_word for event in changes if event.duo_word is not None}:
+            self._lst_words.update_item(duo_word, self._shows(duo_word))
+        self._lst_words.redraw()
 
-                if word in self._last_selected:
-                    self._lbx_words.selection_set(tk.END)
+    def _shows(self, word: str) -> bool:
+        filter, uncategorised = self._query
+        return self._model.has_duo_word(word) and match_rank(word, filter) is not None and \
+            (not uncategorised or self._model.is_duo_word_unassigned(word))
+
+    def _word_colour(self, word: str) -> Optional[str]:
+        try:
+            return '#266e16' if self._model.get_anki_key_from_duo_word(word) else '#6e1616'
+        except Model.ModelError:
+            return None     # removed meanwhile, rows are coloured as drawn, before the change event is handled
 
     def get_selected_words(self) -> List[str]:
-        return [self._lbx_words.get(i) for i in self._lbx_words.curselection()]
+        return self._lst_words.get_selected()
 
     def nav_to(self):
-        self._lbx_words.focus()
-
-    def _request_refresh(self, *args):
-        self.event_generate('<<RefreshRequired>>', when='tail')
+        self._lst_words.focus()
 
     def _on_word_select(self, event):
         self._last_selected = self.get_selected_words()
@@ -94,20 +471,19 @@ class DuoWordsGui(tk.Frame):
 
         if event.keysym == 'Delete' and self.get_selected_words():
             if messagebox.askyesno('Delete?', 'Do you want to delete the selected Anki card?'):
-                for word in self.get_selected_words():
-                    self._model.delete_duo_word(word)
-                self._request_refresh()
+                self._model.delete_duo_words(self.get_selected_words())
 
     def _request_word_link(self, event):
         self.event_generate('<<LinkWords>>', when='tail')
 
 
-class AnkiWordsGui(tk.Frame):
+class AnkiWordsGui(WordsPanel):
+
+    _EMPTY_QUERY = ('', False, ())
 
     def __init__(self, *args, model=None, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
-        self._model: Optional[Model] = None
         self._last_selected: List[str] = []
         self._setup_ui()
         self.refresh(model)    
@@ -118,7 +494,16 @@ class AnkiWordsGui(tk.Frame):
         
         self._untranslated = tk.IntVar()
         ttk.Checkbutton(self, text="No translations only", variable=self._untranslated).pack(side=tk.TOP, fill=tk.X, padx=PSMALL, pady=PSMALL)
-        self._untranslated.trace_add('write', self._request_refresh)
+        self._untranslated.trace_add('write', self.search)
+
+        sub_frame0 = tk.Frame(self)
+        sub_frame0.pack(side=tk.TOP, fill=tk.X)
+
+        tk.Label(sub_frame0, text="Tags: ").pack(side=tk.LEFT, padx=PSMALL, pady=PSMALL)
+        self._tags: Dict[str, tk.IntVar] = {tag: tk.IntVar(value=0) for tag in TAGS}
+        for tag, var in self._tags.items():
+            ttk.Checkbutton(sub_frame0, variable=var, text=tag.capitalize()).pack(side=tk.LEFT, padx=PSMALL//2, pady=PSMALL//2)
+            var.trace_add('write', self.search)
 
         sub_frame1 = tk.Frame(self)
         sub_frame1.pack(side=tk.TOP, fill=tk.X)
@@ -128,45 +513,63 @@ class AnkiWordsGui(tk.Frame):
         tbx_filter = ttk.Entry(sub_frame1, textvariable=self._filter_text)
         tbx_filter.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=PSMALL, pady=PSMALL)
         tbx_filter.bind('<Key>', self._on_filter_text_key)
-        self._filter_text.trace_add('write', self._request_refresh)
+        self._filter_text.trace_add('write', self.search)
 
         sub_frame2 = tk.Frame(self)
         sub_frame2.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=PSMALL, pady=PSMALL)
 
-        self._lbx_words = tk.Listbox(sub_frame2, exportselection=False)
-        self._lbx_words.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=PSMALL, pady=PSMALL)
-        scroll = ttk.Scrollbar(sub_frame2, command=self._lbx_words.yview)
-        scroll.pack(side=tk.LEFT, fill=tk.Y)
-        self._lbx_words.configure(yscrollcommand=scroll.set)
+        self._lst_words = VirtualList(sub_frame2, colour=self._word_colour)
+        self._lst_words.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         # events
-        self._lbx_words.bind('<<ListboxSelect>>', self._on_word_select)
-        self._lbx_words.bind('<Key>', self._on_lbx_words_key)
-        self._lbx_words.bind('<Button-3>', self._request_word_link)
-
-    def refresh(self, model: Optional[Model]):
-        self._model = model
-
-        if self._model:
-            self._lbx_words.delete(0, tk.END)
+        self._lst_words.bind('<<ListboxSelect>>', self._on_word_select)
+        self._lst_words.bind_rows('<Key>', self._on_lbx_words_key)
+        self._lst_words.bind_rows('<Button-3>', self._request_word_link)
+
+    def _current_query(self) -> Tuple[str, bool, Tuple[str, ...]]:
+        return self._filter_text.get(), bool(self._untranslated.get()), tuple(tag for tag, var in self._tags.items() if var.get())
+
+    def _search(self, model: Model, query: Tuple[str, bool, Tuple[str, ...]]) -> List[str]:
+        return model.get_anki_words(*query)
+
+    def _show_words(self, words: List[str]):
+        self._lst_words.set_items(words, self._selected_words(), self._sort_key)
+
+    def apply_changes(self, changes: List[ModelEvent]):
+        words = set()
+        for event in changes:
+            if event.kind in ('anki-changed', 'anki-removed'):
+                words.add(event.old[0])
+            if event.kind in ('anki-added', 'anki-changed') and self._model.has_anki_key(event.anki_key):
+                words.add(self._model.get_anki_entry(event.anki_key)[0])
+        for anki_word in words:
+            self._lst_words.update_item(anki_word, self._shows(anki_word))
+        if words:
+            self._lst_words.set_selected(self._selected_words())
+        else:
+            self._lst_words.redraw()    # links changed the colours
 
-            for word in self._model.get_anki_words(filter=self._filter_text.get(), no_translation_only=bool(self._untranslated.get())):
-                self._lbx_words.insert(tk.END, word)
+    def _selected_words(self) -> List[str]:
+        return [self._model.get_anki_entry(key)[0] for key in self._last_selected if self._model.has_anki_key(key)]
 
-                if self._model.get_duo_words_from_anki_word(word):
-                    self._lbx_words.itemconfig(tk.END, foreground='#266e16')                
+    def _shows(self, word: str) -> bool:
+        filter, untranslated, tags = self._query
+        return self._model.has_anki_word(word) and match_rank(word, filter) is not None and \
+            (not untranslated or self._model.is_anki_word_untranslated(word)) and \
+            (not tags or self._model.is_anki_word_tagged(word, tags))
 
-                if self._model.get_anki_key_from_anki_word(word) in self._last_selected:
-                    self._lbx_words.selection_set(tk.END)
+    def _word_colour(self, word: str) -> Optional[str]:
+        return '#266e16' if self._model.get_duo_words_from_anki_word(word) else None
 
     def get_selected_words(self) -> List[str]:
-        return [self._lbx_words.get(i) for i in self._lbx_words.curselection()]
+        return self._lst_words.get_selected()
 
     def nav_to(self):
-        self._lbx_words.focus()
+        self._lst_words.focus()
 
     def _on_word_select(self, event):
-        self._last_selected = [self._model.get_anki_key_from_anki_word(word) for word in self.get_selected_words()]
+        self._last_selected = [self._model.get_anki_key_from_anki_word(word) for word in self.get_selected_words()
+            if self._model.has_anki_word(word)]    # not a card removed meanwhile, which would create it again
         self.event_generate('<<WordSelected>>', when='tail')
 
     def _on_lbx_words_key(self, event):
@@ -184,29 +587,22 @@ class AnkiWordsGui(tk.Frame):
 
         if event.keysym == 'Delete' and self.get_selected_words():
             if messagebox.askyesno('Delete?', 'Do you want to delete the selected Anki card?'):
-                for word in self.get_selected_words():
-                    self._model.delete_anki_entry(self._model.get_anki_key_from_anki_word(word))
-                self._request_refresh()
+                self._model.delete_anki_entries([self._model.get_anki_key_from_anki_word(word) for word in self.get_selected_words()])
 
     def _on_filter_text_key(self, event):
         if event.keysym == 'Return' and self._filter_text.get() != '':
             if messagebox.askyesno('Add?', 'Do you want to add a new Anki card?'):
                 self._model.get_anki_key_from_anki_word(self._filter_text.get())
-                self._request_refresh()
-
-    def _request_refresh(self, *args):
-        self.event_generate('<<RefreshRequired>>', when='tail')
 
     def _request_word_link(self, event):
         self.event_generate('<<LinkWords>>', when='tail')
 
 
-class AnkiCardGui(tk.Frame):
+class AnkiCardGui(ModelPanel):
     def __init__(self, *args, model=None, **kwargs):
         super().__init__(*args, **kwargs)
         
-        self._model: Optional[Model] = None
-        self._anki_word: str = ''
+        self._anki_key: Optional[str] = None
         self._setup_ui()
         self.refresh(model)
 
@@ -233,14 +629,10 @@ class AnkiCardGui(tk.Frame):
         sub_frame1 = tk.Frame(self)
         sub_frame1.grid(row=3, column=1, sticky=tk.NSEW, padx=PSMALL, pady=PSMALL)
 
-        self._tags: Dict[str, tk.Variable] = {
-            'noun': tk.IntVar(value=0),
-            'verb': tk.IntVar(value=0),
-            'adjective': tk.IntVar(value=0),
-        }
+        self._tags: Dict[str, tk.Variable] = {tag: tk.IntVar(value=0) for tag in TAGS}
 
         for key, value in self._tags.items():
-            ttk.Checkbutton(sub_frame1, variable=value, text=key.capitalize()).pack(side=tk.TOP, fill=tk.X, padx=PSMALL//2, pady=PSMALL//2)
+            ttk.Checkbutton(sub_frame1, variable=value, text=key.capitalize(), command=self._on_tag_toggle).pack(side=tk.TOP, fill=tk.X, padx=PSMALL//2, pady=PSMALL//2)
 
         ttk.Separator(self, orient=tk.HORIZONTAL).grid(row=4, column=0, columnspan=2, sticky=tk.EW, padx=PSMALL, pady=PSMALL)
 
@@ -258,31 +650,58 @@ class AnkiCardGui(tk.Frame):
 
         self.rowconfigure(index=6, weight=1)
         
-    def refresh(self, model: Optional[Model], anki_words=[]):
-        self._model = model
-        self.clear()
-        self.on_card_select(anki_words)
+    def refresh(self, model: Optional[Model], anki_words: Optional[List[str]] = None):
+        '''Shows the card of the given word, or reloads the shown card if no words are given.'''
+        self._watch(model)
+        self._discard_changes()
+        if anki_words is not None:
+            self.on_card_select(anki_words)
+        elif self._model and self._anki_key and self._model.has_anki_key(self._anki_key):
+            self._show_card()
+        else:
+            self.clear()
+
+    def apply_changes(self, changes: List[ModelEvent]):
+        if self._anki_key is None:
+            return
+        if any(event.kind == 'anki-removed' and event.anki_key == self._anki_key for event in changes):
+            self.clear()
+        elif any(event.kind == 'anki-changed' and event.anki_key == self._anki_key for event in changes):
+            self._show_card()
+        elif any(event.kind.startswith('duo-') and self._anki_key in (event.anki_key, event.old) for event in changes):
+            self._show_linked_words()
 
     def clear(self):
+        self._anki_key = None
         self._front.set('')
         self._back.set('')
+        for var in self._tags.values():
+            var.set(0)
         self._lbx_words.delete(0, tk.END)
 
     def on_card_select(self, anki_words: List[str]):
-        if not anki_words:
+        if not anki_words or not self._model:
             self.clear()
             return
 
-        self._anki_word, = anki_words
-        duo_words = self._model.get_duo_words_from_anki_word(self._anki_word)
-        anki_entry = self._model.get_anki_entry(self._model.get_anki_key_from_anki_word(self._anki_word))
+        anki_word, = anki_words
+        self._anki_key = self._model.get_anki_key_from_anki_word(anki_word)
+        self._show_card()
+
+    def _show_card(self):
+        anki_entry = self._model.get_anki_entry(self._anki_key)
 
         self._front.set(anki_entry[0])
         self._back.set(anki_entry[1])
+        tags = self._model.get_anki_tags(self._anki_key)
+        for tag, var in self._tags.items():
+            var.set(int(tag in tags))
+        self._show_linked_words()
 
+    def _show_linked_words(self):
         self._lbx_words.delete(0, tk.END)
 
-        for word in duo_words:
+        for word in self._model.get_duo_words_from_anki_key(self._anki_key):
             self._lbx_words.insert(tk.END, word)
 
     def get_selected_words(self) -> List[str]:
@@ -292,11 +711,15 @@ class AnkiCardGui(tk.Frame):
         self._lbx_words.focus()
 
     def _on_tbx_key(self, event):
-        if event.keysym == 'Return':
-            key = self._model.get_anki_key_from_anki_word(self._anki_word)
-            self._model.update_anki_entry(key, self._front.get(), self._back.get())
-            self._anki_word = self._model.get_anki_entry(key)[0]
-            self._request_refresh()
+        if event.keysym == 'Return' and self._anki_key:
+            self._model.update_anki_entry(self._anki_key, self._front.get(), self._back.get())
+
+    def _on_tag_toggle(self):
+        '''Stores the checked tags, keeping those of the card the GUI doesn't offer.'''
+        if not self._anki_key:
+            return
+        other_tags = [tag for tag in self._model.get_anki_tags(self._anki_key) if tag not in self._tags]
+        self._model.set_anki_tags(self._anki_key, other_tags + [tag for tag, var in self._tags.items() if var.get()])
 
     def _on_lbx_words_key(self, event):
         if event.keysym == 'Left':
@@ -304,12 +727,7 @@ class AnkiCardGui(tk.Frame):
             return
             
         if event.keysym == 'Delete' and self.get_selected_words():
-            for duo_word in self.get_selected_words():
-                self._model.unlink_duo_word(duo_word)
-            self._request_refresh()
-
-    def _request_refresh(self, *args):
-        self.event_generate('<<RefreshRequired>>', when='tail')
+            self._model.unlink_many(self.get_selected_words())
 
 class Gui(tk.Frame):
 
@@ -389,14 +807,190 @@ class Gui(tk.Frame):
             self.wait_window()
             return self._db_info, self._db_path
 
+    class _DialogText(tk.Toplevel):
+        '''Shows a read-only text, e.g. a report.'''
+
+        def __init__(self, *args, title: str, text: str, **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+
+            self.title(title)
+            txt = tk.Text(self, wrap=tk.NONE, font='TkFixedFont', width=110, height=30)
+            txt.insert(tk.END, text)
+            txt.configure(state=tk.DISABLED)
+            scroll = ttk.Scrollbar(self, command=txt.yview)
+            scroll.pack(side=tk.RIGHT, fill=tk.Y)
+            txt.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=PSMALL, pady=PSMALL)
+            txt.configure(yscrollcommand=scroll.set)
+
+    class _DialogProgress(tk.Toplevel):
+        '''Shows the progress of a job, and lets it be cancelled if it checks for that.'''
+
+        def __init__(self, *args, job: Job, cancellable: bool, **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+
+            self._job = job
+            self.title(job.title)
+            self.resizable(False, False)
+            self.protocol('WM_DELETE_WINDOW', self.cancel if cancellable else lambda: None)
+
+            self._label = ttk.Label(self, text=f'{job.title}...')
+            self._label.pack(side=tk.TOP, fill=tk.X, padx=PBIG, pady=PBIG)
+            self._bar = ttk.Progressbar(self, length=300, maximum=1.0)
+            self._bar.pack(side=tk.TOP, fill=tk.X, padx=PBIG, pady=PSMALL)
+            self._btn_cancel = ttk.Button(self, text='Cancel', command=self.cancel, state=tk.NORMAL if cancellable else tk.DISABLED)
+            self._btn_cancel.pack(side=tk.TOP, padx=PBIG, pady=PBIG)
+            self.show_progress()
+
+        def show_progress(self):
+            if self._job.total:
+                self._bar.configure(mode='determinate', value=min(self._job.done / self._job.total, 1.0))
+            elif str(self._bar.cget('mode')) != 'indeterminate':
+                self._bar.configure(mode='indeterminate')
+                self._bar.start()
+
+        def cancel(self):
+            self._job.cancel()
+            self._label.configure(text='Cancelling...')
+            self._btn_cancel.configure(state=tk.DISABLED)
+
+    class _DialogSuggestLinks(tk.Toplevel):
+        '''Lists the suggested cards for the unassigned Duolingo words, the
+        selected or all of which can be accepted at once.'''
+
+        def __init__(self, *args, model: Model, suggestions: List[Suggestion], **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+
+            self._model = model
+            self._suggestions: Dict[str, Suggestion] = {}
+
+            self._setup_ui()
+            self._fill(suggestions)
+
+        def _setup_ui(self):
+            self.title('Suggested links')
+
+            sub_frame1 = tk.Frame(self)
+            sub_frame1.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=PSMALL, pady=PSMALL)
+
+            self._tree = ttk.Treeview(sub_frame1, columns=('words', 'score'), selectmode=tk.EXTENDED)
+            self._tree.heading('#0', text='Anki card')
+            self._tree.heading('words', text='Duolingo words')
+            self._tree.heading('score', text='Score')
+            self._tree.column('score', width=60, stretch=False, anchor=tk.E)
+            self._tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            scroll = ttk.Scrollbar(sub_frame1, command=self._tree.yview)
+            scroll.pack(side=tk.LEFT, fill=tk.Y)
+            self._tree.configure(yscrollcommand=scroll.set)
+
+            sub_frame2 = tk.Frame(self)
+            sub_frame2.pack(side=tk.TOP, fill=tk.X, padx=PSMALL, pady=PSMALL)
+
+            ttk.Button(sub_frame2, command=self.destroy, text='Close').pack(side=tk.RIGHT)
+            ttk.Button(sub_frame2, command=self.accept_all, text='Accept all').pack(side=tk.RIGHT)
+            ttk.Button(sub_frame2, command=self.accept_selected, text='Accept selected').pack(side=tk.RIGHT)
+
+        def _fill(self, suggestions: List[Suggestion]):
+            for suggestion in suggestions:
+                text = f'{suggestion.anki_word} (new)' if suggestion.new else suggestion.anki_word
+                item = self._tree.insert('', tk.END, text=text, values=(', '.join(suggestion.duo_words), f'{suggestion.score:.2f}'))
+                self._suggestions[item] = suggestion
+
+        def _accept(self, items: Iterable[str]):
+            items = list(items)
+            self._model.accept_suggestions(self._suggestions.pop(item) for item in items)
+            self._tree.delete(*items)
+
+        def accept_selected(self):
+            self._accept(self._tree.selection())
+
+        def accept_all(self):
+            self._accept(self._tree.get_children())
+
+    class _DialogWorkspaceSearch(tk.Toplevel):
+        '''Searches the words of all open databases; double-clicking a result
+        switches to its database.'''
+
+        def __init__(self, *args, workspace: Workspace, on_select: Callable[[str], None], **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+
+            self._workspace = workspace
+            self._on_select = on_select
+            self._files: Dict[str, str] = {}    # item -> database
+            self._scheduler = SearchScheduler(self, SEARCH_DELAY)
+
+            self._setup_ui()
+
+        def _setup_ui(self):
+            self.title('Search all databases')
+
+            sub_frame1 = tk.Frame(self)
+            sub_frame1.pack(side=tk.TOP, fill=tk.X, padx=PSMALL, pady=PSMALL)
+            tk.Label(sub_frame1, text="Filter: ").pack(side=tk.LEFT, padx=PSMALL, pady=PSMALL)
+            self._filter_text = tk.StringVar()
+            entry = ttk.Entry(sub_frame1, textvariable=self._filter_text)
+            entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=PSMALL, pady=PSMALL)
+            entry.focus_set()
+            self._filter_text.trace_add('write', self.search)
+
+            sub_frame2 = tk.Frame(self)
+            sub_frame2.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=PSMALL, pady=PSMALL)
+            self._tree = ttk.Treeview(sub_frame2, columns=('kind',), selectmode=tk.BROWSE)
+            self._tree.heading('#0', text='Word')
+            self._tree.heading('kind', text='Kind')
+            self._tree.column('kind', width=90, stretch=False)
+            self._tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            scroll = ttk.Scrollbar(sub_frame2, command=self._tree.yview)
+            scroll.pack(side=tk.LEFT, fill=tk.Y)
+            self._tree.configure(yscrollcommand=scroll.set)
+            self._tree.bind('<Double-Button-1>', self._on_double_click)
+
+            ttk.Button(self, command=self.destroy, text='Close').pack(side=tk.RIGHT, padx=PSMALL, pady=PSMALL)
+
+        def search(self, *args):
+            '''Searches the open databases in the background.'''
+            query = self._filter_text.get()
+            if not query:
+                self._scheduler.cancel()
+                self._fill([])
+                return
+            self._scheduler.submit(lambda: self._workspace.search(query), self._fill)
+
+        def _fill(self, hits: List[WorkspaceHit]):
+            self._tree.delete(*self._tree.get_children())
+            self._files = {}
+            for hit in hits:
+                database = self._tree.insert('', tk.END, text=f'{hit.name} ({os.path.basename(hit.file)})', open=True,
+                    values=(f'{len(hit.duo_words) + len(hit.anki_words)} words',))
+                self._files[database] = hit.file
+                for kind, words in (('Duolingo', hit.duo_words), ('Anki', hit.anki_words)):
+                    for word in words[:WORKSPACE_HITS]:
+                        self._files[self._tree.insert(database, tk.END, text=word, values=(kind,))] = hit.file
+                    if len(words) > WORKSPACE_HITS:
+                        self._files[self._tree.insert(database, tk.END, text=f'{len(words) - WORKSPACE_HITS} more', values=(kind,))] = hit.file
+
+        def _on_double_click(self, event):
+            item = self._tree.identify_row(event.y)
+            if item in self._files:
+                self._on_select(self._files[item])
+
+        def destroy(self):
+            self._scheduler.close()
+            super().destroy()
+
     def __init__(self, *args, model=None, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.root: tk.Tk = self.master # type: ignore -> should be called with root
 
         self._model: Optional[Model] = model 
+        self._workspace = Workspace(write_delay=WRITE_DELAY)
+        if model:
+            self._workspace.add(model)
+        self._jobs = JobRunner(self)
+        self._progress: Optional[Gui._DialogProgress] = None
         self._setup_ui()
         self.refresh()
+        self.after(int(RELOAD_DELAY * 1000), self._reload)
 
     def _setup_ui(self):
 
@@ -415,16 +1009,17 @@ class Gui(tk.Frame):
         self._anki_card = AnkiCardGui(self)
         self._anki_card.pack(side=tk.LEFT, fill=tk.BOTH, padx=PSMALL, pady=PSMALL)
 
-        self._duo.bind('<<RefreshRequired>>', self.refresh)
         self._duo.bind('<<LinkWords>>', self.link_words)
-        self._anki.bind('<<RefreshRequired>>', self.refresh)
         self._anki.bind('<<LinkWords>>', self.link_words)
         self._anki.bind('<<WordSelected>>', lambda e: self._anki_card.on_card_select(self._anki.get_selected_words()))
-        self._anki_card.bind('<<RefreshRequired>>', self.refresh)
+        self._anki.bind('<<WordsShown>>', lambda e: self._anki_card.on_card_select(self._anki.get_selected_words()))
         self._duo.bind('<<NavigateRight>>', lambda e: self._anki.nav_to())
         self._anki.bind('<<NavigateLeft>>', lambda e: self._duo.nav_to())
         self._anki.bind('<<NavigateRight>>', lambda e: self._anki_card.nav_to())
         self._anki_card.bind('<<NavigateLeft>>', lambda e: self._anki.nav_to())
+        self.root.bind_all('<Control-z>', lambda e: self.cmd_undo())
+        self.root.bind_all('<Control-y>', lambda e: self.cmd_redo())
+        self.root.bind_all('<Control-Shift-Z>', lambda e: self.cmd_redo())
 
         # Menu bar
         menu = tk.Menu(self)        
@@ -432,22 +1027,51 @@ class Gui(tk.Frame):
         menu_file = tk.Menu(menu, tearoff=0)
         menu_file.add_command(label="New Database", command=self.cmd_new_database)
         menu_file.add_command(label="Open Database", command=self.cmd_open_database)
-        menu_file.add_command(label="Save Database As", command=NI)
+        menu_file.add_command(label="Save Database As", command=self.cmd_save_database_as)
         menu.add_cascade(label='File', menu=menu_file)
 
+        self._menu_databases = tk.Menu(menu, tearoff=0, postcommand=self._update_databases_menu)
+        self._database = tk.StringVar()
+        menu.add_cascade(label='Databases', menu=self._menu_databases)
+
+        menu_edit = tk.Menu(menu, tearoff=0, postcommand=self._update_edit_menu)
+        menu_edit.add_command(label="Undo", accelerator='Ctrl+Z', command=self.cmd_undo)
+        menu_edit.add_command(label="Redo", accelerator='Ctrl+Y', command=self.cmd_redo)
+        menu.add_cascade(label='Edit', menu=menu_edit)
+        self._menu_edit = menu_edit
+
         menu_duo = tk.Menu(menu, tearoff=0)
         menu_duo.add_command(label="Import Duolingo words from Clipboard", command=self.cmd_import_duo_words)
+        menu_duo.add_command(label="Suggest links for unassigned words", command=self.cmd_suggest_links)
         menu.add_cascade(label='Duolingo', menu=menu_duo)
 
         menu_anki = tk.Menu(menu, tearoff=0)
         menu_anki.add_command(label="Export Anki words to file", command=self.cmd_export_anki_words)
+        menu_anki.add_command(label="Export changed Anki words to file", command=lambda: self.cmd_export_anki_words(delta=True))
+        menu_tagged = tk.Menu(menu_anki, tearoff=0)
+        for tag in TAGS:
+            menu_tagged.add_command(label=f"{tag.capitalize()}s", command=lambda tag=tag: self.cmd_export_anki_words(tags=(tag,)))
+        menu_anki.add_cascade(label="Export Anki words with tag to file", menu=menu_tagged)
+        menu_anki.add_separator()
+        menu_anki.add_command(label="Export Anki words to package", command=lambda: self.cmd_export_anki_words(package=True))
+        menu_anki.add_command(label="Export changed Anki words to package", command=lambda: self.cmd_export_anki_words(delta=True, package=True))
         menu.add_cascade(label='Anki', menu=menu_anki)
 
+        menu_diag = tk.Menu(menu, tearoff=0)
+        self._instrument = tk.BooleanVar(value=instrument.enabled())
+        menu_diag.add_checkbutton(label="Record statistics", variable=self._instrument, command=lambda: instrument.enable(self._instrument.get()))
+        menu_diag.add_command(label="Show statistics", command=self.cmd_show_statistics)
+        menu_diag.add_command(label="Reset statistics", command=instrument.reset)
+        menu_diag.add_command(label="Profile a refresh", command=self.cmd_profile_refresh)
+        menu_diag.add_separator()
+        menu_diag.add_command(label="Check database", command=self.cmd_check_database)
+        menu.add_cascade(label='Diagnostics', menu=menu_diag)
+
         self.root.configure(menu=menu) 
 
     def refresh(self, *args):
         if self._model:
-            self.root.title(f"Duo2Anki - {self._model.json['info']['name']}") 
+            self.root.title(f"Duo2Anki - {self._model.info['name']}") 
         else:
             self.root.title("Duo2Anki") 
         
@@ -456,54 +1080,272 @@ class Gui(tk.Frame):
         self._anki_card.refresh(self._model, self._anki.get_selected_words())
 
     def link_words(self, event):
+        '''Links the selected Duolingo words to the selected Anki card. The panels
+        pick the change up from the model's events.'''
         duo_words = self._duo.get_selected_words()
         anki_words = self._anki.get_selected_words()
 
         if duo_words and anki_words:
             anki_word, = anki_words
-            for duo_word in duo_words:
-                self._model.link_duo_word_to_anki_word(duo_word, anki_word)
+            self._model.link_many(duo_words, anki_word)
+
+    def _reload(self):
+        '''Reads the changes other processes made to the database, e.g. scheduled
+        imports, on a thread of its own, as reading them may take long.'''
+        model = self._model
+        if not model:
+            self.after(int(RELOAD_DELAY * 1000), self._reload)
+            return
+
+        def read():
+            try:
+                model.read_changes()
+            except (OSError, Model.ModelError):
+                pass    # e.g. locked for long by another process, tried again next time
+        thread = threading.Thread(target=read, name='duo2anki-reload', daemon=True)
+        thread.start()
+        self.after(ModelPanel.POLL_MS, self._merge_changes, model, thread)
+
+    def _merge_changes(self, model: Model, thread: threading.Thread):
+        '''Merges the changes read once the reading thread is done. The panels
+        pick them up from the model's events.'''
+        if thread.is_alive():
+            self.after(ModelPanel.POLL_MS, self._merge_changes, model, thread)
+            return
+        if model is self._model:
+            model.merge_changes()
+        self.after(int(RELOAD_DELAY * 1000), self._reload)
+
+    def close(self):
+        '''Cancels the running job and writes all pending changes of the open databases.'''
+        self._jobs.close()
+        self._workspace.close_all()
+        self._model = None
+
+    def _update_databases_menu(self):
+        '''Lists the open databases, the most recently used first.'''
+        menu = self._menu_databases
+        menu.delete(0, tk.END)
+        self._database.set(str(self._model.file) if self._model else '')
+        for model in self._workspace.models():
+            file = str(model.file)
+            menu.add_radiobutton(label=f"{model.info['name']} ({os.path.basename(file)})", variable=self._database, value=file,
+                command=lambda file=file: self.cmd_switch_database(file))
+        if len(self._workspace):
+            menu.add_separator()
+        menu.add_command(label="Search all databases", command=self.cmd_search_databases, state=tk.NORMAL if len(self._workspace) else tk.DISABLED)
+        menu.add_command(label="Close database", command=self.cmd_close_database, state=tk.NORMAL if self._model else tk.DISABLED)
+
+    def _switch(self, model: Optional[Model]):
+        '''Shows the given open database, with the changes other processes made
+        to it while it wasn't shown.'''
+        self._model = model
+        if model:
+            try:
+                model.reload()
+            except (OSError, Model.ModelError):
+                pass    # picked up by the next reload
         self.refresh()
 
+    def cmd_switch_database(self, file: str):
+        self._switch(self._workspace.get(file))
+
+    def cmd_close_database(self):
+        '''Closes the shown database and shows the most recently used other one.'''
+        if not self._model:
+            return
+        if self._jobs.busy:
+            messagebox.showinfo('Busy', 'Please wait for the running job to finish.')
+            return
+        self._workspace.close(str(self._model.file))
+        files = self._workspace.files()
+        self._switch(self._workspace.get(files[0]) if files else None)
+
+    def cmd_search_databases(self):
+        '''Searches the words of all open databases.'''
+        Gui._DialogWorkspaceSearch(self, workspace=self._workspace, on_select=self.cmd_switch_database)
+
+    def run_job(self, title: str, work: Callable[[Job], Any], done: Callable[[Any], None], cancellable: bool = False):
+        '''Runs `work` on a worker thread with a progress dialog, then calls `done`
+        with its result; a failure is reported instead. Jobs reporting their
+        progress through Job.progress() are cancellable.'''
+        if self._jobs.busy:
+            messagebox.showinfo('Busy', 'Please wait for the running job to finish.')
+            return
+
+        def on_progress(job: Job):
+            if self._progress is None and time.monotonic() - job.started >= PROGRESS_DELAY:
+                self._progress = Gui._DialogProgress(self, job=job, cancellable=cancellable)
+            elif self._progress is not None:
+                self._progress.show_progress()
+
+        def on_end():
+            if self._progress is not None:
+                self._progress.destroy()
+                self._progress = None
+
+        def on_done(result: Any):
+            on_end()
+            done(result)
+
+        def on_failed(error: BaseException):
+            on_end()
+            if isinstance(error, Job.Cancelled):
+                messagebox.showinfo('Cancelled', f'{title} was cancelled, nothing was changed.')
+            else:
+                messagebox.showerror('Error', f'{title} failed:\n{error}')
+
+        self._jobs.submit(title, work, on_done, on_failed, on_progress)
+
+    def _update_edit_menu(self):
+        can_undo = bool(self._model and self._model.can_undo())
+        can_redo = bool(self._model and self._model.can_redo())
+        self._menu_edit.entryconfigure(0, state=tk.NORMAL if can_undo else tk.DISABLED)
+        self._menu_edit.entryconfigure(1, state=tk.NORMAL if can_redo else tk.DISABLED)
+
+    def cmd_undo(self):
+        '''Reverts the last change; the panels pick it up from the model's events.'''
+        if self._model:
+            self._model.undo()
+
+    def cmd_redo(self):
+        if self._model:
+            self._model.redo()
+
     def cmd_new_database(self):
         '''Creates a new database.'''        
+        if self._jobs.busy:
+            messagebox.showinfo('Busy', 'Please wait for the running job to finish.')
+            return
         info, path = Gui._DialogNewDb(self).get_new_db_info()
         if info:
-            self._model = Model(path)
-            self._model.update_model_info(info)
-        self.refresh()
+            self._workspace.close(path)
+            model = self._workspace.add(Model(path, write_delay=WRITE_DELAY))
+            model.update_model_info(info)
+            self._switch(model)
 
     def cmd_open_database(self):
-        '''Opens an existing database.'''
+        '''Opens an existing database, reading it in the background unless it is open already.'''
         path = os.path.normpath(filedialog.askopenfilename())
         if path != '.':
-            try:
-                self._model = Model(path)
-            except Model.ModelError:
-                messagebox.showerror('Error', f"Could not open file at '{path}', bad file format.")
-        self.refresh()
+            model = self._workspace.get(path)
+            if model:
+                self._switch(model)
+            else:
+                self.run_job(f"Opening '{os.path.basename(path)}'", lambda job: Model(path, write_delay=WRITE_DELAY), self._on_opened)
+
+    def _on_opened(self, model: Model):
+        self._switch(self._workspace.add(model))
+        if not model.integrity().ok:
+            self.cmd_check_database()
+
+    def cmd_save_database_as(self):
+        '''Saves the database under a new name, as SQLite if the name ends in .db or .sqlite.'''
+        if not self._model:
+            return
+        path = os.path.normpath(filedialog.asksaveasfilename())
+        if path in self._workspace:
+            messagebox.showerror('Error', f"'{path}' is open, close it first.")
+        elif path != '.':
+            model = self._model
+
+            def save(job: Job) -> Model:
+                if os.path.exists(path):
+                    os.remove(path)
+                model.save_as(path)
+                return Model(path, write_delay=WRITE_DELAY)
+            self.run_job(f"Saving as '{os.path.basename(path)}'", save, self._on_opened)
 
     def cmd_import_duo_words(self):
-        try:      
-            self._model.update_duo_new_words_from_str(self.root.clipboard_get())
-        except Exception as e:
-            messagebox.showerror('Error', f'Something went wrong:\n{str(e)}')
-        messagebox.showinfo('Info', 'Import successful!')
-        self.refresh()
-        
-    def cmd_export_anki_words(self):
-        path = os.path.normpath(filedialog.asksaveasfilename())
-        if path != '.':
-            try:
-                self._model.export_anki_csv(path)
-            except Model.ModelError:
-                messagebox.showerror('Error', f"Could not export file at '{path}'")
-        self.refresh()
+        '''Imports the Duolingo vocabulary export on the clipboard in the background.'''
+        if not self._model:
+            return
+        try:
+            duo_str = self.root.clipboard_get()
+        except tk.TclError:
+            messagebox.showerror('Error', 'The clipboard is empty.')
+            return
+        model = self._model
+
+        def done(duo_words: List[str]):
+            # the words are parsed on the worker, but added here, the thread changing the model
+            report = model.add_duo_words(duo_words)
+            messagebox.showinfo('Info', f'Import successful: {len(report.added)} words added, {len(report.known)} already known, '
+                f'{len(report.missing)} not in the export.')
+        self.run_job('Importing Duolingo words', lambda job: Model.read_duo_words(StringIO(duo_str), job.progress, len(duo_str)),
+            done, cancellable=True)
+
+    def cmd_suggest_links(self):
+        '''Shows the suggested cards for the unassigned Duolingo words, grouping
+        them in the background.'''
+        if not self._model:
+            return
+        model = self._model
+        self.run_job('Suggesting links', lambda job: model.suggest_links(),
+            lambda suggestions: Gui._DialogSuggestLinks(self, model=model, suggestions=suggestions))
+
+    def cmd_show_statistics(self):
+        '''Shows the statistics recorded since they were enabled or reset, and
+        those of the memoized queries of the open database.'''
+        text = instrument.report()
+        if self._model:
+            text += '\n\n' + f'{"memoized queries":<40} ' + ' '.join(f'{key} {value}' for key, value in self._model.query_stats().items())
+        Gui._DialogText(self, title='Statistics', text=text)
+
+    def cmd_profile_refresh(self):
+        '''Refreshes all panels under the profiler and shows where the time went.'''
+        Gui._DialogText(self, title='Profile of a refresh', text=instrument.profile(self.refresh))
+
+    def cmd_check_database(self):
+        '''Shows the problems found in the open database and offers to repair them.'''
+        if not self._model:
+            return
+        model = self._model
 
-def main():
+        def done(report: IntegrityReport):
+            if report.ok:
+                messagebox.showinfo('Check database', 'No problems found.')
+                return
+            Gui._DialogText(self, title='Check database', text='\n'.join(report.lines()))
+            if messagebox.askyesno('Check database', f'{len(report.lines())} problems found. Repair them?\n\n'
+                    'Duplicate cards are merged, broken links removed and malformed entries dropped. The repair can be undone.'):
+                # checked again and repaired here, the thread changing the model, as it may have changed meanwhile
+                repaired = model.check(repair=True)
+                messagebox.showinfo('Check database', f'{len(repaired.lines())} problems repaired.')
+        self.run_job('Checking the database', lambda job: model.check(), done)
+
+    def cmd_export_anki_words(self, delta: bool = False, tags: Tuple[str, ...] = (), package: bool = False):
+        '''Exports the cards as CSV, or as an Anki package that Anki imports directly.'''
+        if not self._model:
+            return
+        if package:
+            path = os.path.normpath(filedialog.asksaveasfilename(defaultextension='.apkg', filetypes=[('Anki package', '*.apkg')]))
+        else:
+            path = os.path.normpath(filedialog.asksaveasfilename())
+        if path != '.':
+            model = self._model
+            export = model.export_anki_apkg if package else model.export_anki_csv
+            stamp = time.time()     # before the cards are read, so that delta exports don't skip cards changed meanwhile
+
+            def done(count: int):
+                if not tags:    # exports of some tags only don't count as the last export
+                    model.mark_exported(stamp)
+                messagebox.showinfo('Info', f"{count} cards exported to '{path}'.")
+            self.run_job('Exporting Anki words', lambda job: export(path, delta=delta, tags=tags, progress=job.progress, record=False),
+                done, cancellable=True)
+
+def main(file: Optional[str] = None):
     root = tk.Tk()
-    gui = Gui(master=root)
+    model = Model(file, write_delay=WRITE_DELAY) if file else None
+    gui = Gui(master=root, model=model)
     gui.pack(fill=tk.BOTH, expand=True)
+    if model and not model.integrity().ok:
+        root.after_idle(gui.cmd_check_database)
+
+    def on_close():
+        gui.close()
+        root.destroy()
+    root.protocol('WM_DELETE_WINDOW', on_close)
 
     root.mainloop()
 
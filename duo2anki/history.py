@@ -0,0 +1,61 @@
+from __future__ import annotations
+from collections import deque
+from typing import TYPE_CHECKING, Deque, List, Optional
+
+if TYPE_CHECKING:
+    from duo2anki.model import Record
+
+STEPS = 100     # changes that can be undone
+
+
+class History:
+    '''Bounded undo and redo stacks. A step is the list of records reverting a
+    change, so it takes memory in proportion to the change, not the model.
+
+    Changes made between begin() and end() are recorded as a single step.'''
+
+    def __init__(self, steps: int = STEPS):
+        self._undo: Deque[List[Record]] = deque(maxlen=steps)
+        self._redo: Deque[List[Record]] = deque(maxlen=steps)
+        self._open: Optional[List[List[Record]]] = None   # steps of the changes since begin()
+
+    def begin(self):
+        self._open = []
+
+    def end(self):
+        steps, self._open = self._open, None
+        if steps:
+            # the changes are reverted in the reverse order they were made
+            self.add([record for step in reversed(steps) for record in step])
+
+    def add(self, step: List[Record]):
+        '''Records the step reverting a new change, which can't be redone anymore.'''
+        if not step:
+            return
+        if self._open is not None:
+            self._open.append(step)
+            return
+        self._undo.append(step)
+        self._redo.clear()
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def pop_undo(self) -> Optional[List[Record]]:
+        return self._undo.pop() if self._undo else None
+
+    def pop_redo(self) -> Optional[List[Record]]:
+        return self._redo.pop() if self._redo else None
+
+    def push_undo(self, step: List[Record]):
+        self._undo.append(step)
+
+    def push_redo(self, step: List[Record]):
+        self._redo.append(step)
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import json
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, TextIO
+
+
+class ImportReport(NamedTuple):
+    added:      List[str]   # words new to the model, in export order
+    known:      List[str]   # words of the export already in the model
+    missing:    List[str]   # words of the model that are not in the export
+
+
+class _StreamReader:
+    '''Decodes JSON values one at a time from a text stream, keeping only the
+    unparsed remainder of the stream in memory. `progress` is called with the
+    number of characters read after every chunk.'''
+
+    CHUNK_SIZE = 1 << 16
+    NUMBER_CHARS = '0123456789+-.eE'
+
+    def __init__(self, stream: TextIO, progress: Optional[Callable[[int], None]] = None):
+        self._stream = stream
+        self._progress = progress
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._read = 0
+
+    def _fill(self, size: Optional[int] = None) -> bool:
+        if self._eof:
+            return False
+        chunk = self._stream.read(size or self.CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        self._read += len(chunk)
+        if self._progress:
+            self._progress(self._read)
+        return True
+
+    def peek(self) -> str:
+        '''Returns the next non-whitespace character without consuming it.'''
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON')
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at '{self._buf[self._pos:self._pos+20]}'")
+        self._pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        size = self.CHUNK_SIZE
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # most likely a value cut at the end of the buffer
+                if not self._fill(size):
+                    raise
+                size *= 2
+                continue
+            if isinstance(value, (int, float)) and not self._eof and not self._buf[end:].strip(self.NUMBER_CHARS):
+                # a number cut at the end of the buffer, e.g. '12.' read as 12, may continue in the next chunk
+                if self._fill(size):
+                    continue
+            self._pos = end
+            return value
+
+
+def iter_vocab_words(stream: TextIO, progress: Optional[Callable[[int], None]] = None) -> Iterator[str]:
+    '''Yields the words of the `vocab_overview` of a Duolingo vocabulary export
+    while reading it, without loading the whole export. `progress` is called
+    with the number of characters read so far.'''
+    reader = _StreamReader(stream, progress)
+    reader.expect('{')
+    if reader.peek() == '}':
+        raise KeyError('vocab_overview')
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key != 'vocab_overview':
+            reader.value()
+        else:
+            reader.expect('[')
+            if reader.peek() != ']':
+                while True:
+                    yield reader.value()['word_string']
+                    if reader.peek() != ',':
+                        break
+                    reader.expect(',')
+            reader.expect(']')
+            return
+        if reader.peek() != ',':
+            break
+        reader.expect(',')
+    raise KeyError('vocab_overview')
@@ -0,0 +1,149 @@
+from __future__ import annotations
+from contextlib import contextmanager
+import functools
+import io
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, TypeVar
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+SAMPLES = 1000  # latest samples kept per metric for the percentiles
+
+
+class _Metric:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: List[float] = []
+        self._next = 0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.samples) < SAMPLES:
+            self.samples.append(value)
+        else:
+            self.samples[self._next] = value
+            self._next = (self._next + 1) % SAMPLES
+
+    def summary(self) -> Dict[str, float]:
+        samples = sorted(self.samples)
+        percentile = lambda p: samples[min(int(p * len(samples)), len(samples) - 1)]
+        return {
+            'count': self.count, 'total': self.total, 'mean': self.total / self.count, 'max': self.max,
+            'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99),
+        }
+
+
+_enabled = bool(os.environ.get('DUO2ANKI_INSTRUMENT'))
+_lock = threading.Lock()
+_timings: Dict[str, _Metric] = {}   # seconds per call
+_values: Dict[str, _Metric] = {}    # sizes per call, e.g. rows rendered
+_counters: Dict[str, int] = {}      # totals, e.g. bytes written
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(on: bool = True):
+    '''Turns recording on or off. It is on from the start if the DUO2ANKI_INSTRUMENT
+    environment variable is set.'''
+    global _enabled
+    _enabled = on
+
+
+def reset():
+    with _lock:
+        _timings.clear()
+        _values.clear()
+        _counters.clear()
+
+
+def record(name: str, seconds: float):
+    with _lock:
+        _timings.setdefault(name, _Metric()).add(seconds)
+
+
+def observe(name: str, value: float):
+    if _enabled:
+        with _lock:
+            _values.setdefault(name, _Metric()).add(value)
+
+
+def count(name: str, amount: int = 1):
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + amount
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    '''Records the time spent in the block under `name`.'''
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(func: F) -> F:
+    '''Records the time spent in each call of the decorated function under its qualified name.'''
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - start)
+    return wrapper  # type: ignore
+
+
+def stats() -> Dict[str, Dict[str, Dict[str, float]]]:
+    '''Returns the recorded timings (in seconds) and values, summarised per name,
+    and the counters.'''
+    with _lock:
+        return {
+            'timings': {name: metric.summary() for name, metric in _timings.items()},
+            'values': {name: metric.summary() for name, metric in _values.items()},
+            'counters': {name: {'total': total} for name, total in _counters.items()},
+        }
+
+
+def report() -> str:
+    '''Returns the statistics as a table.'''
+    data = stats()
+    lines = [f'{"timings (ms)":<40} {"count":>8} {"total":>10} {"mean":>9} {"p50":>9} {"p90":>9} {"p99":>9} {"max":>9}']
+    for name, s in sorted(data['timings'].items(), key=lambda item: -item[1]['total']):
+        lines.append(f'{name:<40} {s["count"]:>8} ' + ' '.join(f'{s[k] * 1000:>{10 if k == "total" else 9}.2f}' for k in ('total', 'mean', 'p50', 'p90', 'p99', 'max')))
+    lines.append('')
+    lines.append(f'{"values":<40} {"count":>8} {"total":>10} {"mean":>9} {"p50":>9} {"p90":>9} {"p99":>9} {"max":>9}')
+    for name, s in sorted(data['values'].items()):
+        lines.append(f'{name:<40} {s["count"]:>8} ' + ' '.join(f'{s[k]:>{10 if k == "total" else 9}.0f}' for k in ('total', 'mean', 'p50', 'p90', 'p99', 'max')))
+    lines.append('')
+    lines.append(f'{"counters":<40} {"total":>8}')
+    for name, s in sorted(data['counters'].items()):
+        lines.append(f'{name:<40} {s["total"]:>8.0f}')
+    return '\n'.join(lines)
+
+
+def profile(func: Callable[[], Any], limit: int = 30) -> str:
+    '''Runs `func` under cProfile and returns its most expensive calls.'''
+    import cProfile, pstats    # only needed here, and slow to import
+    profiler = cProfile.Profile()
+    profiler.runcall(func)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
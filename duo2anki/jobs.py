@@ -0,0 +1,96 @@
+from __future__ import annotations
+import threading
+import time
+import tkinter as tk
+from typing import Any, Callable, Optional
+
+
+class Job:
+    '''A long operation run by a JobRunner. The operation reports its progress
+    by calling progress(), which raises Job.Cancelled once it was cancelled.'''
+
+    class Cancelled(Exception):
+        pass
+
+    def __init__(self, title: str):
+        self.title = title
+        self.started = time.monotonic()
+        self.done = 0
+        self.total: Optional[int] = None
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def progress(self, done: int, total: Optional[int] = None):
+        '''Called on the worker thread, matches model.Progress.'''
+        self.done, self.total = done, total
+        if self.cancelled:
+            raise Job.Cancelled(f'{self.title} cancelled')
+
+
+class JobRunner:
+    '''Runs long model operations for a Tk widget on a worker thread, one at a
+    time, so the window stays responsive. The progress and the outcome of a job
+    are passed to its callbacks on the Tk thread.'''
+
+    POLL_MS = 50    # interval the job is polled for on the Tk thread
+
+    def __init__(self, widget: tk.Misc):
+        self._widget = widget
+        self._job: Optional[Job] = None
+        self._thread: Optional[threading.Thread] = None
+        self._poll_timer: Optional[str] = None
+
+    @property
+    def busy(self) -> bool:
+        return self._job is not None
+
+    def submit(self, title: str, work: Callable[[Job], Any], done: Callable[[Any], None], failed: Callable[[BaseException], None],
+            progress: Callable[[Job], None]) -> Job:
+        '''Runs `work` on a worker thread and calls `done` with its result, or
+        `failed` with the exception it raised (Job.Cancelled if cancelled).
+        `progress` is called with the job while it runs.'''
+        if self._job is not None:
+            raise RuntimeError(f"'{self._job.title}' is still running")
+        job = self._job = Job(title)
+
+        def run():
+            try:
+                job.result = work(job)
+            except BaseException as e:
+                job.error = e
+        self._thread = threading.Thread(target=run, name='duo2anki-job', daemon=True)
+        self._thread.start()
+        self._poll_timer = self._widget.after(self.POLL_MS, self._poll, job, done, failed, progress)
+        return job
+
+    def close(self):
+        '''Cancels the running job and waits for it to stop, without calling back.'''
+        if self._poll_timer is not None:
+            self._widget.after_cancel(self._poll_timer)
+            self._poll_timer = None
+        if self._job is not None:
+            self._job.cancel()
+        if self._thread is not None:
+            self._thread.join()
+        self._job = self._thread = None
+
+    def _poll(self, job: Job, done: Callable[[Any], None], failed: Callable[[BaseException], None],
+            progress: Callable[[Job], None]):
+        self._poll_timer = None
+        if self._thread is not None and self._thread.is_alive():
+            progress(job)
+            self._poll_timer = self._widget.after(self.POLL_MS, self._poll, job, done, failed, progress)
+            return
+        self._job = self._thread = None
+        if job.error is not None:
+            failed(job.error)
+        else:
+            done(job.result)
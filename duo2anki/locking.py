@@ -0,0 +1,76 @@
+from __future__ import annotations
+from pathlib import Path
+import time
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None # type: ignore
+    import msvcrt
+
+
+def lock_file(file: Path) -> Path:
+    return file.with_name(f'{file.name}.lock')
+
+
+class FileLock:
+    '''Advisory lock shared by all processes using a database, held on a lock
+    file next to it as the database itself gets replaced when written.
+
+    The lock is reentrant within the process; callers serialise its use
+    between threads.'''
+
+    TIMEOUT = 10.0  # seconds to wait for another process before giving up
+    POLL = 0.05
+
+    def __init__(self, file: Path, timeout: float = TIMEOUT):
+        self._file = file
+        self._timeout = timeout
+        self._f: Optional[IO[bytes]] = None
+        self._depth = 0
+
+    def __enter__(self) -> FileLock:
+        if not self._depth:
+            self._acquire()
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if not self._depth:
+            self._release()
+
+    def _acquire(self):
+        if self._f is None:
+            self._f = open(self._file, 'a+b')
+        deadline = time.monotonic() + self._timeout
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(self._f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    self._f.seek(0)
+                    msvcrt.locking(self._f.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f'{self._file} is locked by another process')
+                time.sleep(self.POLL)
+
+    def _release(self):
+        if self._f is None:
+            return
+        if fcntl:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+        else:
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        if self._f is not None:
+            if self._depth:
+                self._release()
+                self._depth = 0
+            self._f.close()
+            self._f = None
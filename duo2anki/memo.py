@@ -0,0 +1,71 @@
+from __future__ import annotations
+from collections import OrderedDict
+import copy
+import functools
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple, TypeVar
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+MAXSIZE = 256   # results kept, the least recently used are dropped first
+
+
+class QueryCache:
+    '''Bounded LRU cache of query results, each valid as long as the version of
+    the model it was computed from is current.'''
+
+    def __init__(self, maxsize: int = MAXSIZE):
+        self._maxsize = maxsize
+        self._entries: OrderedDict[Hashable, Tuple[int, Any]] = OrderedDict()
+        self._lock = threading.Lock()   # queries run on the search thread as well
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, version: int) -> Tuple[bool, Any]:
+        '''Returns whether a result of the given version is cached, and the result.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key: Hashable, version: int, value: Any):
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self._maxsize}
+
+
+def memoized(method: F) -> F:
+    '''Caches the results of a query method in the `_queries` QueryCache of its
+    object, keyed by the arguments and valid while its `_version` is unchanged.
+    Callers get a copy of the result, so they may modify it.'''
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:   # e.g. a list argument
+            return method(self, *args, **kwargs)
+        version = self._version     # read first, a change made while computing invalidates the result
+        found, value = self._queries.get(key, version)
+        if not found:
+            value = method(self, *args, **kwargs)
+            self._queries.put(key, version, value)
+        return copy.copy(value)
+    return wrapper  # type: ignore
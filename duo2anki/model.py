@@ -1,11 +1,27 @@
 from __future__ import annotations
+from contextlib import contextmanager
+import io
 import json
-from json.decoder import JSONDecodeError
 import os
 from pathlib import Path
-from typing import List, Dict, Tuple, TypedDict, Optional
+import sys
+import threading
+import time
+from typing import Any, Callable, Hashable, Iterable, Iterator, List, Dict, NamedTuple, Sequence, Set, TextIO, Tuple, TypedDict, TypeVar, Optional
 import uuid
 
+from duo2anki.apkg import Note, write_apkg
+from duo2anki.cache import cache_file, load_cache, save_cache
+from duo2anki.exporter import write_csv
+from duo2anki.grouping import Suggestion, suggest_links
+from duo2anki.history import History
+from duo2anki.importer import ImportReport, iter_vocab_words
+from duo2anki.instrument import timed
+from duo2anki.memo import QueryCache, memoized
+from duo2anki.search import SearchIndex, fold, match_rank
+from duo2anki.storage import Storage, StorageError, diff_records, open_storage
+from duo2anki.writer import BackgroundWriter
+
 
 class ModelInfo(TypedDict):
     name: str
@@ -16,6 +32,89 @@ class ModelDict(TypedDict):
     info:   ModelInfo
     duo:    Dict[str, Optional[str]]
     anki:   Dict[str, Tuple[str, str]]
+    stamps: Dict[str, float]    # anki key -> time the card was last changed
+    tags:   Dict[str, List[str]]    # anki key -> tags of the card, if it has any
+    exported: float             # time of the last export
+
+
+class ModelEvent(NamedTuple):
+    '''A change of the model, as passed to its listeners.
+
+    kind is one of 'info', 'duo-added', 'duo-removed', 'duo-linked' (linked
+    or unlinked), 'anki-added', 'anki-changed' and 'anki-removed'. `old` is
+    the previous anki key for duo events and the previous (word, translation)
+    for anki events. Changing the tags of a card is an 'anki-changed' event.'''
+    kind:       str
+    duo_word:   Optional[str] = None
+    anki_key:   Optional[str] = None
+    old:        Any = None
+
+
+class IntegrityReport(NamedTuple):
+    duplicates: Dict[str, List[str]]    # anki word -> keys of the cards sharing it as front side
+    dangling:   List[str]   # duo words linked to keys without a card
+    orphans:    List[str]   # keys without a card that still have a stamp or tags stored
+    malformed:  List[str]   # stored entries that couldn't be read, left out of the model
+
+    @property
+    def ok(self) -> bool:
+        return not (self.duplicates or self.dangling or self.orphans or self.malformed)
+
+    def lines(self) -> List[str]:
+        '''Describes the problems found, one per line.'''
+        return [f"{len(keys)} cards with the front side '{word}': {', '.join(keys)}" for word, keys in sorted(self.duplicates.items())] + \
+            [f"'{duo_word}' is linked to a card that doesn't exist" for duo_word in self.dangling] + \
+            [f'stamp or tags of the missing card {anki_key}' for anki_key in self.orphans] + \
+            [f'malformed {entry}' for entry in self.malformed]
+
+
+# A single mutation of the model, e.g. ['duo', duo_word, anki_key], ['tags', anki_key, tags, stamp] or ['anki-', anki_key]
+Record = List[Any]
+
+# Called by long operations with the work done and the total, if known
+Progress = Callable[[int, Optional[int]], None]
+
+PROGRESS_STEP = 1000    # rows between progress reports
+
+T = TypeVar('T')
+
+
+def _reporting(rows: Sequence[T], progress: Progress, total: int) -> Iterator[T]:
+    for done, row in enumerate(rows):
+        if not done % PROGRESS_STEP:
+            progress(done, total)
+        yield row
+    progress(total, total)
+
+
+def _targets(record: Record) -> List[tuple]:
+    '''Returns the stored entries a record replaces: removing a card also removes its tags.'''
+    op, *args = record
+    if op in ('info', 'exported'):
+        return [(op,)]
+    if op in ('duo', 'duo-'):
+        return [('duo', args[0])]
+    if op == 'anki-':
+        return [('anki', args[0]), ('tags', args[0])]
+    return [(op, args[0])]
+
+
+class Card:
+    '''An Anki card in memory. Cards are referred to by small integer ids, their
+    UUID keys are only needed to persist them and are looked up by id.'''
+
+    __slots__ = ('id', 'word', 'folded', 'translation', 'stamp', 'tags')
+
+    def __init__(self, id: int, word: str, translation: str, stamp: float):
+        self.id = id
+        self.tags: Tuple[str, ...] = ()
+        self.set(word, translation, stamp)
+
+    def set(self, word: str, translation: str, stamp: float):
+        self.word = sys.intern(word)
+        self.folded = fold(self.word)
+        self.translation = translation
+        self.stamp = stamp
 
 
 class Model:
@@ -31,125 +130,1027 @@ class Model:
             },
             'duo': {}, 
             'anki': {},
+            'stamps': {},
+            'tags': {},
+            'exported': 0.0,
             }
 
     @property
     def json(self) -> ModelDict:
-        return self._json.copy()
+        '''The model as stored, built from its in-memory representation.'''
+        with self._lock:
+            return self._to_dict()
+
+    @property
+    def info(self) -> ModelInfo:
+        return dict(self._info) # type: ignore
+
+    @property
+    def file(self) -> Path:
+        return self._file
+
+    @memoized
+    def summary(self) -> Dict[str, int]:
+        '''Returns the numbers of words and cards by state.'''
+        with self._lock:
+            return {
+                'duo_words': len(self._duo),
+                'unassigned': sum(1 for card_id in self._duo.values() if card_id not in self._cards),
+                'anki_cards': len(self._cards),
+                'untranslated': sum(1 for card in self._cards.values() if card.translation == ''),
+                'changed_since_export': sum(1 for card in self._cards.values() if card.stamp >= self._exported),
+            }
+
+    def query_stats(self) -> Dict[str, int]:
+        '''Returns the hits and misses of the memoized queries.'''
+        return self._queries.stats()
 
-    def __init__(self, file: str):
+    def clear_queries(self):
+        '''Forgets the memoized queries, e.g. to time the searches themselves.'''
+        self._queries.clear()
+
+    def __init__(self, file: str, journal: bool = False, write_delay: Optional[float] = None, storage: Optional[Storage] = None, cache: bool = True):
+        '''Opens the model stored at `file`, creating it if it doesn't exist.
+
+        SQLite databases are stored row by row, all other files as JSON. With
+        `journal` changes to a JSON database are appended to a journal next to the
+        file instead of rewriting it. With a `write_delay` (in seconds) changes
+        are written by a background thread, coalescing all changes made within
+        the delay. With `cache` the model read from a JSON database is cached
+        next to it, so that it opens without parsing the JSON the next time.'''
         self._file = Path(file)
-        self._json: ModelDict = self.TEMPLATE
-        if not os.path.exists(self._file):
-            self._create()
-        self._read()
-
-    def _create(self):        
-        if self._file.exists():
-            raise PermissionError(f'File {self._file} already exists, cannot create.')
-        self._file.touch(0o664)
-        self._json = self.TEMPLATE
-        self._update()
+        self._storage = storage or open_storage(self._file, journal)
+        self._batch_depth = 0
+        self._pending: List[Record] = []
+        self._unwritten: List[Record] = []
+        self._incoming: List[Record] = []   # changes of other processes read but not merged yet
+        self._lock = threading.RLock()      # guards the in-memory model against the writer and search threads
+        self._io_lock = threading.Lock()    # serialises the use of the storage
+        self._writer: Optional[BackgroundWriter] = None
+        self._listeners: List[Callable[[ModelEvent], None]] = []
+        self._info: ModelInfo = self.TEMPLATE['info']
+        self._exported = 0.0
+        self._duo: Dict[str, Optional[int]] = {}    # duo word -> card id
+        self._cards: Dict[int, Card] = {}
+        self._ids: Dict[str, int] = {}              # anki key -> card id
+        self._keys: List[Optional[str]] = []        # card id -> anki key, None once the card is removed
+        self._cards_by_word: Dict[str, List[Card]] = {}
+        self._cards_by_tag: Dict[str, Set[int]] = {}  # tag -> ids of the cards having it
+        self._duo_words_by_card: Dict[int, Set[str]] = {}
+        self._duo_index: Optional[SearchIndex] = None
+        self._anki_index: Optional[SearchIndex] = None
+        self._integrity = IntegrityReport({}, [], [], [])   # as found when the model was read
+        self._cleanup: List[Record] = []    # records fixing the malformed entries, then removing the orphans, one each in report order
+        self._cache = cache
+        self._version = 0   # bumped by every change, invalidates the memoized queries
+        self._queries = QueryCache()
+        self._history = History()
+        self._cached_version: Optional[Hashable] = None  # of the snapshot the cache was made from
+        with self._storage.locked():
+            if not self._storage.exists():
+                self._create()
+            self._read()
+        if write_delay is not None:
+            self._writer = BackgroundWriter(self._write_unwritten, write_delay)
+
+    @staticmethod
+    def migrate(src: str, dst: str):
+        '''Copies the database at `src` into a new database at `dst`, e.g. from JSON to SQLite.'''
+        model = Model(src)
+        try:
+            model.save_as(dst)
+        finally:
+            model.close()
 
+    def save_as(self, file: str):
+        '''Writes the model to a new database, whose format is chosen by its suffix.'''
+        with self._lock:
+            data = self._to_dict()     # copied into new containers, written without holding the lock
+        storage = open_storage(Path(file))
+        try:
+            storage.create(data)
+        finally:
+            storage.close()
+
+    def _create(self):
+        self._storage.create(self.TEMPLATE)
+
+    @timed
     def _read(self):
-        with open(self._file, 'r') as f:
-            try:
-                self._json = json.load(f)
-            except JSONDecodeError:
-                raise Model.ModelError('Invalid File')
+        version = self._storage.version() if self._cache else None
+        state = load_cache(cache_file(self._file), version) if version is not None else None
+        try:
+            if state is not None:
+                try:
+                    self._restore(state)
+                except (ValueError, TypeError, KeyError, AttributeError):
+                    state = None    # not the layout of this version after all, read the database
+            if state is not None:
+                self._cached_version = version
+                records = self._storage.load_records()
+            else:
+                data, records = self._storage.load()
+                self._integrity = self._load(self._completed(data))
+        except StorageError:
+            raise Model.ModelError('Invalid File')
+        for record in records:
+            self._apply(record)
+        if records:
+            self._replayed(records)
+
+    def _completed(self, data: ModelDict) -> ModelDict:
+        '''Checks the parts of stored data and adds those missing, as in data
+        written by an older version.'''
+        if not isinstance(data, dict):
+            raise Model.ModelError('Invalid File')
+        for key, value in self.TEMPLATE.items():
+            data.setdefault(key, value)
+        if not all(isinstance(data[key], dict) for key in ('duo', 'anki', 'stamps', 'tags')):
+            raise Model.ModelError('Invalid File')
+        return data
+
+    def _replayed(self, records: Sequence[Record]):
+        '''Updates the problems found when the model was read after replaying the
+        records of a journal over it, which may have fixed them, e.g. by a repair
+        made since the last compaction.'''
+        replaced = {target for record in records for target in _targets(record)}
+        integrity = self._integrity
+        count = len(integrity.malformed)
+        malformed = [(entry, record) for entry, record in zip(integrity.malformed, self._cleanup[:count])
+            if replaced.isdisjoint(_targets(record))]
+        orphans = [(anki_key, record) for anki_key, record in zip(integrity.orphans, self._cleanup[count:])
+            if replaced.isdisjoint(_targets(record))]
+        duplicates, dangling = self._linking_problems()
+        self._integrity = IntegrityReport(duplicates, dangling, [anki_key for anki_key, _ in orphans], [entry for entry, _ in malformed])
+        self._cleanup = [record for _, record in malformed + orphans]
+
+    def _load(self, data: ModelDict) -> IntegrityReport:
+        '''Builds the in-memory representation of the stored model and its
+        lookups anki word -> cards, tag -> cards and card -> duo words. The
+        entries are checked in the same pass, malformed ones are left out.
+        Returns the problems found.'''
+        malformed: List[str] = []
+        self._cleanup = []
+        self._info = data['info']
+        if not isinstance(self._info, dict) or not all(isinstance(self._info.get(key), str) for key in ('name', 'lang')):
+            malformed.append(f'info {self._info!r}')
+            self._info = self.TEMPLATE['info']
+            self._cleanup.append(['info', self._info])
+        self._exported = data['exported']
+        if not isinstance(self._exported, (int, float)):
+            malformed.append(f'export time {self._exported!r}')
+            self._exported = 0.0
+            self._cleanup.append(['exported', 0.0])
+        stamps, tags = data['stamps'], data['tags']
+        self._clear()
+        duplicated: Set[str] = set()
+        for key, entry in data['anki'].items():
+            if not isinstance(entry, (list, tuple)) or len(entry) != 2 or not all(isinstance(field, str) for field in entry):
+                malformed.append(f'card {key}: {entry!r}')
+                self._cleanup.append(['anki-', key])
+                continue
+            stamp = stamps.get(key, 0.0)
+            if not isinstance(stamp, (int, float)):
+                malformed.append(f'stamp of card {key}: {stamp!r}')
+                stamp = 0.0     # the card is kept, as if changed before any export
+                self._cleanup.append(['anki', key, entry[0], entry[1], stamp])
+            card_id = self._card_id(key)
+            card = Card(card_id, entry[0], entry[1], stamp)
+            self._cards[card.id] = card
+            cards = self._cards_by_word.setdefault(card.word, [])
+            cards.append(card)
+            if len(cards) == 2:
+                duplicated.add(card.word)
+            if key in tags:
+                if isinstance(tags[key], list) and all(isinstance(tag, str) for tag in tags[key]):
+                    self._tag_card(card, tags[key])
+                else:
+                    malformed.append(f'tags of card {key}: {tags[key]!r}')
+                    self._cleanup.append(['tags', key, [], stamp])
+        dangling: List[str] = []
+        for duo_word, key in data['duo'].items():
+            if key is not None and not isinstance(key, str):
+                malformed.append(f'link of {duo_word!r}: {key!r}')
+                self._cleanup.append(['duo', duo_word, None])
+                key = None
+            duo_word = sys.intern(duo_word)
+            card_id = self._duo[duo_word] = None if key is None else self._card_id(key)
+            if card_id is not None:
+                self._duo_words_by_card.setdefault(card_id, set()).add(duo_word)
+                if card_id not in self._cards:
+                    dangling.append(duo_word)
+        orphans = sorted((stamps.keys() | tags.keys()) - data['anki'].keys())
+        self._cleanup.extend(['anki-', key] for key in orphans)
+        duplicates = {word: [self._keys[card.id] for card in self._cards_by_word[word]] for word in duplicated}
+        return IntegrityReport(duplicates, dangling, orphans, malformed)
+
+    def _clear(self):
+        self._ids, self._keys = {}, []
+        self._cards = {}
+        self._cards_by_word = {}
+        self._cards_by_tag = {}
+        self._duo = {}
+        self._duo_words_by_card = {}
+        self._duo_index = self._anki_index = None   # built by the first search
+
+    def _cached_state(self) -> tuple:
+        '''Returns the in-memory model for the cache as plain values: the cards
+        as columns and the lookups by card id as they are.'''
+        cards = list(self._cards.values())
+        return (
+            self._info, self._exported, self._keys,
+            [card.id for card in cards], [card.word for card in cards], [card.translation for card in cards],
+            [card.stamp for card in cards], [card.tags for card in cards],
+            self._duo, self._duo_words_by_card, self._cards_by_tag,
+            # the problems an uncached open finds: those in the model as it is now
+            (*self._linking_problems(), self._integrity.orphans, self._integrity.malformed), self._cleanup,
+        )
+
+    def _restore(self, state: tuple):
+        '''Builds the in-memory model from the cached state, which was checked
+        when the model it was made from was read.'''
+        info, exported, keys, ids, words, translations, stamps, tags, duo, duo_words_by_card, cards_by_tag, integrity, cleanup = state
+        self._clear()
+        self._info, self._exported = info, exported
+        self._keys = keys
+        self._ids = {anki_key: card_id for card_id, anki_key in enumerate(keys) if anki_key is not None}
+        for card_id, anki_word, translation, stamp, card_tags in zip(ids, words, translations, stamps, tags):
+            card = self._cards[card_id] = Card(card_id, anki_word, translation, stamp)
+            card.tags = card_tags
+            self._cards_by_word.setdefault(card.word, []).append(card)
+        self._duo = duo
+        self._duo_words_by_card = duo_words_by_card
+        self._cards_by_tag = cards_by_tag
+        self._integrity = IntegrityReport(*integrity)
+        self._cleanup = cleanup
+
+    def integrity(self) -> IntegrityReport:
+        '''Returns the problems found when the model was read.'''
+        return self._integrity
+
+    @timed
+    def check(self, repair: bool = False) -> IntegrityReport:
+        '''Returns the problems of the model: cards sharing a front side, words
+        linked to missing cards, and entries left out when reading it. With
+        `repair` they are fixed as one undoable change: the cards sharing a front
+        side are merged into the first one, the missing cards are unlinked and the
+        entries left out are removed from the storage.'''
+        report = IntegrityReport(*self._linking_problems(), self._integrity.orphans, self._integrity.malformed)
+        if repair and not report.ok:
+            with self.batch():
+                for anki_word in report.duplicates:
+                    self._merge_cards(self._cards_by_word[anki_word])
+                self._commit(*(['duo', duo_word, None] for duo_word in report.dangling))
+                self._commit(*self._cleanup)
+            self._integrity = IntegrityReport({}, [], [], [])
+            self._cleanup = []
+        return report
+
+    def _linking_problems(self) -> Tuple[Dict[str, List[str]], List[str]]:
+        '''Returns the cards sharing a front side and the words linked to missing cards.'''
+        with self._lock:
+            return ({word: [self._keys[card.id] for card in cards] for word, cards in self._cards_by_word.items() if len(cards) > 1},
+                [duo_word for duo_word, card_id in self._duo.items() if card_id is not None and card_id not in self._cards])
+
+    def _merge_cards(self, cards: List[Card]):
+        '''Merges cards sharing a front side into the first of them, keeping all
+        translations, tags and linked words.'''
+        card, *others = cards
+        anki_key = self._keys[card.id]
+        translations = list(dict.fromkeys(other.translation for other in cards if other.translation))
+        tags = set(card.tags).union(*(other.tags for other in others))
+        stamp = time.time()
+        if translations != [card.translation] and translations:
+            self._commit(['anki', anki_key, card.word, ', '.join(translations), stamp])
+        if tags != set(card.tags):
+            self._commit(['tags', anki_key, sorted(tags), stamp])
+        for other in others:
+            self._commit(*(['duo', duo_word, anki_key] for duo_word in sorted(self._duo_words_by_card.get(other.id, ()))))
+            self._commit(['anki-', self._keys[other.id]])
+
+    def _card_id(self, anki_key: str) -> int:
+        '''Returns the id of the card with the given key, assigning one to new keys.'''
+        card_id = self._ids.get(anki_key)
+        if card_id is None:
+            card_id = self._ids[anki_key] = len(self._keys)
+            self._keys.append(sys.intern(anki_key))
+        return card_id
+
+    def _key(self, card_id: Optional[int]) -> Optional[str]:
+        return None if card_id is None else self._keys[card_id]
+
+    def _to_dict(self) -> ModelDict:
+        keys = self._keys
+        return {
+            'info': self._info,
+            'duo': {duo_word: None if card_id is None else keys[card_id] for duo_word, card_id in self._duo.items()},
+            'anki': {keys[card.id]: (card.word, card.translation) for card in self._cards.values()},
+            'stamps': {keys[card.id]: card.stamp for card in self._cards.values()},
+            'tags': {keys[card.id]: list(card.tags) for card in self._cards.values() if card.tags},
+            'exported': self._exported,
+        }
+
+    @timed
+    def _dump(self) -> str:
+        '''Serialises the model. Only copying it holds the lock, which _to_dict()
+        does into new containers of immutable values, so the searches and the
+        edits of other threads don't wait for the serialisation.'''
+        with self._lock:
+            data = self._to_dict()
+        return json.dumps(data)
+
+    def _snapshot(self) -> str:
+        '''Serialises the model for the storage to replace its snapshot with, which
+        drops the malformed and orphaned entries stored before.'''
+        text = self._dump()
+        with self._lock:
+            self._integrity = self._integrity._replace(orphans=[], malformed=[])
+            self._cleanup = []
+        return text
+
+    def compact(self):
+        '''Folds the journal of a JSON database back into its snapshot.'''
+        self.flush()
+        with self._io_lock:
+            self._storage.compact(self._snapshot)
+
+    def flush(self):
+        '''Blocks until all changes are written to disk.'''
+        if self._writer:
+            self._writer.flush()
+
+    def close(self):
+        '''Writes all pending changes, stops the background writer and closes the storage.'''
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        with self._io_lock:
+            with self._storage.locked():
+                self._save_cache()
+            self._storage.close()
+
+    def _save_cache(self):
+        '''Caches the model if the snapshot changed since the cache was made.
+        Records in a journal are not an issue, they are replayed over the cache.'''
+        version = self._storage.version() if self._cache else None
+        if version is None or version == self._cached_version:
+            return
+        with self._lock:
+            state = self._cached_state()
+        save_cache(cache_file(self._file), version, state)
+        self._cached_version = version
+
+    @contextmanager
+    def batch(self) -> Iterator[Model]:
+        '''Defers persisting the changes made inside the block to a single write
+        when the outermost block exits. The changes are undone as one step.'''
+        if not self._batch_depth:
+            self._history.begin()
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._history.end()
+                if self._pending:
+                    with self._lock:
+                        self._unwritten.extend(self._pending)
+                        self._pending = []
+                    self._request_write()
 
+    def _commit(self, *records: Record, undoable: bool = True) -> List[Record]:
+        '''Applies and persists the records, and returns the records reverting
+        them. Undoable changes are recorded in the history as one step.'''
+        with self._lock:
+            inverse = []
+            for record in records:
+                reverting = self._inverse(record)
+                if reverting != [record]:   # else it changes nothing
+                    inverse.append(reverting)
+                self._apply(record)
+            (self._pending if self._batch_depth else self._unwritten).extend(records)
+        if not self._batch_depth:
+            self._request_write()
+        step = [record for reverting in reversed(inverse) for record in reverting]
+        if undoable:
+            self._history.add(step)
+        return step
 
-    def _update(self):
-        with open(self._file, 'w') as f:
-            json.dump(self._json, f)
+    def _inverse(self, record: Record) -> List[Record]:
+        '''Returns the records reverting the given one, to be applied in order.'''
+        op, *args = record
+        if op == 'info':
+            return [['info', self._info]]
+        if op == 'duo':
+            duo_word, _ = args
+            if duo_word not in self._duo:
+                return [['duo-', duo_word]]
+            return [['duo', duo_word, self._key(self._duo[duo_word])]]
+        if op == 'duo-':
+            duo_word, = args
+            return [['duo', duo_word, self._key(self._duo[duo_word])]] if duo_word in self._duo else []
+        if op == 'exported':
+            return [['exported', self._exported]]
+        anki_key = args[0]
+        card = self._cards.get(self._ids.get(anki_key, -1))
+        if op == 'anki':
+            return [['anki-', anki_key]] if card is None else [['anki', anki_key, card.word, card.translation, card.stamp]]
+        if card is None:
+            return []
+        if op == 'tags':
+            return [['tags', anki_key, list(card.tags), card.stamp]]
+        # 'anki-' unlinks the words of the card as well
+        inverse = [['anki', anki_key, card.word, card.translation, card.stamp]]
+        if card.tags:
+            inverse.append(['tags', anki_key, list(card.tags), card.stamp])
+        inverse.extend(['duo', duo_word, anki_key] for duo_word in sorted(self._duo_words_by_card.get(card.id, ())))
+        return inverse
+
+    def can_undo(self) -> bool:
+        return self._history.can_undo()
+
+    def can_redo(self) -> bool:
+        return self._history.can_redo()
+
+    @timed
+    def undo(self) -> bool:
+        '''Reverts the last change; all changes of a batch or of a method changing
+        several words are reverted together. Returns whether there was one.'''
+        step = self._history.pop_undo()
+        if step is None:
+            return False
+        self._history.push_redo(self._commit(*self._restamped(step), undoable=False))
+        return True
+
+    @timed
+    def redo(self) -> bool:
+        '''Makes the last undone change again. Returns whether there was one.'''
+        step = self._history.pop_redo()
+        if step is None:
+            return False
+        self._history.push_undo(self._commit(*self._restamped(step), undoable=False))
+        return True
+
+    @staticmethod
+    def _restamped(step: List[Record]) -> List[Record]:
+        '''Returns the records of an undo or redo step with the cards stamped now.
+        They restore the content of the cards, but are a new change to what keeps
+        the newer version, Anki and the delta export.'''
+        stamp = time.time()
+        return [[*record[:4], stamp] if record[0] == 'anki' else [*record[:3], stamp] if record[0] == 'tags' else record
+            for record in step]
+
+    def _request_write(self):
+        '''Writes the unwritten records, by the background writer if there is one.'''
+        if self._writer:
+            self._writer.request()
+        else:
+            self._write_unwritten()
+
+    @timed
+    def _write(self, records: Sequence[Record]):
+        '''Called with the io lock held.'''
+        with self._storage.locked():
+            self._merge(records)
+            self._storage.write(records, self._snapshot)
+
+    def reload(self) -> bool:
+        '''Merges the changes other processes made to the database since it was
+        read or written, e.g. by a scheduled import. Returns whether there were any.'''
+        with self._io_lock, self._storage.locked():
+            return self._merge(())
+
+    @timed
+    def read_changes(self) -> bool:
+        '''Reads the changes other processes made to the database, as reload()
+        does, but leaves merging them to merge_changes(). Reading them takes the
+        time, so that it can run on a worker thread while merging them on the
+        thread owning the model is quick. Returns whether there are any.'''
+        with self._io_lock, self._storage.locked():
+            changes, full = self._read_changes()
+            with self._lock:
+                # a full comparison is made without the changes read before, and replaces them
+                self._incoming = changes if full else self._incoming + changes
+                return bool(self._incoming)
+
+    @timed
+    def merge_changes(self) -> bool:
+        '''Merges the changes read by read_changes(). Returns whether there were
+        any, False while the model is written or searched, as a write merges them
+        itself and a search leaves them for the next call.'''
+        if not self._io_lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                incoming, self._incoming = self._incoming, []
+                if incoming:
+                    for record in (*incoming, *self._unwritten, *self._pending):
+                        self._apply(record)
+            return bool(incoming)
+        finally:
+            self._io_lock.release()
+
+    def _read_changes(self) -> Tuple[List[Record], bool]:
+        '''Returns the records other processes wrote to the database since it was
+        read or written, and whether they were found by comparing the whole
+        database with the model. Called with the storage locked.'''
+        try:
+            changes = self._storage.changes()
+            if changes is not None:
+                return changes, False
+            data, records = self._storage.load()
+        except StorageError:
+            raise Model.ModelError('Invalid File')
+        data = self._completed(data)
+        with self._lock:
+            current = self._to_dict()
+        # changes made meanwhile are not written yet, and applied after the diff
+        return diff_records(current, data) + records, True
+
+    @timed
+    def _merge(self, local: Sequence[Record]) -> bool:
+        '''Applies the changes other processes wrote to the database, then the
+        `local` records about to be written and those not written yet, so that
+        the changes made by this model win. Called with the storage locked.'''
+        changes, full = self._read_changes()
+        with self._lock:
+            incoming = [] if full else self._incoming
+            self._incoming = []
+            if not incoming and not changes:
+                return False
+            for record in (*incoming, *changes, *local, *self._unwritten, *self._pending):
+                self._apply(record)
+        return True
+
+    def _write_unwritten(self):
+        # the records are taken and written under the io lock, so that searches
+        # answered by the storage find every record either stored or unwritten
+        with self._io_lock:
+            with self._lock:
+                records, self._unwritten = self._unwritten, []
+            if records:
+                try:
+                    self._write(records)
+                except BaseException:
+                    with self._lock:
+                        self._unwritten[:0] = records
+                    raise
+
+    def _unsynced(self) -> List[Record]:
+        '''Returns the records applied to the model but not stored yet, those of
+        an open batch included. Called with the io lock held.'''
+        with self._lock:
+            return self._unwritten + self._pending
+
+    def _overlay(self, words: List[str], changed: Set[str], filter: str, matches: Callable[[str], bool]) -> List[str]:
+        '''Corrects the words a storage search returned for the records not stored
+        yet: the `changed` words are matched against the model instead.'''
+        with self._lock:
+            added = [word for word in changed if match_rank(word, filter) is not None and matches(word)]
+        if not added and changed.isdisjoint(words):
+            return words
+        return sorted([word for word in words if word not in changed] + added, key=lambda word: (match_rank(word, filter), word))
+
+    def _apply(self, record: Record):
+        '''Applies a single mutation to the in-memory model and its indexes.
+
+        Records describe the resulting state rather than the change, so applying
+        one twice (e.g. replaying a journal over a newer snapshot) is harmless.'''
+        op, *args = record
+        self._version += 1
+        if op == 'info':
+            info, = args
+            self._info = info
+            self._emit(ModelEvent('info'))
+        elif op == 'duo':
+            duo_word, anki_key = args
+            duo_word = sys.intern(duo_word)
+            card_id = None if anki_key is None else self._card_id(anki_key)
+            is_new = duo_word not in self._duo
+            old_id = self._duo.get(duo_word)
+            if is_new and self._duo_index is not None:
+                self._duo_index.add(duo_word)
+            self._index_link(duo_word, old_id, card_id)
+            self._duo[duo_word] = card_id
+            if is_new:
+                self._emit(ModelEvent('duo-added', duo_word, anki_key))
+            elif old_id != card_id:
+                self._emit(ModelEvent('duo-linked', duo_word, anki_key, self._key(old_id)))
+        elif op == 'duo-':
+            duo_word, = args
+            if duo_word in self._duo:
+                old_id = self._duo.pop(duo_word)
+                self._index_link(duo_word, old_id, None)
+                if self._duo_index is not None:
+                    self._duo_index.remove(duo_word)
+                self._emit(ModelEvent('duo-removed', duo_word, None, self._key(old_id)))
+        elif op == 'anki':
+            anki_key, anki_word, translation, *stamp = args
+            card_id = self._card_id(anki_key)
+            card = self._cards.get(card_id)
+            old_entry = None
+            if card is None:
+                card = self._cards[card_id] = Card(card_id, anki_word, translation, stamp[0] if stamp else 0.0)
+            else:   # updated in place, keeping its position in the export
+                old_entry = (card.word, card.translation)
+                self._unindex_card(card)
+                card.set(anki_word, translation, stamp[0] if stamp else 0.0)
+            self._cards_by_word.setdefault(card.word, []).append(card)
+            if self._anki_index is not None:
+                self._anki_index.add(card.word)
+            if old_entry is None:
+                self._emit(ModelEvent('anki-added', None, anki_key))
+            else:
+                self._emit(ModelEvent('anki-changed', None, anki_key, old_entry))
+        elif op == 'anki-':
+            anki_key, = args
+            card_id = self._ids.pop(anki_key, -1)   # released, as nothing refers to it once the words are unlinked
+            card = self._cards.pop(card_id, None)
+            if card is not None:
+                self._unindex_card(card)
+                self._tag_card(card, ())
+            for duo_word in self._duo_words_by_card.pop(card_id, ()):
+                self._duo[duo_word] = None
+                self._emit(ModelEvent('duo-linked', duo_word, None, anki_key))
+            if card_id >= 0:
+                self._keys[card_id] = None
+            if card is not None:
+                self._emit(ModelEvent('anki-removed', None, anki_key, (card.word, card.translation)))
+        elif op == 'tags':
+            anki_key, tags, stamp = args
+            card = self._cards.get(self._ids.get(anki_key, -1))
+            if card is not None:    # else removed since
+                self._tag_card(card, tags)
+                card.stamp = stamp
+                self._emit(ModelEvent('anki-changed', None, anki_key, (card.word, card.translation)))
+        elif op == 'exported':
+            self._exported, = args
+        else:
+            raise Model.ModelError(f'Unknown record {op}')
+
+    def subscribe(self, listener: Callable[[ModelEvent], None]):
+        '''Calls `listener` with a ModelEvent for every change of the model.'''
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[ModelEvent], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _emit(self, event: ModelEvent):
+        for listener in self._listeners:
+            listener(event)
+
+    def _index_link(self, duo_word: str, old_id: Optional[int], card_id: Optional[int]):
+        if old_id is not None:
+            linked = self._duo_words_by_card.get(old_id)
+            if linked is not None:
+                linked.discard(duo_word)
+                if not linked:
+                    del self._duo_words_by_card[old_id]
+        if card_id is not None:
+            self._duo_words_by_card.setdefault(card_id, set()).add(duo_word)
+
+    def _unindex_card(self, card: Card):
+        cards = self._cards_by_word[card.word]
+        cards.remove(card)
+        if not cards:
+            del self._cards_by_word[card.word]
+        if self._anki_index is not None:
+            self._anki_index.remove(card.word)
+
+    def _tag_card(self, card: Card, tags: Iterable[str]):
+        for tag in card.tags:
+            tagged = self._cards_by_tag[tag]
+            tagged.discard(card.id)
+            if not tagged:
+                del self._cards_by_tag[tag]
+        card.tags = tuple(sorted({sys.intern(tag) for tag in tags}))
+        for tag in card.tags:
+            self._cards_by_tag.setdefault(tag, set()).add(card.id)
+
+    def _tagged_cards(self, tags: Sequence[str]) -> List[Card]:
+        '''Returns the cards having all given tags in the order they were added,
+        intersecting the tag indexes from the smallest on.'''
+        tagged = sorted((self._cards_by_tag.get(tag, set()) for tag in set(tags)), key=len)
+        card_ids = tagged[0].intersection(*tagged[1:])
+        return [self._cards[card_id] for card_id in sorted(card_ids)]
 
     def update_model_info(self, info: ModelInfo):
-        self._json['info'] = info
-        self._update()
+        self._commit(['info', info])
 
+    @timed
+    @memoized
     def get_duo_words(self, filter: str='', unassigned_only: bool=False) -> List[str]:
-        start_matches = sorted([duo_word for duo_word, anki_key in self._json['duo'].items() if (duo_word.lower().startswith(filter.lower())) and (unassigned_only == False or self._json['duo'][duo_word] not in self._json['anki'])])
-        other_matches = sorted([duo_word for duo_word, anki_key in self._json['duo'].items() if (filter.lower() in duo_word.lower()) and (unassigned_only == False or self._json['duo'][duo_word] not in self._json['anki']) and (duo_word not in start_matches)])        
-        return start_matches + other_matches
+        if self._storage.SEARCHABLE:
+            with self._io_lock:
+                unsynced = self._unsynced()
+                words = self._storage.search_duo_words(filter, unassigned_only)
+                if not unsynced:
+                    return words
+                changed = {args[0] for op, *args in unsynced if op in ('duo', 'duo-')}
+                if unassigned_only:     # adding or removing a card assigns or unassigns its words
+                    changed.update(self._storage.linked_duo_words({args[0] for op, *args in unsynced if op in ('anki', 'anki-')}))
+            return self._overlay(words, changed, filter,
+                lambda duo_word: duo_word in self._duo and (not unassigned_only or self.is_duo_word_unassigned(duo_word)))
+        with self._lock:
+            if filter:
+                start_matches, other_matches = self._duo_search_index().search(filter)
+                matches = start_matches + other_matches
+            else:
+                matches = sorted(self._duo)
+            if unassigned_only:
+                return [duo_word for duo_word in matches if self.is_duo_word_unassigned(duo_word)]
+        return matches
+
+    def _duo_search_index(self) -> SearchIndex:
+        '''Returns the search index of the duo words, built by the first search
+        with a filter so that opening a model doesn't pay for it. Called with the
+        lock held.'''
+        if self._duo_index is None:
+            self._duo_index = SearchIndex(self._duo)
+        return self._duo_index
 
+    def has_duo_word(self, duo_word: str) -> bool:
+        return duo_word in self._duo
+
+    def is_duo_word_unassigned(self, duo_word: str) -> bool:
+        return self._duo[duo_word] not in self._cards
+
+    @timed
+    @memoized
     def get_duo_words_from_anki_key(self, anki_key: str) -> List[str]:
-        return sorted([duo_word for duo_word, _anki_key in self._json['duo'].items() if anki_key == _anki_key])
+        return sorted(self._duo_words_by_card.get(self._ids.get(anki_key), ())) # type: ignore
 
-    def get_duo_words_from_anki_word(self, anki_word: str):
-        return self.get_duo_words_from_anki_key(self.get_anki_key_from_anki_word(anki_word))
+    def get_duo_words_from_anki_word(self, anki_word: str) -> List[str]:
+        '''Returns the words linked to the card of the Anki word, none if it has
+        no card. Unlike get_anki_key_from_anki_word() it never creates one.'''
+        cards = self._cards_by_word.get(anki_word)
+        return self.get_duo_words_from_anki_key(self._keys[cards[0].id]) if cards else [] # type: ignore
 
-    def update_duo_new_words_from_file(self, file: str):
+    def update_duo_new_words_from_file(self, file: str, progress: Optional[Progress] = None) -> ImportReport:
         '''Updates the model JSON file with newly learned Duolingo words.'''
         with open(file, 'r') as f:
-            self._update_duo_new_words(json.load(f))        
+            return self.import_duo_words(f, progress, os.path.getsize(file))
+
+    def update_duo_new_words_from_str(self, duo_str: str, progress: Optional[Progress] = None) -> ImportReport:
+        return self.import_duo_words(io.StringIO(duo_str), progress, len(duo_str))
 
-    def update_duo_new_words_from_str(self, duo_str: str):
-        self._update_duo_new_words(json.loads(duo_str))
+    def import_duo_words(self, stream: TextIO, progress: Optional[Progress] = None, size: Optional[int] = None) -> ImportReport:
+        '''Adds the words of a Duolingo vocabulary export read from `stream` that
+        are not in the model yet, with a single write. `progress` is called with
+        the characters read and the `size` of the stream; an exception it raises
+        aborts the import before the model is changed.'''
+        return self.add_duo_words(self.read_duo_words(stream, progress, size))
 
-    def _update_duo_new_words(self, duo_json: dict):
-        for _word in duo_json['vocab_overview']:
-            word = _word['word_string']
-            if word not in self._json['duo']:
-                self._json['duo'].update({word: None})
-        self._update()
+    @staticmethod
+    @timed
+    def read_duo_words(stream: TextIO, progress: Optional[Progress] = None, size: Optional[int] = None) -> List[str]:
+        '''Returns the words of a Duolingo vocabulary export, once each, in the
+        order of the export. Parsing takes the time of an import, so it can run on
+        a worker thread and add_duo_words() on the thread owning the model.'''
+        return list(dict.fromkeys(iter_vocab_words(stream, progress and (lambda read: progress(read, size)))))
+
+    @timed
+    def add_duo_words(self, duo_words: Sequence[str]) -> ImportReport:
+        '''Adds the words of an export read by read_duo_words() that are not in
+        the model yet, with a single write.'''
+        words = dict.fromkeys(duo_words)
+        # the batch defers the write until the lock is released
+        with self.batch(), self._lock:
+            known = words.keys() & self._duo.keys()
+            missing = self._duo.keys() - words.keys()
+            added = [word for word in words if word not in known]
+            if added:
+                self._commit(*(['duo', word, None] for word in added))
+        return ImportReport(added, sorted(known), sorted(missing))
 
     def delete_duo_word(self, duo_word: str):
-        try:
-            self._json['duo'].pop(duo_word)
-        except KeyError:
+        if duo_word not in self._duo:
             raise Model.ModelError('Duo key not in dict!')
-        self._update()
+        self._commit(['duo-', duo_word])
+
+    @timed
+    def delete_duo_words(self, duo_words: Iterable[str]):
+        duo_words = list(duo_words)
+        for duo_word in duo_words:
+            if duo_word not in self._duo:
+                raise Model.ModelError(f'Duo key {duo_word} not in dict!')
+        self._commit(*(['duo-', duo_word] for duo_word in duo_words))
 
     def link_duo_word_to_anki_word(self, duo_word: str, anki_word: str):
-        anki_key = self.get_anki_key_from_anki_word(anki_word)
-        self._json['duo'].update({duo_word: anki_key})
-        self._update()
+        self.link_many([duo_word], anki_word)
+
+    @timed
+    def link_many(self, duo_words: Iterable[str], anki_word: str):
+        '''Links all the given Duolingo words to a single Anki card, creating the card if needed.'''
+        with self.batch():
+            anki_key = self.get_anki_key_from_anki_word(anki_word)
+            self._commit(*(['duo', duo_word, anki_key] for duo_word in duo_words))
+
+    @timed
+    @memoized
+    def suggest_links(self) -> List[Suggestion]:
+        '''Suggests cards for the unassigned Duolingo words, grouping their
+        inflections by the rules of the model's language.'''
+        return suggest_links(self.get_duo_words(unassigned_only=True), self.get_anki_words(), self._info['lang'])
+
+    def accept_suggestions(self, suggestions: Iterable[Suggestion]):
+        '''Links the words of all given suggestions to their cards, creating the new cards.'''
+        with self.batch():
+            for suggestion in suggestions:
+                self.link_many(suggestion.duo_words, suggestion.anki_word)
 
     def unlink_duo_word(self, duo_word: str):
-        self._json['duo'][duo_word] = None
-        self._update()
+        self._commit(['duo', duo_word, None])
+
+    @timed
+    def unlink_many(self, duo_words: Iterable[str]):
+        self._commit(*(['duo', duo_word, None] for duo_word in duo_words))
+
+    @timed
+    @memoized
+    def get_anki_words(self, filter: str='', no_translation_only: bool = False, tags: Sequence[str] = ()) -> List[str]:
+        '''Returns the anki words containing the filter, those starting with it
+        first. With `tags` only the words of the cards having all of them are
+        searched, in time proportional to the number of such cards.'''
+        if tags:
+            folded = filter.lower()
+            start_words, other_words = set(), set()
+            with self._lock:
+                for card in self._tagged_cards(tags):
+                    if no_translation_only and card.translation != '':
+                        continue
+                    if card.folded.startswith(folded):
+                        start_words.add(card.word)
+                    elif folded in card.folded:
+                        other_words.add(card.word)
+            return sorted(start_words) + sorted(other_words - start_words)
+        if self._storage.SEARCHABLE:
+            with self._io_lock:
+                unsynced = self._unsynced()
+                words = self._storage.search_anki_words(filter, no_translation_only)
+                if not unsynced:
+                    return words
+                anki_keys = {args[0] for op, *args in unsynced if op in ('anki', 'anki-')}
+                changed = set(self._storage.anki_words(anki_keys))    # as stored
+            with self._lock:
+                changed.update(card.word for card in (self._cards.get(self._ids.get(anki_key, -1)) for anki_key in anki_keys) if card is not None)
+            return self._overlay(words, changed, filter,
+                lambda anki_word: self.has_anki_word(anki_word) and (not no_translation_only or self.is_anki_word_untranslated(anki_word)))
+        with self._lock:
+            if filter:
+                start_matches, other_matches = self._anki_search_index().search(filter)
+                matches = start_matches + other_matches
+            else:
+                matches = sorted(self._cards_by_word)
+            if no_translation_only:
+                return [anki_word for anki_word in matches if self.is_anki_word_untranslated(anki_word)]
+        return matches
+
+    def _anki_search_index(self) -> SearchIndex:
+        '''As _duo_search_index(), for the anki words.'''
+        if self._anki_index is None:
+            self._anki_index = SearchIndex(card.word for card in self._cards.values())
+        return self._anki_index
+
+    def has_anki_word(self, anki_word: str) -> bool:
+        return anki_word in self._cards_by_word
+
+    def is_anki_word_untranslated(self, anki_word: str) -> bool:
+        return any(card.translation == '' for card in self._cards_by_word[anki_word])
+
+    def is_anki_word_tagged(self, anki_word: str, tags: Sequence[str]) -> bool:
+        '''Returns whether a card of the word has all given tags.'''
+        return any(set(tags).issubset(card.tags) for card in self._cards_by_word.get(anki_word, ()))
+
+    def get_tags(self) -> List[str]:
+        '''Returns the tags of all cards.'''
+        return sorted(self._cards_by_tag)
+
+    def get_anki_tags(self, anki_key: str) -> List[str]:
+        card = self._cards.get(self._ids.get(anki_key, -1))
+        if card is None:
+            raise Model.ModelError(f"Key {anki_key} doesn't exist!")
+        return list(card.tags)
 
-    def get_anki_words(self, filter: str='', no_translation_only: bool = False) -> List[str]:
-        start_matches = sorted([anki_word for anki_word, translation in self._json['anki'].values() if (anki_word.lower().startswith(filter.lower())) and (no_translation_only == False or translation == '')])
-        other_matches = sorted([anki_word for anki_word, translation in self._json['anki'].values() if (filter.lower() in anki_word.lower()) and (no_translation_only == False or translation=='') and (anki_word not in start_matches)])
-        return start_matches + other_matches
+    def set_anki_tags(self, anki_key: str, tags: Iterable[str]):
+        if not self.has_anki_key(anki_key):
+            raise Model.ModelError(f"Key {anki_key} doesn't exist!")
+        self._commit(['tags', anki_key, sorted(set(tags)), time.time()])
 
     def get_anki_key_from_duo_word(self, duo_word: str) -> Optional[str]:
         try:
-            return self._json['duo'][duo_word]
+            return self._key(self._duo[duo_word])
         except KeyError:
             raise Model.ModelError(f"Duo word {duo_word} doesn't exist")
 
+    @timed
     def get_anki_key_from_anki_word(self, anki_word: str) -> str:
-        keys = [key for key in self._json['anki'] if self._json['anki'][key][0] == anki_word]
+        cards = self._cards_by_word.get(anki_word)
 
-        if not len(keys):
-            self.update_anki_entry(str(uuid.uuid4()), anki_word, '')
-            return self.get_anki_key_from_anki_word(anki_word)
-        key, = keys # should only be one
-        return key
+        if not cards:
+            key = str(uuid.uuid4())
+            self.update_anki_entry(key, anki_word, '')
+            return key
+        return self._keys[cards[0].id] # type: ignore # should only be one
 
+    def has_anki_key(self, anki_key: str) -> bool:
+        return self._ids.get(anki_key) in self._cards
+
+    @timed
     def get_anki_entry(self, anki_key) -> Tuple[str, str]:
-        try:
-            return self._json['anki'][anki_key]
-        except KeyError:
+        card = self._cards.get(self._ids.get(anki_key)) # type: ignore
+        if card is None:
             raise Model.ModelError(f"Key {anki_key} doesn't exist!")
+        return card.word, card.translation
 
+    @timed
     def update_anki_entry(self, anki_key: str, anki_word: str, translation: str):
-        self._json['anki'].update({anki_key: (anki_word, translation)})
-        self._update()
+        self._commit(['anki', anki_key, anki_word, translation, time.time()])
 
     def delete_anki_entry(self, anki_key: str):
-        try:
-            self._json['anki'].pop(anki_key)
-            for duo_word, key in self._json['duo'].items():
-                if key == anki_key:
-                    self.unlink_duo_word(duo_word)
-        except KeyError:
+        if not self.has_anki_key(anki_key):
             raise Model.ModelError(f"Anki key {anki_key} doesn't exist!")
-        self._update()
+        self._commit(['anki-', anki_key])
+
+    @timed
+    def delete_anki_entries(self, anki_keys: Iterable[str]):
+        anki_keys = list(anki_keys)
+        for anki_key in anki_keys:
+            if not self.has_anki_key(anki_key):
+                raise Model.ModelError(f"Anki key {anki_key} doesn't exist!")
+        self._commit(*(['anki-', anki_key] for anki_key in anki_keys))
+
+    def iter_anki_rows(self, since: Optional[float] = None, tags: Sequence[str] = ()) -> Iterator[Tuple[str, str]]:
+        '''Yields the (word, translation) of all cards, or of the cards changed
+        since the given time, and only of those having all given tags.'''
+        with self._lock:
+            cards = self._tagged_cards(tags) if tags else list(self._cards.values())
+        for card in cards:
+            if since is None or card.stamp >= since:
+                yield card.word, card.translation
+
+    def get_anki_notes(self, since: Optional[float] = None, tags: Sequence[str] = ()) -> List[Note]:
+        '''Returns the cards iter_anki_rows() yields, with their keys, tags and stamps.'''
+        with self._lock:
+            cards = self._tagged_cards(tags) if tags else self._cards.values()
+            return [Note(self._keys[card.id], card.word, card.translation, sorted(card.tags), card.stamp) # type: ignore
+                for card in cards if since is None or card.stamp >= since]
+
+    def mark_exported(self, stamp: float):
+        '''Records an export of the cards as they were at the given time as the
+        last export, the one delta exports continue from.'''
+        self._commit(['exported', stamp], undoable=False)
+
+    def _export(self, file_out, write: Callable[[str], int], partial: bool, record: bool) -> int:
+        '''Writes an export through a temporary file, so that a failed or cancelled
+        export leaves any existing file unchanged. Exports of all cards or of the
+        changed ones are recorded as the last export, if `record`.'''
+        stamp = time.time()
+        tmp_file = f'{file_out}.tmp'
+        try:
+            count = write(tmp_file)
+            os.replace(tmp_file, file_out)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        if record and not partial:
+            self.mark_exported(stamp)
+        return count
+
+    @timed
+    def export_anki_csv(self, file_out, delimiter: str = ';', encoding: str = 'utf-8', delta: bool = False, tags: Sequence[str] = (),
+            progress: Optional[Progress] = None, record: bool = True) -> int:
+        '''Writes the cards as CSV to be imported into Anki and returns the number
+        of cards written. With `delta` only the cards created or changed since the
+        last export are written. With `tags` only the cards having all of them are
+        written, e.g. for a deck of verbs; such partial exports don't count as
+        the last export.
+
+        `progress` is called with the cards written and their total; an exception
+        it raises aborts the export, leaving any existing file unchanged. Without
+        `record` the export is not recorded as the last export, e.g. to record it
+        with mark_exported() on the thread owning the model.'''
+        rows: Iterable[Tuple[str, str]] = self.iter_anki_rows(self._exported if delta else None, tags)
+        if progress:
+            rows = list(rows)
+            rows = _reporting(rows, progress, len(rows))
 
-    def export_anki_csv(self, file_out):
-        with open(file_out, 'w') as f:
-            f.write('\n'.join([f"{word};{trans}" for id, (word, trans) in self._json['anki'].items()]))
+        def write(file: str) -> int:
+            with open(file, 'w', encoding=encoding, newline='') as f:
+                return write_csv(f, rows, delimiter)
+        return self._export(file_out, write, bool(tags), record)
 
+    @timed
+    def export_anki_apkg(self, file_out, delta: bool = False, tags: Sequence[str] = (), progress: Optional[Progress] = None,
+            record: bool = True) -> int:
+        '''Writes the cards as an Anki package, to a deck named after the model,
+        and returns the number of cards written. Unlike a CSV import, importing
+        the package again updates the notes of the earlier import in place, so
+        exporting only the changed cards with `delta` is optional. `tags`,
+        `progress` and `record` work as for export_anki_csv().'''
+        notes = self.get_anki_notes(self._exported if delta else None, tags)
+        rows: Iterable[Note] = _reporting(notes, progress, len(notes)) if progress else notes
+        return self._export(file_out, lambda file: write_apkg(file, self._info['name'], rows), bool(tags), record)
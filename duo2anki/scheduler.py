@@ -0,0 +1,104 @@
+from __future__ import annotations
+import queue
+import threading
+import tkinter as tk
+from typing import Any, Callable, Optional, Tuple
+
+
+class SearchScheduler:
+    '''Runs searches for a Tk widget on a worker thread.
+
+    A search is started only once no newer one was submitted for `delay`
+    seconds, so a burst of keystrokes results in a single search. Searches
+    superseded by a newer one are dropped, before they start if they haven't
+    yet, and their results otherwise, so only the result of the latest search
+    is passed to its callback, on the Tk thread.'''
+
+    POLL_MS = 15    # interval results are polled for on the Tk thread
+
+    def __init__(self, widget: tk.Misc, delay: float = 0.15):
+        self._widget = widget
+        self._delay_ms = int(delay * 1000)
+        self._generation = 0    # number of the latest search, searches with lower numbers are stale
+        self._delivered = 0     # number of the latest search whose result was delivered (or dropped)
+        self._timer: Optional[str] = None
+        self._poll_timer: Optional[str] = None
+        self._cond = threading.Condition()
+        self._job: Optional[Tuple[int, Callable[[], Any], Callable[[Any], None]]] = None
+        self._results: queue.Queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='duo2anki-search', daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self) -> bool:
+        '''Whether the result of the latest search is still to come.'''
+        return self._delivered != self._generation
+
+    def submit(self, search: Callable[[], Any], done: Callable[[Any], None]):
+        '''Schedules `search` to run on the worker thread and `done` to be called
+        with its result on the Tk thread, unless a newer search is submitted first.'''
+        if self._closed:
+            raise RuntimeError('Scheduler is closed')
+        self._generation += 1
+        if self._timer is not None:
+            self._widget.after_cancel(self._timer)
+        self._timer = self._widget.after(self._delay_ms, self._start, self._generation, search, done)
+
+    def cancel(self):
+        '''Drops the pending search, if any.'''
+        self._generation += 1
+        self._delivered = self._generation
+        if self._timer is not None:
+            self._widget.after_cancel(self._timer)
+            self._timer = None
+        with self._cond:
+            self._job = None
+
+    def close(self):
+        self.cancel()
+        if self._poll_timer is not None:
+            self._widget.after_cancel(self._poll_timer)
+            self._poll_timer = None
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _start(self, generation: int, search: Callable[[], Any], done: Callable[[Any], None]):
+        self._timer = None
+        with self._cond:
+            self._job = (generation, search, done)  # replaces a job the worker hasn't taken yet
+            self._cond.notify_all()
+        if self._poll_timer is None:
+            self._poll_timer = self._widget.after(self.POLL_MS, self._poll)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._job is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                (generation, search, done), self._job = self._job, None
+            if generation != self._generation:
+                continue
+            try:
+                self._results.put((generation, done, search(), None))
+            except Exception as e:
+                self._results.put((generation, done, None, e))
+
+    def _poll(self):
+        self._poll_timer = None
+        while True:
+            try:
+                generation, done, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._generation:
+                continue
+            self._delivered = generation
+            if error is not None:
+                raise error     # reported by Tk like any error of a callback
+            done(result)
+        if self.busy and not self._closed:
+            self._poll_timer = self._widget.after(self.POLL_MS, self._poll)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+from bisect import bisect_left
+import sys
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+def fold(word: str) -> str:
+    '''Returns the case-folded word, the word itself if it is folded already so
+    that the common lowercase words are not stored twice.'''
+    folded = word.lower()
+    return word if folded == word else sys.intern(folded)
+
+
+class SearchIndex:
+    '''Case-insensitive prefix/substring index over a collection of words.
+
+    Prefix matches are answered from a sorted list of lowered words, substring
+    matches from a trigram index. The substring matches of the last query are
+    kept so that a query extending it (as happens while typing) only narrows
+    the previous result instead of searching again.'''
+
+    N = 3   # n-gram size
+
+    def __init__(self, words: Iterable[str] = ()):
+        self._counts: Dict[str, int] = {}
+        self._folded: Dict[str, str] = {}
+        self._sorted: List[Tuple[str, str]] = []
+        self._unsorted: List[Tuple[str, str]] = []    # added since the last search, merged lazily
+        self._grams: Dict[str, Set[str]] = {}
+        self._last: Optional[Tuple[str, Set[str]]] = None
+
+        for word in words:
+            if word in self._counts:
+                self._counts[word] += 1
+                continue
+            self._counts[word] = 1
+            folded = self._folded[word] = fold(word)
+            self._sorted.append((folded, word))
+            for gram in self._ngrams(folded):
+                self._grams.setdefault(gram, set()).add(word)
+        self._sorted.sort()
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self._counts
+
+    @classmethod
+    def _ngrams(cls, folded: str) -> Set[str]:
+        return {folded[i:i+cls.N] for i in range(len(folded) - cls.N + 1)}
+
+    def add(self, word: str):
+        if word in self._counts:
+            self._counts[word] += 1
+            return
+        self._counts[word] = 1
+        folded = self._folded[word] = fold(word)
+        self._unsorted.append((folded, word))
+        for gram in self._ngrams(folded):
+            self._grams.setdefault(gram, set()).add(word)
+        if self._last and self._last[0] in folded:
+            self._last[1].add(word)
+
+    def remove(self, word: str):
+        count = self._counts.get(word, 0)
+        if count > 1:
+            self._counts[word] = count - 1
+            return
+        if not count:
+            return
+        del self._counts[word]
+        folded = self._folded.pop(word)
+        self._merge()
+        del self._sorted[bisect_left(self._sorted, (folded, word))]
+        for gram in self._ngrams(folded):
+            words = self._grams[gram]
+            words.discard(word)
+            if not words:
+                del self._grams[gram]
+        if self._last:
+            self._last[1].discard(word)
+
+    def _merge(self):
+        if self._unsorted:
+            self._sorted.extend(self._unsorted)
+            self._sorted.sort()
+            self._unsorted = []
+
+    def _substring_matches(self, folded: str) -> Set[str]:
+        if self._last and folded.startswith(self._last[0]):
+            candidates: Iterable[str] = self._last[1]
+        elif len(folded) >= self.N:
+            grams = sorted((self._grams.get(gram, set()) for gram in self._ngrams(folded)), key=len)
+            candidates = grams[0].intersection(*grams[1:])
+        else:
+            candidates = self._counts
+        return {word for word in candidates if folded in self._folded[word]}
+
+    def _prefix_matches(self, folded: str) -> List[str]:
+        self._merge()
+        lo = bisect_left(self._sorted, (folded, ''))
+        hi = bisect_left(self._sorted, (folded + '\U0010ffff', ''))
+        return [word for _, word in self._sorted[lo:hi]]
+
+    def search(self, filter: str = '') -> Tuple[List[str], List[str]]:
+        '''Returns the sorted words starting with the filter, followed by the
+        sorted words otherwise containing it.'''
+        folded = filter.lower()
+        if not folded:
+            return sorted(self._counts), []
+
+        matches = self._substring_matches(folded)
+        self._last = (folded, matches)
+
+        start_matches = self._prefix_matches(folded)
+        other_matches = matches.difference(start_matches)
+        return sorted(start_matches), sorted(other_matches)
+
+
+def match_rank(word: str, filter: str) -> Optional[int]:
+    '''Returns 0 if the word starts with the filter, 1 if it otherwise contains
+    it and None if it doesn't match, ignoring case as SearchIndex.search does.'''
+    folded, word = filter.lower(), word.lower()
+    if word.startswith(folded):
+        return 0
+    if folded in word:
+        return 1
+    return None
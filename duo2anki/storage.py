@@ -0,0 +1,479 @@
+from __future__ import annotations
+from contextlib import AbstractContextManager, nullcontext
+import hashlib
+import json
+from json.decoder import JSONDecodeError
+import os
+from pathlib import Path
+import sqlite3
+from typing import TYPE_CHECKING, Callable, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from duo2anki import instrument
+from duo2anki.locking import FileLock, lock_file
+
+if TYPE_CHECKING:
+    from duo2anki.model import ModelDict, Record
+
+
+class StorageError(Exception): pass
+
+
+class Storage:
+    '''Persists a model, either as snapshots of the whole model or as the
+    records of the single changes made to it.'''
+
+    SEARCHABLE = False  # whether the storage answers word searches itself
+
+    def exists(self) -> bool:
+        raise NotImplementedError
+
+    def create(self, data: ModelDict):
+        raise NotImplementedError
+
+    def load(self) -> Tuple[ModelDict, List[Record]]:
+        '''Returns the stored model and the records to apply on top of it.'''
+        raise NotImplementedError
+
+    def load_records(self) -> List[Record]:
+        '''Returns only the records to apply on top of the stored model, for a
+        model restored from a cache of the snapshot.'''
+        return []
+
+    def version(self) -> Optional[Hashable]:
+        '''Returns a value identifying the stored snapshot, for caching the model
+        read from it. None if the storage can't be cached or the snapshot was
+        replaced by another process since this storage read or wrote it.'''
+        return None
+
+    def locked(self) -> AbstractContextManager:
+        '''Returns a context holding the database exclusively against other
+        processes, for reading it consistently or merging before writing.'''
+        return nullcontext()
+
+    def changes(self) -> Optional[List[Record]]:
+        '''Returns the records other processes wrote since this storage last read
+        or wrote the database, None if it can't tell which changed and the model
+        has to be loaded again. Called while locked().'''
+        return []
+
+    def write(self, records: Sequence[Record], dump: Callable[[], str]):
+        '''Persists the given records; `dump` serialises the whole model if needed.'''
+        raise NotImplementedError
+
+    def compact(self, dump: Callable[[], str]):
+        pass
+
+    def close(self):
+        pass
+
+    def search_duo_words(self, filter: str, unassigned_only: bool) -> List[str]:
+        raise NotImplementedError
+
+    def search_anki_words(self, filter: str, no_translation_only: bool) -> List[str]:
+        raise NotImplementedError
+
+    def linked_duo_words(self, anki_keys: Iterable[str]) -> List[str]:
+        '''Returns the stored duo words linked to the given keys.'''
+        raise NotImplementedError
+
+    def anki_words(self, anki_keys: Iterable[str]) -> List[str]:
+        '''Returns the stored anki words of the given keys.'''
+        raise NotImplementedError
+
+
+def records_from(data: ModelDict) -> Iterator[Record]:
+    '''Returns the records that build the given model from an empty one.'''
+    yield ['info', data['info']]
+    for anki_key, (anki_word, translation) in data['anki'].items():
+        yield ['anki', anki_key, anki_word, translation, data['stamps'].get(anki_key, 0.0)]
+    for anki_key, tags in data.get('tags', {}).items():
+        yield ['tags', anki_key, tags, data['stamps'].get(anki_key, 0.0)]
+    for duo_word, anki_key in data['duo'].items():
+        yield ['duo', duo_word, anki_key]
+    yield ['exported', data['exported']]
+
+
+def diff_records(old: ModelDict, new: ModelDict) -> List[Record]:
+    '''Returns the records that turn the model `old` into `new`.'''
+    records: List[Record] = []
+    if old['info'] != new['info']:
+        records.append(['info', new['info']])
+    for anki_key, (anki_word, translation) in new['anki'].items():
+        stamp = new['stamps'].get(anki_key, 0.0)
+        old_entry = old['anki'].get(anki_key)
+        if old_entry is None or tuple(old_entry) != (anki_word, translation) or old['stamps'].get(anki_key, 0.0) != stamp:
+            records.append(['anki', anki_key, anki_word, translation, stamp])
+    for anki_key, tags in new['tags'].items():
+        if sorted(old['tags'].get(anki_key, ())) != sorted(tags):
+            records.append(['tags', anki_key, tags, new['stamps'].get(anki_key, 0.0)])
+    records.extend(['tags', anki_key, [], new['stamps'].get(anki_key, 0.0)]
+                   for anki_key in sorted(old['tags'].keys() - new['tags'].keys()) if anki_key in new['anki'])
+    removed = old['anki'].keys() - new['anki'].keys()
+    records.extend(['anki-', anki_key] for anki_key in sorted(removed))
+    records.extend(['duo-', duo_word] for duo_word in sorted(old['duo'].keys() - new['duo'].keys()))
+    for duo_word, anki_key in new['duo'].items():
+        # removing a card unlinks its words, restore links kept to its key
+        if duo_word not in old['duo'] or old['duo'][duo_word] != anki_key or anki_key in removed:
+            records.append(['duo', duo_word, anki_key])
+    if old['exported'] != new['exported']:
+        records.append(['exported', new['exported']])
+    return records
+
+
+class JsonStorage(Storage):
+    '''Stores the model as a JSON file, optionally with a journal of the changes
+    made since the file was last written.'''
+
+    COMPACT_EVERY = 1000    # journal records between two compactions
+
+    def __init__(self, file: Path, journal: bool = False):
+        self._file = file
+        self._journal_file = Path(f'{file}.journal')
+        self._journal = journal
+        self._journal_length = 0
+        self._journal_offset = 0    # bytes of the journal read or written by this storage
+        self._stat: Optional[Tuple[int, int, int]] = None   # of the snapshot last seen by this storage
+        self._lock = FileLock(lock_file(file))
+
+    def exists(self) -> bool:
+        return self._file.exists()
+
+    def create(self, data: ModelDict):
+        if self._file.exists():
+            raise PermissionError(f'File {self._file} already exists, cannot create.')
+        self._file.touch(0o664)
+        self._snapshot(json.dumps(data))
+
+    def load(self) -> Tuple[ModelDict, List[Record]]:
+        self._stat = self._stat_file()
+        with open(self._file, 'r') as f:
+            try:
+                data = json.load(f)
+            except JSONDecodeError:
+                raise StorageError('Invalid File')
+        return data, self._read_journal()
+
+    def load_records(self) -> List[Record]:
+        return self._read_journal()
+
+    def locked(self) -> AbstractContextManager:
+        return self._lock
+
+    def changes(self) -> Optional[List[Record]]:
+        if self._stat_file() != self._stat:
+            return None     # the snapshot was replaced
+        try:
+            if self._journal_file.stat().st_size < self._journal_offset:
+                return None
+        except FileNotFoundError:
+            return [] if not self._journal_offset else None
+        return self._read_journal(self._journal_offset)
+
+    def _stat_file(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = self._file.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def version(self) -> Optional[Hashable]:
+        stat = self._stat_file()
+        if stat is None or (self._stat is not None and stat != self._stat):
+            return None
+        self._stat = stat
+        with open(self._file, 'rb') as f:
+            digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        return stat[0], stat[1], digest
+
+    def _read_journal(self, offset: int = 0) -> List[Record]:
+        '''Returns the records of the journal from the given byte offset on.'''
+        if not offset:
+            self._journal_length = 0
+        self._journal_offset = offset
+        if not self._journal_file.exists():
+            return []
+        records = []
+        with open(self._journal_file, 'rb+') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError
+                    records.append(json.loads(line))
+                except ValueError:
+                    # torn write at the end of the journal, drop it so that
+                    # new records don't get appended to a partial line
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+        self._journal_length += len(records)
+        self._journal_offset = offset
+        return records
+
+    def write(self, records: Sequence[Record], dump: Callable[[], str]):
+        if not self._journal:
+            self._snapshot(dump())
+            return
+        with open(self._journal_file, 'ab') as f:
+            start = f.tell()
+            f.write(''.join(json.dumps(record) + '\n' for record in records).encode())
+            f.flush()
+            os.fsync(f.fileno())
+            instrument.count('bytes written', f.tell() - start)
+            self._journal_offset = f.tell()
+        self._journal_length += len(records)
+        if self._journal_length >= self.COMPACT_EVERY:
+            self.compact(dump)
+
+    def compact(self, dump: Callable[[], str]):
+        '''Folds the journal back into the snapshot.'''
+        self._snapshot(dump())
+
+    def _snapshot(self, data: str):
+        '''Writes a full snapshot of the model, which makes the journal obsolete.
+
+        The snapshot is written to a temporary file that replaces the database
+        once it is on disk, so a crash never leaves a half-written database.'''
+        tmp_file = self._file.with_name(f'{self._file.name}.tmp')
+        with open(tmp_file, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            instrument.count('bytes written', f.tell())
+        os.replace(tmp_file, self._file)
+        self._stat = self._stat_file()
+        if self._journal_file.exists():
+            self._journal_file.unlink()
+        self._journal_length = 0
+        self._journal_offset = 0
+
+    def close(self):
+        self._lock.close()
+
+
+class SqliteStorage(Storage):
+    '''Stores the model in an SQLite database, writing only the changed rows
+    and answering word searches with indexed queries.
+
+    The records written are logged as well, so that other processes read only
+    the records written since they last looked instead of the whole database.'''
+
+    SEARCHABLE = True
+    CHANGES_KEPT = 10000    # records logged for other processes, those behind by more load the database again
+    KEYS_PER_QUERY = 500    # below the limit of parameters of older SQLite versions
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS duo (word TEXT PRIMARY KEY, folded TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS anki (key TEXT PRIMARY KEY, word TEXT NOT NULL, folded TEXT NOT NULL, translation TEXT NOT NULL, stamp REAL NOT NULL DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS links (word TEXT PRIMARY KEY, key TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS tags (key TEXT NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (key, tag));
+        CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, record TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS duo_folded ON duo (folded);
+        CREATE INDEX IF NOT EXISTS anki_word ON anki (word);
+        CREATE INDEX IF NOT EXISTS anki_folded ON anki (folded);
+        CREATE INDEX IF NOT EXISTS links_key ON links (key);
+        CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+    '''
+
+    def __init__(self, file: Path):
+        self._file = file
+        self._db: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None     # changed by the commits of other connections
+        self._seq = 0   # of the last change read or written
+        self._lock = FileLock(lock_file(file))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            # the connection is shared with the background writer, Model serialises its use
+            self._db = sqlite3.connect(self._file, check_same_thread=False)
+        return self._db
+
+    def exists(self) -> bool:
+        return self._file.exists()
+
+    def create(self, data: ModelDict):
+        if self._file.exists():
+            raise PermissionError(f'File {self._file} already exists, cannot create.')
+        db = self._connect()
+        db.executescript(self.SCHEMA)
+        with db:
+            self._execute(db, records_from(data))
+
+    def load(self) -> Tuple[ModelDict, List[Record]]:
+        db = self._connect()
+        try:
+            db.executescript(self.SCHEMA)
+            self._upgrade(db)
+            meta = dict(db.execute('SELECT key, value FROM meta'))
+            data: ModelDict = {
+                'info': json.loads(meta['info']) if 'info' in meta else {'name': '', 'lang': ''},
+                'duo': dict.fromkeys(word for word, in db.execute('SELECT word FROM duo')),
+                'anki': {},
+                'stamps': {},
+                'tags': {},
+                'exported': float(meta.get('exported', 0.0)),
+            }
+            data['duo'].update(db.execute('SELECT word, key FROM links'))
+            for key, word, translation, stamp in db.execute('SELECT key, word, translation, stamp FROM anki'):
+                data['anki'][key] = (word, translation)
+                data['stamps'][key] = stamp
+            for key, tag in db.execute('SELECT key, tag FROM tags ORDER BY key, tag'):
+                data['tags'].setdefault(key, []).append(tag)
+            self._data_version = self._get_data_version(db)
+            self._seq = self._last_seq(db)
+        except sqlite3.DatabaseError:
+            raise StorageError('Invalid File')
+        return data, []
+
+    @staticmethod
+    def _get_data_version(db: sqlite3.Connection) -> int:
+        return db.execute('PRAGMA data_version').fetchone()[0]
+
+    @staticmethod
+    def _last_seq(db: sqlite3.Connection) -> int:
+        '''Returns the seq of the last change logged, even if it was dropped since.'''
+        row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    def locked(self) -> AbstractContextManager:
+        return self._lock
+
+    def changes(self) -> Optional[List[Record]]:
+        db = self._connect()
+        if self._data_version is None:
+            return []
+        data_version = self._get_data_version(db)
+        if data_version == self._data_version:
+            return []
+        try:
+            first, = db.execute('SELECT min(seq) FROM changes').fetchone()
+            rows = db.execute('SELECT seq, record FROM changes WHERE seq > ? ORDER BY seq', (self._seq,)).fetchall()
+        except sqlite3.DatabaseError:
+            raise StorageError('Invalid File')
+        if first is None or first > self._seq + 1 or not rows:
+            return None     # the records were dropped from the log, or written by an older version not logging them
+        self._data_version = data_version
+        self._seq = rows[-1][0]
+        return [json.loads(record) for _, record in rows]
+
+    @staticmethod
+    def _upgrade(db: sqlite3.Connection):
+        '''Adds the columns missing in databases written by older versions.'''
+        columns = {name for _, name, *_ in db.execute('PRAGMA table_info(anki)')}
+        if 'stamp' not in columns:
+            db.execute('ALTER TABLE anki ADD COLUMN stamp REAL NOT NULL DEFAULT 0')
+
+    def write(self, records: Sequence[Record], dump: Callable[[], str]):
+        db = self._connect()
+        changes = db.total_changes
+        with db:
+            self._execute(db, records)
+            if len(records) < self.CHANGES_KEPT:
+                db.executemany('INSERT INTO changes (record) VALUES (?)', ((json.dumps(record),) for record in records))
+                self._seq = self._last_seq(db)
+                db.execute('DELETE FROM changes WHERE seq <= ?', (self._seq - self.CHANGES_KEPT,))
+            else:   # as many as kept, the other processes load the database again anyway
+                db.execute('DELETE FROM changes')
+        instrument.count('rows written', db.total_changes - changes)
+
+    @staticmethod
+    def _execute(db: sqlite3.Connection, records: Iterable[Record]):
+        '''Changes the rows as the records say, within the caller's transaction.'''
+        for op, *args in records:
+            if op == 'info':
+                info, = args
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('info', ?)", (json.dumps(info),))
+            elif op == 'duo':
+                duo_word, anki_key = args
+                db.execute('INSERT OR IGNORE INTO duo VALUES (?, ?)', (duo_word, duo_word.lower()))
+                if anki_key is None:
+                    db.execute('DELETE FROM links WHERE word = ?', (duo_word,))
+                else:
+                    db.execute('INSERT OR REPLACE INTO links VALUES (?, ?)', (duo_word, anki_key))
+            elif op == 'duo-':
+                duo_word, = args
+                db.execute('DELETE FROM duo WHERE word = ?', (duo_word,))
+                db.execute('DELETE FROM links WHERE word = ?', (duo_word,))
+            elif op == 'anki':
+                anki_key, anki_word, translation, *stamp = args
+                db.execute('INSERT OR REPLACE INTO anki VALUES (?, ?, ?, ?, ?)', (anki_key, anki_word, anki_word.lower(), translation, stamp[0] if stamp else 0.0))
+            elif op == 'anki-':
+                anki_key, = args
+                db.execute('DELETE FROM anki WHERE key = ?', (anki_key,))
+                db.execute('DELETE FROM links WHERE key = ?', (anki_key,))
+                db.execute('DELETE FROM tags WHERE key = ?', (anki_key,))
+            elif op == 'tags':
+                anki_key, tags, stamp = args
+                db.execute('DELETE FROM tags WHERE key = ?', (anki_key,))
+                db.executemany('INSERT INTO tags SELECT key, ? FROM anki WHERE key = ?', ((tag, anki_key) for tag in tags))
+                db.execute('UPDATE anki SET stamp = ? WHERE key = ?', (stamp, anki_key))
+            elif op == 'exported':
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('exported', ?)", (str(args[0]),))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        self._lock.close()
+
+    @staticmethod
+    def _prefix_range(folded: str) -> Tuple[str, str]:
+        return folded, folded + '\U0010ffff'
+
+    def search_duo_words(self, filter: str, unassigned_only: bool) -> List[str]:
+        db = self._connect()
+        folded = filter.lower()
+        join, where = '', ''
+        if unassigned_only:
+            join = 'LEFT JOIN links l ON l.word = d.word LEFT JOIN anki a ON a.key = l.key'
+            where = 'AND a.key IS NULL'
+        start_matches = db.execute(f'SELECT d.word FROM duo d {join} WHERE d.folded >= ? AND d.folded < ? {where} ORDER BY d.word', self._prefix_range(folded))
+        words = [word for word, in start_matches]
+        if folded:
+            other_matches = db.execute(f'SELECT d.word FROM duo d {join} WHERE instr(d.folded, ?) > 1 {where} ORDER BY d.word', (folded,))
+            words.extend(word for word, in other_matches)
+        return words
+
+    def search_anki_words(self, filter: str, no_translation_only: bool) -> List[str]:
+        db = self._connect()
+        folded = filter.lower()
+        where = "AND translation = ''" if no_translation_only else ''
+        start_matches = db.execute(f'SELECT DISTINCT word FROM anki WHERE folded >= ? AND folded < ? {where} ORDER BY word', self._prefix_range(folded))
+        words = [word for word, in start_matches]
+        if folded:
+            # instr() finds the first occurrence, so start matches are not returned again
+            other_matches = db.execute(f'SELECT DISTINCT word FROM anki WHERE instr(folded, ?) > 1 {where} ORDER BY word', (folded,))
+            words.extend(word for word, in other_matches)
+        return words
+
+    def _by_keys(self, query: str, anki_keys: Iterable[str]) -> List[str]:
+        '''Runs a query selecting words by `key IN (...)` for the keys, a chunk at a time.'''
+        db = self._connect()
+        anki_keys = list(anki_keys)
+        words = []
+        for start in range(0, len(anki_keys), self.KEYS_PER_QUERY):
+            chunk = anki_keys[start:start + self.KEYS_PER_QUERY]
+            words.extend(word for word, in db.execute(query.format(', '.join('?' * len(chunk))), chunk))
+        return words
+
+    def linked_duo_words(self, anki_keys: Iterable[str]) -> List[str]:
+        return self._by_keys('SELECT word FROM links WHERE key IN ({})', anki_keys)
+
+    def anki_words(self, anki_keys: Iterable[str]) -> List[str]:
+        return self._by_keys('SELECT word FROM anki WHERE key IN ({})', anki_keys)
+
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+
+def open_storage(file: Path, journal: bool = False) -> Storage:
+    '''Returns the storage for the given database file: SQLite for SQLite files
+    (or new files with an SQLite suffix), JSON otherwise.'''
+    if file.exists():
+        with open(file, 'rb') as f:
+            is_sqlite = f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+    else:
+        is_sqlite = file.suffix.lower() in SQLITE_SUFFIXES
+    return SqliteStorage(file) if is_sqlite else JsonStorage(file, journal)
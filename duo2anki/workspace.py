@@ -0,0 +1,154 @@
+from __future__ import annotations
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from duo2anki.instrument import timed
+from duo2anki.model import Model
+
+MAX_MODELS = 4          # databases kept open at once
+MAX_ENTRIES = 2000000   # words and cards of all open databases, a proxy for their memory
+WORKERS = 4             # threads searching the databases
+
+
+class WorkspaceHit(NamedTuple):
+    file:       str         # database the words are in
+    name:       str         # name of the database
+    duo_words:  List[str]   # matching Duolingo words
+    anki_words: List[str]   # matching Anki words
+
+
+class Workspace:
+    '''The databases open at once, e.g. one per language, so switching between
+    them doesn't read them again.
+
+    The databases are kept in a pool of at most `max_models` holding at most
+    `max_entries` words and cards. Once the pool is full the least recently used
+    databases are closed, which writes their pending changes; the most recently
+    used one is always kept. A database removed from the pool while it is
+    searched is closed once the search is done.'''
+
+    def __init__(self, max_models: int = MAX_MODELS, max_entries: int = MAX_ENTRIES, **options: Any):
+        self._max_models = max_models
+        self._max_entries = max_entries
+        self._options = options     # passed on to Model
+        self._models: OrderedDict[str, Model] = OrderedDict()   # least recently used first
+        self._lock = threading.RLock()  # searches run on worker threads
+        self._idle = threading.Condition(self._lock)    # notified when a search is done
+        self._searches: Dict[Model, int] = {}   # databases being searched -> searches running
+        self._closing: Set[Model] = set()       # databases removed while searched, closed after the search
+
+    @staticmethod
+    def _key(file: str) -> str:
+        return os.path.normcase(os.path.abspath(file))
+
+    def __contains__(self, file: str) -> bool:
+        return self._key(file) in self._models
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def models(self) -> List[Model]:
+        '''Returns the open databases, the most recently used first.'''
+        with self._lock:
+            return list(reversed(self._models.values()))
+
+    def files(self) -> List[str]:
+        return [str(model.file) for model in self.models()]
+
+    def get(self, file: str) -> Optional[Model]:
+        '''Returns the database if it is open, making it the most recently used.'''
+        key = self._key(file)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+            return model
+
+    def open(self, file: str) -> Model:
+        '''Returns the database, reading it unless it is open.'''
+        return self.get(file) or self.add(Model(file, **self._options))
+
+    def add(self, model: Model) -> Model:
+        '''Adds a database opened elsewhere, e.g. on a job thread, as the most
+        recently used one.'''
+        key = self._key(str(model.file))
+        with self._lock:
+            old = self._models.pop(key, None)
+            if old is not None and old is not model:
+                self._close(old)
+            self._models[key] = model
+            self._evict()
+        return model
+
+    def _entries(self) -> int:
+        return sum(summary['duo_words'] + summary['anki_cards'] for summary in (model.summary() for model in self._models.values()))
+
+    def _evict(self):
+        while len(self._models) > 1 and (len(self._models) > self._max_models or self._entries() > self._max_entries):
+            _, model = self._models.popitem(last=False)
+            self._close(model)
+
+    def _close(self, model: Model):
+        '''Closes a database removed from the pool, or has the search using it close it.'''
+        with self._lock:
+            if model in self._searches:
+                self._closing.add(model)
+                return
+        model.close()
+
+    def close(self, file: str):
+        '''Closes the database, writing its pending changes.'''
+        with self._lock:
+            model = self._models.pop(self._key(file), None)
+        if model is not None:
+            self._close(model)
+
+    def close_all(self):
+        '''Closes all databases. Those being searched are closed by the search,
+        which is waited for, so that all pending changes are written on return.'''
+        with self._lock:
+            models, self._models = list(self._models.values()), OrderedDict()
+        for model in models:
+            self._close(model)
+        with self._idle:
+            self._idle.wait_for(lambda: not self._closing)
+
+    @timed
+    def search(self, filter: str) -> List[WorkspaceHit]:
+        '''Returns the words matching the filter in each open database, the most
+        recently used first, searching the databases in parallel.'''
+        def search(model: Model) -> WorkspaceHit:
+            return WorkspaceHit(str(model.file), model.info['name'], model.get_duo_words(filter), model.get_anki_words(filter))
+
+        # the pool is only locked to mark the databases as searched, one closed
+        # meanwhile is closed by the search once done
+        with self._lock:
+            models = self.models()
+            for model in models:
+                self._searches[model] = self._searches.get(model, 0) + 1
+        try:
+            if len(models) <= 1:
+                return [search(model) for model in models]
+            with ThreadPoolExecutor(min(len(models), WORKERS), thread_name_prefix='duo2anki-workspace') as executor:
+                return list(executor.map(search, models))
+        finally:
+            self._searched(models)
+
+    def _searched(self, models: List[Model]):
+        '''Unmarks the databases of a finished search, closing those removed meanwhile.'''
+        closing = []
+        with self._lock:
+            for model in models:
+                self._searches[model] -= 1
+                if not self._searches[model]:
+                    del self._searches[model]
+                    if model in self._closing:
+                        closing.append(model)
+        for model in closing:
+            model.close()
+        with self._idle:
+            self._closing.difference_update(closing)
+            self._idle.notify_all()
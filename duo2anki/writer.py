@@ -0,0 +1,89 @@
+from __future__ import annotations
+import atexit
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+import weakref
+
+
+class BackgroundWriter:
+    '''Runs a write callback on a worker thread.
+
+    Requests made within `delay` seconds of the first unwritten one are
+    coalesced into a single call of the callback.'''
+
+    def __init__(self, write: Callable[[], None], delay: float = 0.5):
+        self._write = write
+        self._delay = delay
+        self._cond = threading.Condition()
+        self._due: Optional[float] = None   # time the pending write is due, None if clean
+        self._writing = False
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name='duo2anki-writer', daemon=True)
+        self._thread.start()
+        _writers.add(self)
+
+    def request(self):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Writer is closed')
+            if self._due is None:
+                self._due = time.monotonic() + self._delay
+                self._cond.notify_all()
+
+    def flush(self):
+        '''Blocks until all requested writes are done.'''
+        with self._cond:
+            if self._due is not None:
+                self._due = time.monotonic()
+                self._cond.notify_all()
+            while self._due is not None or self._writing:
+                self._cond.wait()
+            self._raise_error()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        with self._cond:
+            while True:
+                while not self._closed and (self._due is None or time.monotonic() < self._due):
+                    self._cond.wait(None if self._due is None else self._due - time.monotonic())
+                if self._closed:
+                    return
+                self._due = None
+                self._writing = True
+                self._cond.release()
+                try:
+                    self._write()
+                except BaseException as e:
+                    self._error = e
+                finally:
+                    self._cond.acquire()
+                    self._writing = False
+                    self._cond.notify_all()
+
+
+_writers: weakref.WeakSet[BackgroundWriter] = weakref.WeakSet()
+
+
+@atexit.register
+def _close_writers():
+    for writer in list(_writers):
+        try:
+            writer.close()
+        except Exception:
+            traceback.print_exc()
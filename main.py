@@ -1,2 +1,2 @@
-import duo2anki.gui
-duo2anki.gui.main()
\ No newline at end of file
+from duo2anki.cli import main
+main()
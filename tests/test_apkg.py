@@ -0,0 +1,82 @@
+import sqlite3
+from pathlib import Path
+import zipfile
+
+import pytest
+
+from duo2anki.apkg import Note, write_apkg
+from duo2anki.model import Model
+
+KEYS = ['0f8fad5b-d9cb-469f-a165-70867728950e', '7c9e6679-7425-40de-944b-e07fc1f90ae7', 'not a uuid']
+
+
+def read(file: Path, tmp_path: Path):
+    '''Returns the notes of a package by the first field, and its cards.'''
+    with zipfile.ZipFile(file) as package:
+        assert package.read('media') == b'{}'
+        package.extract('collection.anki2', tmp_path)
+    db = sqlite3.connect(tmp_path / 'collection.anki2')
+    try:
+        notes = {row[1]: row for row in db.execute('SELECT id, sfld, guid, mid, tags, flds, mod FROM notes')}
+        cards = db.execute('SELECT id, nid, did FROM cards').fetchall()
+    finally:
+        db.close()
+    (tmp_path / 'collection.anki2').unlink()
+    return notes, cards
+
+
+@pytest.fixture
+def notes():
+    return [Note(KEYS[0], 'het huis', 'house & <home>', ['noun', 'two words'], 1.0), Note(KEYS[1], 'lopen', '', [], 2.0),
+        Note(KEYS[2], 'de kat', 'the cat', [], 3.0)]
+
+
+def test_package(notes, tmp_path):
+    assert write_apkg(str(tmp_path / 'out.apkg'), 'Dutch', notes) == 3
+    found, cards = read(tmp_path / 'out.apkg', tmp_path)
+    assert found['het huis'][4] == ' noun two_words '
+    assert found['het huis'][5] == 'het huis\x1fhouse &amp; &lt;home&gt;'
+    assert found['lopen'][6] == 2
+    assert sorted(nid for _, nid, _ in cards) == sorted(note[0] for note in found.values())
+    assert not list(tmp_path.glob('*.anki2'))
+
+
+def test_ids_are_stable(notes, tmp_path):
+    '''Packages of the same cards, changed or not, update the same notes in Anki.'''
+    write_apkg(str(tmp_path / 'first.apkg'), 'Dutch', notes)
+    changed = [notes[2]._replace(translation='a cat', stamp=4.0), notes[0]]
+    write_apkg(str(tmp_path / 'second.apkg'), 'Dutch', changed)
+    first, first_cards = read(tmp_path / 'first.apkg', tmp_path)
+    second, second_cards = read(tmp_path / 'second.apkg', tmp_path)
+    for word in ('het huis', 'de kat'):
+        assert second[word][:4] == first[word][:4]     # id, front side, guid, note type
+    assert {did for _, _, did in first_cards} == {did for _, _, did in second_cards}
+    assert second['de kat'][5] == 'de kat\x1fa cat'
+
+
+def test_guids(notes, tmp_path):
+    write_apkg(str(tmp_path / 'out.apkg'), 'Dutch', notes)
+    found, _ = read(tmp_path / 'out.apkg', tmp_path)
+    guids = [note[2] for note in found.values()]
+    assert len(set(guids)) == len(guids)
+    assert all(len(guid) == 10 for guid in guids)
+    # keys differing in their last digits only get unrelated GUIDs
+    similar = [Note(f'00000000-0000-4000-8000-{i:012x}', f'w{i}', '', [], 0.0) for i in range(1000)]
+    write_apkg(str(tmp_path / 'similar.apkg'), 'Dutch', similar)
+    found, _ = read(tmp_path / 'similar.apkg', tmp_path)
+    assert len({note[2] for note in found.values()}) == 1000
+    assert len({note[2][:3] for note in found.values()}) > 100
+
+
+def test_model_export(tmp_path):
+    model = Model(str(tmp_path / 'db.json'))
+    model.update_model_info({'name': 'Dutch', 'lang': 'nl'})
+    model.update_anki_entry(KEYS[0], 'het huis', 'house')
+    model.export_anki_apkg(str(tmp_path / 'all.apkg'))
+    model.update_anki_entry(KEYS[1], 'lopen', 'to walk')
+    assert model.export_anki_apkg(str(tmp_path / 'delta.apkg'), delta=True) == 1
+    model.close()
+    first, _ = read(tmp_path / 'all.apkg', tmp_path)
+    delta, _ = read(tmp_path / 'delta.apkg', tmp_path)
+    assert list(delta) == ['lopen']
+    assert first['het huis'][2] != delta['lopen'][2]
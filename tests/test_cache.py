@@ -0,0 +1,117 @@
+import json
+import marshal
+from pathlib import Path
+
+import pytest
+
+from duo2anki.cache import HEADER_SIZE, MAGIC, cache_file
+from duo2anki.model import Model
+from duo2anki.storage import JsonStorage
+
+
+def data():
+    return {
+        'info': {'name': 'test', 'lang': 'nl'},
+        'duo': {'huis': 'k1', 'huizen': 'k1', 'boek': None, 'kat': 'gone'},
+        'anki': {'k1': ['het huis', 'the house'], 'k2': ['het boek', ''], 'k3': ['het boek', 'book']},
+        'stamps': {'k1': 1.0, 'k2': 2.0, 'k3': 3.0},
+        'tags': {'k1': ['noun']},
+        'exported': 1.5,
+    }
+
+
+@pytest.fixture
+def file(tmp_path: Path) -> Path:
+    file = tmp_path / 'db.json'
+    file.write_text(json.dumps(data()))
+    return file
+
+
+def state(model: Model):
+    return (model.json, model.integrity(), model.summary(), model.get_duo_words('h'), model.get_anki_words('het'),
+        model.get_duo_words(unassigned_only=True), model.get_anki_words(no_translation_only=True), model.get_anki_words(tags=('noun',)))
+
+
+def uncached(file: Path, journal: bool = False):
+    model = Model(str(file), journal=journal, cache=False)
+    try:
+        return state(model)
+    finally:
+        model.close()
+
+
+def cached(file: Path, monkeypatch, journal: bool = False):
+    '''Opens the model from the cache, failing if the database is read instead.'''
+    with monkeypatch.context() as patch:
+        patch.setattr(JsonStorage, 'load', lambda self: pytest.fail('read the database instead of the cache'))
+        model = Model(str(file), journal=journal)
+    try:
+        return state(model)
+    finally:
+        model.close()
+
+
+def test_cached_open_matches_uncached(file, monkeypatch):
+    Model(str(file)).close()
+    assert cache_file(file).exists()
+    assert cached(file, monkeypatch) == uncached(file)
+
+
+def test_changes_are_cached(file, monkeypatch):
+    model = Model(str(file))
+    model.link_many(['boek'], 'het boek')
+    model.set_anki_tags('k3', ['noun', 'thing'])
+    model.delete_anki_entry('k2')
+    model.close()
+    assert cached(file, monkeypatch) == uncached(file)
+
+
+def test_journal_is_replayed_over_cache(file, monkeypatch):
+    Model(str(file), journal=True).close()
+    other = Model(str(file), journal=True, cache=False)   # doesn't update the cache
+    other.link_duo_word_to_anki_word('kat', 'de kat')
+    other.delete_duo_word('huizen')
+    other.close()
+    assert Path(f'{file}.journal').exists()
+    assert cached(file, monkeypatch, journal=True) == uncached(file, journal=True)
+
+
+def test_stale_cache_is_ignored(file):
+    Model(str(file)).close()
+    other = Model(str(file), cache=False)
+    other.update_anki_entry('k4', 'de kat', 'the cat')
+    other.close()
+    model = Model(str(file))
+    assert model.has_anki_word('de kat')
+    model.close()
+
+
+def other_layout(cache: Path):
+    '''Keeps the header, valid for the database, and replaces the state.'''
+    content = cache.read_bytes()
+    size, = HEADER_SIZE.unpack_from(content, len(MAGIC))
+    cache.write_bytes(content[:len(MAGIC) + HEADER_SIZE.size + size] + marshal.dumps(({'k1': 1}, [2], None)))
+
+
+@pytest.mark.parametrize('damage', [
+    lambda cache: cache.write_bytes(b'garbage'),
+    lambda cache: cache.write_bytes(cache.read_bytes()[:100]),
+    lambda cache: cache.write_bytes(b''),
+    other_layout,
+])
+def test_damaged_cache_is_ignored(file, damage):
+    Model(str(file)).close()
+    expected = uncached(file)
+    damage(cache_file(file))
+    model = Model(str(file))
+    assert state(model) == expected
+    model.close()
+
+
+def test_cache_is_not_code(file):
+    '''A cache is only ever read as data: one holding a pickle is ignored.'''
+    Model(str(file)).close()
+    cache_file(file).write_bytes(b'cos\nsystem\n(S"exit 1"\ntR.')
+    model = Model(str(file))
+    assert model.json['anki']['k1'] == ('het huis', 'the house')
+    model.close()
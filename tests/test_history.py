@@ -0,0 +1,104 @@
+import json
+from pathlib import Path
+import time
+
+import pytest
+
+from duo2anki.model import Model
+
+
+def export(*words: str) -> str:
+    return json.dumps({'vocab_overview': [{'word_string': word} for word in words]})
+
+
+@pytest.fixture(params=['json', 'journal', 'sqlite'])
+def open_model(request, tmp_path: Path):
+    file = tmp_path / ('db.sqlite' if request.param == 'sqlite' else 'db.json')
+    return lambda: Model(str(file), journal=request.param == 'journal', cache=False)
+
+
+def test_undo_redo_round_trip_is_stored(open_model):
+    model = open_model()
+    model.update_duo_new_words_from_str(export('huis', 'huizen', 'boek'))
+    before = model.json
+    model.link_many(['huis', 'huizen'], 'het huis')
+    linked = model.json
+    assert model.undo()
+    assert model.get_duo_words() == ['boek', 'huis', 'huizen']
+    assert not model.has_anki_word('het huis')
+    model.close()
+
+    reopened = open_model()
+    assert reopened.json['duo'] == before['duo'] and reopened.json['anki'] == {}
+    assert not reopened.can_undo()  # the history is not stored
+    reopened.close()
+
+    model = open_model()
+    model.link_many(['huis', 'huizen'], 'het huis')
+    assert model.undo() and model.redo()
+    model.close()
+    reopened = open_model()
+    assert reopened.get_duo_words_from_anki_word('het huis') == ['huis', 'huizen']
+    assert reopened.json['duo'].keys() == linked['duo'].keys()
+    reopened.close()
+
+
+def test_batch_is_undone_as_one_step(open_model):
+    model = open_model()
+    model.update_duo_new_words_from_str(export('huis', 'boek'))
+    with model.batch():
+        model.link_duo_word_to_anki_word('huis', 'het huis')
+        model.link_duo_word_to_anki_word('boek', 'het boek')
+        model.delete_duo_word('boek')
+    assert model.undo()
+    assert model.get_anki_words() == []
+    assert model.get_duo_words(unassigned_only=True) == ['boek', 'huis']
+    assert model.undo()     # the import
+    assert model.get_duo_words() == []
+    assert not model.undo()
+    model.close()
+
+
+def test_new_change_clears_redo(open_model):
+    model = open_model()
+    model.update_anki_entry('k1', 'het huis', 'the house')
+    model.update_anki_entry('k1', 'het huis', 'house')
+    assert model.undo()
+    assert model.can_redo()
+    model.update_anki_entry('k1', 'het huis', 'home')
+    assert not model.can_redo() and not model.redo()
+    assert model.get_anki_entry('k1') == ('het huis', 'home')
+    model.close()
+
+
+def test_undo_and_redo_stamp_cards_now(open_model):
+    model = open_model()
+    model.update_anki_entry('k1', 'het huis', 'the house')
+    model.set_anki_tags('k1', ['noun'])
+    stamp = model.json['stamps']['k1']
+    time.sleep(0.01)
+    assert model.undo()
+    assert model.json['tags'] == {}
+    undone = model.json['stamps']['k1']
+    assert undone > stamp
+    time.sleep(0.01)
+    assert model.redo()
+    assert model.json['tags'] == {'k1': ['noun']}
+    assert model.json['stamps']['k1'] > undone
+    model.close()
+    reopened = open_model()
+    assert reopened.json['stamps']['k1'] > undone
+    reopened.close()
+
+
+def test_undone_change_is_exported_again(open_model, tmp_path: Path):
+    model = open_model()
+    model.update_anki_entry('k1', 'het huis', 'the house')
+    model.export_anki_csv(str(tmp_path / 'all.csv'))
+    model.update_anki_entry('k1', 'het huis', 'house')
+    time.sleep(0.01)
+    model.export_anki_csv(str(tmp_path / 'all.csv'))
+    assert model.undo()
+    assert model.export_anki_csv(str(tmp_path / 'delta.csv'), delta=True) == 1
+    assert 'the house' in (tmp_path / 'delta.csv').read_text()
+    model.close()
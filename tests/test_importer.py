@@ -0,0 +1,115 @@
+import io
+import json
+
+import pytest
+
+from duo2anki.importer import _StreamReader, iter_vocab_words
+
+WORDS = ['huis', 'café', 'zeg "hallo"', 'back\\slash', 'tab\there', '😀 emoji', 'ß']
+
+EXPORT = json.dumps({
+    'language_string': 'Dutch',
+    'learning_language': 'nl',
+    'skills': [{'name': 'Basics', 'strength': 0.75, 'words': ['huis', 'boek']}],
+    'count': 1234567890,
+    'vocab_overview': [{'word_string': word, 'strength_bars': 4, 'strength': 1.0e-3, 'gender': None} for word in WORDS],
+    'from_language': 'en',
+}, indent=1)
+
+
+class Chunked(io.StringIO):
+    '''Returns at most `chunk_size` characters per read, as pipes and sockets may.'''
+
+    def __init__(self, text: str, chunk_size: int):
+        super().__init__(text)
+        self._chunk_size = chunk_size
+
+    def read(self, size=-1):
+        return super().read(self._chunk_size if size is None or size < 0 else min(size, self._chunk_size))
+
+
+@pytest.fixture(params=[1, 2, 3, 5, 64, 1 << 16])
+def chunk_size(request):
+    return request.param
+
+
+def words(text: str, chunk_size: int = 1 << 16, **kwargs):
+    return list(iter_vocab_words(Chunked(text, chunk_size), **kwargs))
+
+
+def test_words_in_export_order(chunk_size):
+    assert words(EXPORT, chunk_size) == WORDS
+
+
+def test_escapes_split_at_chunk_boundaries(chunk_size):
+    # \u escapes and surrogate pairs written as escapes, so that chunks split them
+    text = json.dumps({'vocab_overview': [{'word_string': word} for word in WORDS]}, ensure_ascii=True)
+    assert '\\ud83d\\ude00' in text
+    assert words(text, chunk_size) == WORDS
+
+
+def test_numbers_split_at_chunk_boundaries(chunk_size):
+    text = '{"count": 1234567890123, "ratio": -12.5e-10, "vocab_overview": [{"word_string": "huis", "strength": 0.123456789}]}'
+    assert words(text, chunk_size) == ['huis']
+
+
+def test_whitespace_between_tokens(chunk_size):
+    assert words(' \n{ "vocab_overview" :\t[ { "word_string" : "huis" } ,\r\n{"word_string":"boek"} ] } ', chunk_size) == ['huis', 'boek']
+
+
+def test_empty_vocabulary(chunk_size):
+    assert words('{"vocab_overview": []}', chunk_size) == []
+
+
+def test_stops_reading_after_vocabulary(monkeypatch):
+    stream = io.StringIO('{"vocab_overview": [{"word_string": "huis"}], "rest": ' + '[0, ' * 1000 + '0' + ']' * 1000 + '}')
+    monkeypatch.setattr(_StreamReader, 'CHUNK_SIZE', 16)
+    assert list(iter_vocab_words(stream)) == ['huis']
+    assert stream.tell() <= 64
+
+
+def test_progress_counts_characters_read(chunk_size):
+    reads = []
+    assert words(EXPORT, chunk_size, progress=reads.append) == WORDS
+    assert reads == sorted(reads)
+    assert reads[-1] <= len(EXPORT)
+
+
+@pytest.mark.parametrize('text', ['{}', '{"language_string": "Dutch"}', '{"vocab": [{"word_string": "huis"}]}'])
+def test_missing_vocabulary(text, chunk_size):
+    with pytest.raises(KeyError):
+        words(text, chunk_size)
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '[]',
+    '"vocab_overview"',
+    '{"vocab_overview": {"word_string": "huis"}}',
+    '{"vocab_overview" [{"word_string": "huis"}]}',
+    '{"vocab_overview": [{"word_string": "huis"} {"word_string": "boek"}]}',
+    '{"vocab_overview": [{"word_string": "huis",}]}',
+    '{"vocab_overview": [{"word_string": "hu\\xis"}]}',
+    '{"language_string": Dutch, "vocab_overview": []}',
+])
+def test_malformed(text, chunk_size):
+    with pytest.raises(ValueError):
+        words(text, chunk_size)
+
+
+def test_entry_without_word(chunk_size):
+    with pytest.raises(KeyError):
+        words('{"vocab_overview": [{"strength_bars": 4}]}', chunk_size)
+
+
+def test_truncated_export(chunk_size):
+    '''An export cut anywhere before its vocabulary ends raises ValueError after
+    yielding the complete entries before the cut.'''
+    end = EXPORT.index(']', EXPORT.index('vocab_overview')) + 1
+    for size in range(0, end, 1 if chunk_size >= 64 else 7):     # small chunks cover the offsets between
+        found = []
+        with pytest.raises(ValueError):
+            for word in iter_vocab_words(Chunked(EXPORT[:size], chunk_size)):
+                found.append(word)
+        assert found == WORDS[:len(found)], size
+    assert words(EXPORT[:end], chunk_size) == WORDS
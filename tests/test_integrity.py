@@ -0,0 +1,91 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from duo2anki.model import Model
+
+
+def damaged():
+    return {
+        'info': {'name': 'test', 'lang': 'nl'},
+        'duo': {'huis': 'k1', 'kat': 'gone', 'boek': 'k3'},
+        'anki': {'k1': ['huis', 'house'], 'k2': ['huis', 'home'], 'k3': ['boek', 'book'], 'k4': [1, 2]},
+        'stamps': {'k1': 1.0, 'k2': 2.0, 'k3': 'yesterday', 'k9': 3.0},
+        'tags': {'k1': 'noun'},
+        'exported': 0.0,
+    }
+
+
+@pytest.fixture
+def file(tmp_path: Path) -> Path:
+    file = tmp_path / 'db.json'
+    file.write_text(json.dumps(damaged()))
+    return file
+
+
+def test_problems_found_when_read(file):
+    model = Model(str(file), cache=False)
+    report = model.integrity()
+    assert report.duplicates == {'huis': ['k1', 'k2']}
+    assert report.dangling == ['kat']
+    assert report.orphans == ['k9']
+    assert len(report.malformed) == 3
+    model.close()
+
+
+def test_card_with_malformed_stamp_is_kept(file):
+    model = Model(str(file), cache=False)
+    assert model.get_anki_entry('k3') == ('boek', 'book')
+    model.check(repair=True)
+    model.close()
+    reopened = Model(str(file), cache=False)
+    assert reopened.get_anki_entry('k3') == ('boek', 'book')
+    assert reopened.get_anki_key_from_duo_word('boek') == 'k3'
+    assert reopened.json['stamps']['k3'] == 0.0
+    reopened.close()
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_repair_in_journal_is_reported_fixed(file, cache):
+    model = Model(str(file), journal=True, cache=cache)
+    model.check(repair=True)
+    model.close()
+    assert Path(f'{file}.journal').exists()     # the snapshot still holds the problems
+    for _ in range(2):  # the second open reads the cache written by the first
+        reopened = Model(str(file), journal=True, cache=cache)
+        assert reopened.integrity().ok
+        assert reopened.check().ok
+        reopened.close()
+
+
+@pytest.mark.parametrize('data', [[], {**damaged(), 'stamps': []}, {**damaged(), 'tags': [1]}, {**damaged(), 'anki': None}])
+def test_invalid_file(file, data):
+    file.write_text(json.dumps(data))
+    with pytest.raises(Model.ModelError):
+        Model(str(file), cache=False)
+
+
+@pytest.mark.parametrize('journal', [False, True])
+def test_rewritten_snapshot_has_no_stored_problems(file, journal):
+    model = Model(str(file), journal=journal, cache=False)
+    model.update_anki_entry('k2', 'het huis', 'home')
+    model.compact()
+    assert model.integrity().orphans == [] and model.integrity().malformed == []
+    model.close()
+    reopened = Model(str(file), journal=journal, cache=False)
+    assert reopened.integrity().orphans == [] and reopened.integrity().malformed == []
+    reopened.close()
+
+
+def test_cached_and_uncached_open_find_the_same_problems(file):
+    model = Model(str(file))
+    model.update_anki_entry('k2', 'het huis', 'home')
+    model.update_anki_entry('k5', 'boek', '')
+    model.close()
+    cached = Model(str(file))
+    uncached = Model(str(file), cache=False)
+    assert cached.integrity() == uncached.integrity()
+    assert cached.integrity().duplicates == {'boek': ['k3', 'k5']}
+    cached.close()
+    uncached.close()
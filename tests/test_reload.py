@@ -0,0 +1,92 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from duo2anki.model import Model
+
+
+def export(*words: str) -> str:
+    return json.dumps({'vocab_overview': [{'word_string': word} for word in words]})
+
+
+@pytest.fixture(params=['json', 'journal', 'sqlite'])
+def open_model(request, tmp_path: Path):
+    file = tmp_path / ('db.sqlite' if request.param == 'sqlite' else 'db.json')
+    model = Model(str(file), journal=request.param == 'journal')
+    model.update_model_info({'name': 'test', 'lang': 'nl'})
+    model.update_duo_new_words_from_str(export('huis', 'kat', 'boek'))
+    model.close()
+    return lambda: Model(str(file), journal=request.param == 'journal', cache=False)
+
+
+def test_reload_merges_other_changes(open_model):
+    model, other = open_model(), open_model()
+    events = []
+    model.subscribe(events.append)
+    other.update_duo_new_words_from_str(export('fiets'))
+    other.link_duo_word_to_anki_word('huis', 'het huis')
+    assert not model.has_duo_word('fiets')
+    assert model.reload()
+    assert model.has_duo_word('fiets')
+    assert model.get_duo_words_from_anki_word('het huis') == ['huis']
+    assert any(event.kind == 'duo-added' and event.duo_word == 'fiets' for event in events)
+    assert not model.reload()
+    other.close()
+    model.close()
+
+
+def test_read_changes_then_merge(open_model):
+    model, other = open_model(), open_model()
+    other.update_duo_new_words_from_str(export('fiets'))
+    assert model.read_changes()
+    assert not model.has_duo_word('fiets')  # read, not merged yet
+    assert model.merge_changes()
+    assert model.has_duo_word('fiets')
+    assert not model.read_changes() and not model.merge_changes()
+    other.close()
+    model.close()
+
+
+def test_changes_read_twice_are_merged_in_order(open_model):
+    model, other = open_model(), open_model()
+    other.link_duo_word_to_anki_word('kat', 'de kat')
+    assert model.read_changes()
+    other.delete_duo_word('kat')
+    other.update_duo_new_words_from_str(export('kat'))
+    assert model.read_changes()
+    assert model.merge_changes()
+    assert model.has_duo_word('kat') and model.is_duo_word_unassigned('kat')
+    assert model.json == other.json
+    other.close()
+    model.close()
+
+
+def test_write_merges_changes_read(open_model):
+    model, other = open_model(), open_model()
+    other.link_duo_word_to_anki_word('huis', 'het huis')
+    other.delete_duo_word('kat')
+    assert model.read_changes()
+    model.link_duo_word_to_anki_word('kat', 'de kat')  # written over the change of the other model, which it merges first
+    assert model.get_anki_key_from_duo_word('huis') == model.get_anki_key_from_anki_word('het huis')
+    assert not model.merge_changes()
+    other.close()
+    model.close()
+    reopened = open_model()
+    assert reopened.get_duo_words_from_anki_word('het huis') == ['huis']
+    assert reopened.get_duo_words_from_anki_word('de kat') == ['kat']
+    reopened.close()
+
+
+def test_local_changes_win(open_model):
+    model, other = open_model(), open_model()
+    with model.batch():
+        model.link_duo_word_to_anki_word('boek', 'het boek')
+        other.link_duo_word_to_anki_word('boek', 'een boek')
+        assert model.read_changes() and model.merge_changes()
+        assert model.get_anki_key_from_duo_word('boek') == model.get_anki_key_from_anki_word('het boek')
+    other.close()
+    model.close()
+    reopened = open_model()
+    assert reopened.get_duo_words_from_anki_word('het boek') == ['boek']
+    reopened.close()
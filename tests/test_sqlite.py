@@ -0,0 +1,93 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from duo2anki.model import Model
+
+
+def export(*words: str) -> str:
+    return json.dumps({'vocab_overview': [{'word_string': word} for word in words]})
+
+
+@pytest.fixture
+def file(tmp_path: Path) -> Path:
+    file = tmp_path / 'db.sqlite'
+    model = Model(str(file))
+    model.update_model_info({'name': 'test', 'lang': 'nl'})
+    model.update_duo_new_words_from_str(export('huis', 'huizen', 'kat', 'katten', 'boek'))
+    model.link_many(['kat', 'katten'], 'de kat')
+    model.update_anki_entry('k1', 'het boek', '')
+    model.close()
+    return file
+
+
+@pytest.fixture
+def delayed(file):
+    '''A model whose changes stay unwritten until flushed.'''
+    model = Model(str(file), write_delay=60)
+    yield model
+    model.close()
+
+
+def searches(model: Model):
+    return (model.get_duo_words(), model.get_duo_words('k'), model.get_duo_words(unassigned_only=True),
+        model.get_duo_words('h', unassigned_only=True), model.get_anki_words(), model.get_anki_words('de'),
+        model.get_anki_words(no_translation_only=True))
+
+
+def test_searches_include_unwritten_records(file, delayed):
+    delayed.update_duo_new_words_from_str(export('fiets', 'kast'))
+    delayed.link_many(['huis', 'huizen'], 'het huis')
+    delayed.delete_duo_word('boek')
+    delayed.update_anki_entry(delayed.get_anki_key_from_anki_word('de kat'), 'de kat', 'the cat')
+    delayed.delete_anki_entry('k1')
+    assert delayed.get_duo_words('k') == ['kast', 'kat', 'katten']
+    assert delayed.get_duo_words(unassigned_only=True) == ['fiets', 'kast']
+    assert delayed.get_anki_words() == ['de kat', 'het huis']
+    assert delayed.get_anki_words(no_translation_only=True) == ['het huis']
+    unwritten = searches(delayed)
+
+    stored = Model(str(file))
+    assert stored.get_duo_words('k') == ['kat', 'katten', 'boek']   # not written yet
+    stored.close()
+
+    delayed.flush()
+    assert searches(delayed) == unwritten
+    reopened = Model(str(file))
+    assert searches(reopened) == unwritten
+    assert reopened.json == delayed.json
+    reopened.close()
+
+
+def test_unwritten_records_are_written_on_close(file, delayed):
+    delayed.link_many(['huis'], 'het huis')
+    delayed.set_anki_tags(delayed.get_anki_key_from_anki_word('het huis'), ['noun'])
+    expected = delayed.json
+    delayed.close()
+    reopened = Model(str(file))
+    assert reopened.json == expected
+    assert reopened.get_anki_words(tags=('noun',)) == ['het huis']
+    reopened.close()
+
+
+def test_unwritten_records_win_over_other_changes(file, delayed):
+    delayed.link_many(['huis'], 'het huis')
+    other = Model(str(file))
+    other.link_many(['huis'], 'huis')
+    other.update_duo_new_words_from_str(export('fiets'))
+    other.close()
+    assert delayed.reload()
+    assert delayed.has_duo_word('fiets')
+    assert delayed.get_anki_key_from_duo_word('huis') == delayed.get_anki_key_from_anki_word('het huis')
+    assert delayed.get_duo_words('f') == ['fiets']
+    delayed.flush()
+    reopened = Model(str(file))
+    assert reopened.json == delayed.json
+    reopened.close()
+
+
+def test_search_of_words_of_removed_card(file, delayed):
+    delayed.delete_anki_entry(delayed.get_anki_key_from_anki_word('de kat'))
+    assert delayed.get_duo_words('kat', unassigned_only=True) == ['kat', 'katten']
+    assert delayed.get_anki_words('de') == []
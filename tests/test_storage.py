@@ -0,0 +1,139 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from duo2anki.model import Model
+from duo2anki.storage import JsonStorage
+
+
+def empty():
+    return {'info': {'name': 'test', 'lang': 'nl'}, 'duo': {}, 'anki': {}, 'stamps': {}, 'tags': {}, 'exported': 0.0}
+
+
+RECORDS = [
+    ['duo', 'huis', None],
+    ['anki', 'k1', 'het huis', 'the house', 1.0],
+    ['duo', 'huis', 'k1'],
+    ['tags', 'k1', ['noun'], 2.0],
+    ['duo-', 'huis'],
+]
+
+
+@pytest.fixture
+def file(tmp_path: Path) -> Path:
+    file = tmp_path / 'db.json'
+    JsonStorage(file).create(empty())
+    return file
+
+
+def journal_of(file: Path) -> Path:
+    return Path(f'{file}.journal')
+
+
+def write(file: Path, records, journal: bool = True) -> JsonStorage:
+    storage = JsonStorage(file, journal)
+    storage.load()
+    storage.write(records, lambda: json.dumps(empty()))
+    return storage
+
+
+def test_journal_is_replayed_in_order(file):
+    write(file, RECORDS).close()
+    data, records = JsonStorage(file, True).load()
+    assert data == empty()
+    assert records == RECORDS
+
+
+def test_model_replays_journal(file):
+    model = Model(str(file), journal=True, cache=False)
+    model.update_duo_new_words_from_str(json.dumps({'vocab_overview': [{'word_string': word} for word in ('huis', 'huizen', 'boek')]}))
+    model.link_many(['huis', 'huizen'], 'het huis')
+    model.delete_duo_word('boek')
+    expected = model.json
+    model.close()
+    assert journal_of(file).exists()
+    assert json.loads(file.read_text()) == empty()
+
+    reopened = Model(str(file), journal=True, cache=False)
+    assert reopened.json == expected
+    assert reopened.get_duo_words_from_anki_word('het huis') == ['huis', 'huizen']
+    reopened.close()
+
+
+def test_truncated_last_record_is_dropped(file):
+    write(file, RECORDS).close()
+    lines = journal_of(file).read_bytes().splitlines(keepends=True)
+    complete = b''.join(lines[:-1])
+    journal_of(file).write_bytes(complete + lines[-1][:len(lines[-1]) // 2])
+
+    storage = JsonStorage(file, True)
+    _, records = storage.load()
+    assert records == RECORDS[:-1]
+    # the torn line is cut off, so that new records start on a line of their own
+    assert journal_of(file).read_bytes() == complete
+    storage.write([['duo', 'boek', None]], lambda: json.dumps(empty()))
+    storage.close()
+    assert JsonStorage(file, True).load()[1] == RECORDS[:-1] + [['duo', 'boek', None]]
+
+
+def test_truncation_at_any_byte_recovers_the_complete_records(file):
+    write(file, RECORDS).close()
+    journal = journal_of(file).read_bytes()
+    ends = [i + 1 for i, byte in enumerate(journal) if byte == ord('\n')]
+    for size in range(len(journal) + 1):
+        journal_of(file).write_bytes(journal[:size])
+        _, records = JsonStorage(file, True).load()
+        complete = sum(1 for end in ends if end <= size)
+        assert records == RECORDS[:complete], size
+        assert journal_of(file).stat().st_size == (ends[complete - 1] if complete else 0)
+
+
+def test_last_line_without_newline_is_torn(file):
+    write(file, RECORDS[:2]).close()
+    journal_of(file).write_bytes(journal_of(file).read_bytes().rstrip(b'\n'))
+    assert JsonStorage(file, True).load()[1] == RECORDS[:1]
+
+
+def test_changes_returns_only_new_records(file):
+    reader = JsonStorage(file, True)
+    reader.load()
+    writer = write(file, RECORDS[:2])
+    with reader.locked():
+        assert reader.changes() == RECORDS[:2]
+        assert reader.changes() == []
+    writer.write(RECORDS[2:], lambda: json.dumps(empty()))
+    with reader.locked():
+        assert reader.changes() == RECORDS[2:]
+    writer.compact(lambda: json.dumps(empty()))
+    with reader.locked():
+        assert reader.changes() is None     # the snapshot was replaced, load again
+    writer.close()
+    reader.close()
+
+
+def test_journal_is_compacted(file, monkeypatch):
+    monkeypatch.setattr(JsonStorage, 'COMPACT_EVERY', 3)
+    model = Model(str(file), journal=True, cache=False)
+    model.update_duo_new_words_from_str(json.dumps({'vocab_overview': [{'word_string': 'huis'}]}))
+    model.update_anki_entry('k1', 'het huis', 'the house')
+    assert journal_of(file).exists()
+    model.link_duo_word_to_anki_word('huis', 'het huis')
+    assert not journal_of(file).exists()
+    snapshot = json.loads(file.read_text())
+    assert snapshot['duo'] == {'huis': 'k1'}
+    assert snapshot['anki'] == {'k1': ['het huis', 'the house']}
+    model.close()
+
+
+def test_compact_folds_journal_into_snapshot(file):
+    model = Model(str(file), journal=True, cache=False)
+    model.update_anki_entry('k1', 'het huis', 'the house')
+    model.compact()
+    assert not journal_of(file).exists()
+    assert json.loads(file.read_text())['anki'] == {'k1': ['het huis', 'the house']}
+    model.update_anki_entry('k1', 'het huis', 'house')
+    model.close()
+    reopened = Model(str(file), journal=True, cache=False)
+    assert reopened.get_anki_entry('k1') == ('het huis', 'house')
+    reopened.close()